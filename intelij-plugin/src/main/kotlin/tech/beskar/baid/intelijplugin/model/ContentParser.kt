@@ -79,7 +79,12 @@ object ContentParser {
         }
         "code" -> {
             val language = blockObj.getString("language")
-            val content = decodeSafeJsonContent(blockObj.getString("content"))
+            // Blocks negotiated with X-Code-Encoding: json carry plain content
+            val content = if (blockObj.optString("encoding") == "json") {
+                blockObj.getString("content")
+            } else {
+                decodeSafeJsonContent(blockObj.getString("content"))
+            }
             val executable = blockObj.optBoolean("executable", false)
             Block.Code(language, content, executable)
         }
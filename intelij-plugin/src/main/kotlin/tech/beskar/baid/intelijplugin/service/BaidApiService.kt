@@ -79,6 +79,8 @@ class BaidAPIService private constructor() {
         val headers: MutableMap<String?, String?> = HashMap<String?, String?>()
         headers.put("Authorization", "Bearer $accessToken")
         headers.put("Content-Type", "application/json")
+        // Ask for plain JSON-escaped code blocks instead of base64
+        headers.put("X-Code-Encoding", "json")
 
         if (sessionId != null && !sessionId.isBlank()) {
             headers.put("session_id", sessionId)
@@ -134,58 +136,63 @@ class BaidAPIService private constructor() {
             // Process successful response
             connection.inputStream.use { inputStream ->
                 BufferedReader(InputStreamReader(inputStream)).use { reader ->
-                    var currentLine: String?
-                    var jsonBuffer = StringBuilder()
-                    var braceCount = 0
-                    var inJson = false
-                    while (reader.readLine().also { currentLine = it } != null) {
-                        // Skip lines that don't start with "data: "
-                        if (currentLine == null || !currentLine!!.startsWith("data: ")) {
-                            continue
+                    // Events are framed by blank lines; the data lines of one event are joined
+                    // with newlines. Braces are not counted: code in JSON strings may be unbalanced.
+                    val eventData = StringBuilder()
+
+                    fun dispatchEvent() {
+                        val jsonStr = eventData.toString()
+                        eventData.setLength(0)
+                        if (!jsonStr.startsWith("{")) {
+                            return
                         }
+                        try {
+                            val jsonObj = JSONObject(jsonStr)
+
+                            // Check for session ID update
+                            if (jsonObj.has("session_id")) {
+                                updatedSessionId[0] = jsonObj.optString("session_id", "")
+                            } else {
+                                // Process content block
+                                if (jsonObj.has("error")) {
+                                    throw Exception(jsonObj.getString("error"))
+                                }
+                                SwingUtilities.invokeLater { onStreamedBlock.accept(jsonObj) }
+                            }
+                        } catch (e: Exception) {
+                            LOG.error("Error parsing JSON response: $jsonStr", e)
+                        }
+                    }
 
-                        val data = currentLine!!.substring(6).trim { it <= ' ' }  // Remove "data: " prefix
+                    while (true) {
+                        val currentLine = reader.readLine() ?: break
 
-                        // Check for end of stream marker
-                        if ("[DONE]" == data) {
-                            break
+                        // A blank line ends the event
+                        if (currentLine.isEmpty()) {
+                            dispatchEvent()
+                            continue
                         }
 
-                        // Start or continue JSON object
-                        if (!inJson && data.startsWith("{")) {
-                            jsonBuffer = StringBuilder(data)
-                            braceCount = countBraces(data)
-                            inJson = true
-                        } else if (inJson) {
-                            jsonBuffer.append(data)
-                            braceCount += countBraces(data)
+                        // Skip fields other than data (comments, event, id)
+                        if (!currentLine.startsWith("data:")) {
+                            continue
                         }
 
-                        // If we have a complete JSON object
-                        if (inJson && braceCount == 0) {
-                            val jsonStr = jsonBuffer.toString()
-                            try {
-                                val jsonObj = JSONObject(jsonStr)
-
-                                // Check for session ID update
-                                if (jsonObj.has("session_id")) {
-                                    updatedSessionId[0] = jsonObj.optString("session_id", "")
-                                } else {
-                                    // Process content block
-                                    if (jsonObj.has("error")) {
-                                        throw Exception(jsonObj.getString("error"))
-                                    }
-                                    SwingUtilities.invokeLater { onStreamedBlock.accept(jsonObj) }
-                                }
-                            } catch (e: Exception) {
-                                LOG.error("Error parsing JSON response: $jsonStr", e)
-                            }
+                        val data = currentLine.substring(5).trim { it <= ' ' }  // Remove "data:" prefix
+
+                        // Check for end of stream marker
+                        if (eventData.isEmpty() && "[DONE]" == data) {
+                            break
+                        }
 
-                            // Reset for next JSON object
-                            inJson = false
-                            jsonBuffer = StringBuilder()
+                        if (eventData.isNotEmpty()) {
+                            eventData.append('\n')
                         }
+                        eventData.append(data)
                     }
+
+                    // A stream closed without a trailing blank line still delivers its last event
+                    dispatchEvent()
                 }
             }
 
@@ -209,15 +216,6 @@ class BaidAPIService private constructor() {
         }
     }
 
-    private fun countBraces(text: String): Int {
-        var count = 0
-        for (c in text.toCharArray()) {
-            if (c == '{') count++
-            else if (c == '}') count--
-        }
-        return count
-    }
-
     fun fetchUserSessions(
         userId: String?,
         accessToken: String?,
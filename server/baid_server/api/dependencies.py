@@ -1,3 +1,4 @@
+import hmac
 import logging
 import os
 from typing import Dict, Any
@@ -25,3 +26,12 @@ async def get_current_user(
     except Exception as e:
         logger.error(f"JWT decode failed: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+
+async def verify_metrics_token(
+    token: HTTPAuthorizationCredentials = Depends(bearer_scheme)
+) -> None:
+    """Scrapers authenticate with the METRICS_TOKEN bearer token; without one set, nobody can."""
+    expected = settings.METRICS_TOKEN.get_secret_value() if settings.METRICS_TOKEN else ""
+    if not expected or not hmac.compare_digest(token.credentials.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
@@ -6,11 +6,23 @@ from fastapi import APIRouter, Request, Header, HTTPException, Depends
 from fastapi.responses import StreamingResponse
 
 from baid_server.api.dependencies import get_current_user
+from baid_server.db.database import get_db_pool
+from baid_server.db.repositories.user_repository import UserRepository
+from baid_server.services.answer_cache import wants_answer_cache
 from baid_server.services.service_factory import ServiceFactory
+from baid_server.services.stream_registry import STREAM_ID_HEADER, StreamRegistry
+from baid_server.services.upstream_scheduler import SchedulerRejected
+from baid_server.utils.stream_options import StreamOptions
 
 router = APIRouter(prefix="/api", tags=["agent"])
 logger = logging.getLogger(__name__)
 
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',
+}
+
 @router.post("/consult")
 async def consult(
         request: Request,
@@ -28,21 +40,81 @@ async def consult(
         logger.error(f"[{request_id}] Failed to parse request body: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid request body")
 
+    try:
+        stream_options = StreamOptions.negotiate(request.headers, request.query_params)
+    except ValueError as e:
+        logger.warning(f"[{request_id}] Rejected stream negotiation: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
     user_input = data.get("prompt", "")
     context = data.get("context", {})
-    
+
+    # Cached answers are shared within a tenant
+    agent_service = ServiceFactory.get_agent_service()
+    use_answer_cache = agent_service.answer_cache is not None and \
+        wants_answer_cache(request.headers, request.query_params)
+    scheduler = ServiceFactory.get_upstream_scheduler()
+    tenant_id = None
+    if use_answer_cache or scheduler is not None:
+        tenant_id = await UserRepository(db_pool=await get_db_pool()).get_user_tenant_id(user_id)
+
+    # Queue for an upstream slot, or shed load before anything is streamed
+    ticket = None
+    if scheduler is not None:
+        try:
+            ticket = scheduler.submit(scheduler.tenant_key(tenant_id, user_id), user_id)
+        except SchedulerRejected as e:
+            logger.warning(f"[{request_id}] Rejected by upstream scheduler: {str(e)}")
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    response_stream = agent_service.process_query(
+        user_id=user_id,
+        session_id=session_id,
+        user_input=user_input,
+        context=context,
+        stream_options=stream_options,
+        use_answer_cache=use_answer_cache,
+        tenant_id=tenant_id
+    )
+    if ticket is not None:
+        response_stream = scheduler.stream(ticket, response_stream)
+    headers = {**SSE_HEADERS, **stream_options.response_headers()}
+
+    # Run the query independently of this connection so a dropped client can resume
+    stream_registry = ServiceFactory.initialize_stream_registry()
+    if stream_registry is not None:
+        stream = stream_registry.start(user_id, response_stream)
+        headers[STREAM_ID_HEADER] = stream.stream_id
+        response_stream = StreamRegistry.events(stream)
+
     # Return streaming response
     return StreamingResponse(
-        ServiceFactory.get_agent_service().process_query(
-            user_id=user_id,
-            session_id=session_id,
-            user_input=user_input,
-            context=context
-        ),
+        response_stream,
+        media_type="text/event-stream",
+        headers=headers
+    )
+
+
+@router.get("/consult/streams/{stream_id}")
+async def resume_consult(
+        stream_id: str,
+        current_user: Dict[str, Any] = Depends(get_current_user),
+        last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Resume an interrupted /consult stream after the last event the client received."""
+    stream_registry = ServiceFactory.initialize_stream_registry()
+    stream = stream_registry.get(stream_id, current_user["sub"]) if stream_registry else None
+    if stream is None:
+        raise HTTPException(status_code=404, detail=f"Stream {stream_id} not found or expired")
+
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an integer")
+
+    logger.info(f"Resuming stream {stream_id} after event {last_event_id}")
+    return StreamingResponse(
+        StreamRegistry.events(stream, last_event_id),
         media_type="text/event-stream",
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no',
-        }
+        headers={**SSE_HEADERS, STREAM_ID_HEADER: stream_id}
     )
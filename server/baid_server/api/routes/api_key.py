@@ -1,6 +1,5 @@
 import logging
 import os
-import secrets
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
 from uuid import UUID
@@ -12,6 +11,7 @@ from baid_server.api.dependencies import get_current_user
 from baid_server.db.database import get_db_pool
 from baid_server.db.repositories.user_repository import UserRepository
 from baid_server.models.api_key import ApiKeyCreate, ApiKeyResponse
+from baid_server.utils.api_keys import generate_api_key
 
 router = APIRouter(prefix="/api/keys", tags=["api_keys"])
 logger = logging.getLogger(__name__)
@@ -32,8 +32,7 @@ async def create_api_key(
     user_id = current_user["sub"]
     
     # Generate a new API key with a prefix
-    key_prefix = "baid_"
-    api_key = f"{key_prefix}{secrets.token_hex(24)}"
+    api_key = generate_api_key()
     
     try:
         # Store the API key
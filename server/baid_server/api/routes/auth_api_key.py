@@ -29,8 +29,6 @@ async def authenticate_with_api_key(
     """
     try:
         # Validate API key and get user info
-        print("api key")
-        print(api_key)
         user_info = await user_repository.validate_api_key(api_key)
 
         if not user_info:
@@ -52,6 +50,8 @@ async def authenticate_with_api_key(
             "name": user_info["name"]
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"API key authentication error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Authentication failed: {str(e)}")
\ No newline at end of file
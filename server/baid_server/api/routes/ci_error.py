@@ -2,73 +2,86 @@ import logging
 import os
 from typing import Dict, Any, Optional
 
-from fastapi import APIRouter, Depends, Header
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.responses import StreamingResponse
 from baid_server.api.dependencies import get_current_user
+from baid_server.db.database import get_db_pool
+from baid_server.db.repositories.user_repository import UserRepository
 from baid_server.models.ci_error import CIErrorRequest
-from baid_server.prompts.format import CI_RESPONSE_FORMAT
+from baid_server.services.ci_analysis_cache import fingerprint_ci_request
 from baid_server.services.service_factory import ServiceFactory
+from baid_server.services.upstream_scheduler import SchedulerRejected, UpstreamScheduler
 
 router = APIRouter(tags=["ci"])
 logger = logging.getLogger(__name__)
 
 AGENT_RESOURCE_NAME = "projects/742371152853/locations/us-central1/reasoningEngines/7827476054695477248"
 
+
+async def get_user_repository():
+    return UserRepository(db_pool=await get_db_pool())
+
+
 @router.post("/api/ci/analyze")
 async def analyze_ci_error(
         request: CIErrorRequest,
         current_user: Dict[str, Any] = Depends(get_current_user),
-        session_id: Optional[str] = Header(None, alias="session_id")
+        session_id: Optional[str] = Header(None, alias="session_id"),
+        user_repository: UserRepository = Depends(get_user_repository)
 ):
     request_id = os.urandom(4).hex()
     logger.info(f"[{request_id}] === Starting CI error analysis request ===")
     user_id = current_user["sub"]
-    prompt = f"""
-You are a CI error analyzer.
- I'm facing an error in my CI pipeline. Please help me fix it.
-
-## Command
-```
-{request.command}
-```
-
-## Standard Output
-```
-{request.stdout}
-```
-
-## Error Output
-```
-{request.stderr}
-```
-
-Please analyze this error and provide a solution. Focus on the specific issue in the CI pipeline and be very actionable.
-Your response should include:
-1. A clear explanation of what went wrong
-2. A brief explanation of the error
-3. A probable fix
-Focus on being practical and specific with your solution.
-
-Make sure your response is in the following JSON format:
-{CI_RESPONSE_FORMAT}
-
-Stream your response as a series of rfc8259 JSON format only. Do not include any other characters or formatting. Each chunk should be a valid JSON object.
-"""
+    prompt = ServiceFactory.get_prompt_builder().ci_analysis_message(
+        session_id=session_id,
+        command=request.command,
+        stdout=request.stdout,
+        stderr=request.stderr
+    )
     try:
         # Get the CI Error Service
         ci_error_service = await ServiceFactory.initialize_ci_error_service()
-        
-        # Create a streaming response using the CI Error Service
-        response_stream = ci_error_service.analyze_error(
-            prompt=prompt,
-            user_id=user_id,
-            session_id=session_id,
-            request_id=request_id
+        scheduler = ServiceFactory.get_upstream_scheduler()
+        tenant_id = await user_repository.get_user_tenant_id(user_id)
+
+        def start_analysis():
+            # Create a streaming response using the CI Error Service
+            analysis = ci_error_service.analyze_error(
+                prompt=prompt,
+                user_id=user_id,
+                session_id=session_id,
+                request_id=request_id
+            )
+            if scheduler is None:
+                return analysis
+            # Only analyses that actually call the agent engine take an upstream slot
+            ticket = scheduler.submit(scheduler.tenant_key(tenant_id, user_id), user_id)
+            return scheduler.stream(ticket, analysis)
+
+        # Follow-ups in an existing session depend on its history and are never shared
+        coalescer = await ServiceFactory.initialize_ci_analysis_coalescer()
+        if coalescer is None or session_id:
+            return StreamingResponse(start_analysis(), media_type="text/event-stream")
+
+        # Identical failures within a tenant share one upstream analysis; users without a tenant
+        # only share with themselves, since the analysis quotes their own output
+        cache_status, response_stream = await coalescer.open(
+            namespace=f"ci:{UpstreamScheduler.tenant_key(tenant_id, user_id)}",
+            fingerprint=fingerprint_ci_request(request),
+            start_stream=start_analysis
         )
-        
+        logger.info(f"[{request_id}] CI analysis cache status: {cache_status}")
+
         # Return the streaming response
-        return StreamingResponse(response_stream, media_type="text/event-stream")
+        return StreamingResponse(
+            response_stream,
+            media_type="text/event-stream",
+            headers={"X-Cache-Status": cache_status}
+        )
         
+    except SchedulerRejected as e:
+        logger.warning(f"[{request_id}] Rejected by upstream scheduler: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"[{request_id}] Error in CI error analysis: {str(e)}", exc_info=True)
         error_msg = str(e)
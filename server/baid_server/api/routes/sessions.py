@@ -1,14 +1,18 @@
 """Session management routes."""
+import json
 import logging
-from typing import Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 
 from baid_server.api.dependencies import get_current_user
+from baid_server.config import settings
 from baid_server.db.database import get_db_pool
 from baid_server.db.repositories.message_repository import MessageRepository
 from baid_server.db.repositories.session_repository import SessionRepository
-from baid_server.services.service_factory import ServiceFactory
+from baid_server.utils.pagination import decode_cursor, encode_cursor
 
 router = APIRouter(tags=["sessions"])
 logger = logging.getLogger(__name__)
@@ -34,29 +38,73 @@ async def get_user_sessions(user_id: str, current_user: Dict[str, Any] = Depends
     return {"user_id": user_id, "sessions": sessions}
 
 
+def parse_history_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/history/{user_id}/{session_id}")
 async def get_session_history(
     user_id: str, 
     session_id: str, 
     current_user: Dict[str, Any] = Depends(get_current_user),
-    message_repository: MessageRepository = Depends(get_message_repository)
+    message_repository: MessageRepository = Depends(get_message_repository),
+    limit: Optional[int] = Query(None, ge=1, le=settings.HISTORY_PAGE_MAX_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page")
 ):
     # Verify the user is requesting their own history or is an admin
     if current_user["sub"] != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to view this history")
+    after = parse_history_cursor(cursor)
     
-    history = await message_repository.get_session_history(user_id, session_id)
+    # Fetch one extra row to know whether another page follows
+    history = await message_repository.get_session_history(
+        user_id, session_id, limit=limit + 1 if limit else None, after=after
+    )
+    has_more = limit is not None and len(history) > limit
+    history = history[:limit]
     
-    if not history:
+    if not history and after is None:
         raise HTTPException(status_code=404, detail=f"No history found for session {session_id}")
 
+    next_cursor = None
+    if has_more:
+        last = history[-1]
+        next_cursor = encode_cursor(datetime.fromisoformat(last["timestamp"]), last["id"])
+
     return {
         "user_id": user_id,
         "session_id": session_id,
-        "history": history
+        "history": history,
+        "has_more": has_more,
+        "next_cursor": next_cursor
     }
 
 
+@router.get("/history/{user_id}/{session_id}/stream")
+async def stream_session_history(
+    user_id: str,
+    session_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    message_repository: MessageRepository = Depends(get_message_repository),
+    cursor: Optional[str] = Query(None, description="Resume after this position")
+):
+    """Stream the whole history as NDJSON, one message per line, without buffering it."""
+    if current_user["sub"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this history")
+    after = parse_history_cursor(cursor)
+
+    async def ndjson():
+        async for entry in message_repository.iter_session_history(user_id, session_id, after=after):
+            yield json.dumps(entry) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 @router.delete("/sessions/{user_id}/{session_id}")
 async def delete_session(
     user_id: str, 
@@ -69,10 +117,8 @@ async def delete_session(
         raise HTTPException(status_code=403, detail="Not authorized to delete this session")
     
     try:
-        # Delete from ADK
-        ServiceFactory.get_agent_service().delete_session(user_id, session_id)
-        
-        # Delete from database
+        # Delete from database; the ADK sessions, including the agent session a long
+        # session was rotated to, are deleted by the remote-session-deletions task
         await session_repository.delete_session(user_id, session_id)
         
         return {"message": f"Session {session_id} for user {user_id} deleted successfully"}
@@ -80,3 +126,41 @@ async def delete_session(
     except Exception as e:
         logger.error(f"Error deleting session: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting session: {str(e)}")
+
+
+async def purge_sessions(session_repository: SessionRepository, **filters) -> None:
+    """Run a bulk deletion after the response has been sent."""
+    try:
+        deleted = await session_repository.delete_sessions(
+            batch_size=settings.SESSION_PURGE_BATCH_SIZE,
+            max_passes=settings.SESSION_PURGE_MAX_PASSES,
+            retry_delay=settings.SESSION_PURGE_RETRY_DELAY,
+            **filters
+        )
+        logger.info(f"Purged {deleted} sessions ({filters})")
+    except Exception as e:
+        logger.error(f"Error purging sessions ({filters}): {str(e)}")
+
+
+def inactive_before(older_than_days: Optional[int]) -> Optional[datetime]:
+    if older_than_days is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(days=older_than_days)
+
+
+@router.delete("/sessions/{user_id}", status_code=202)
+async def delete_user_sessions(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    session_repository: SessionRepository = Depends(get_session_repository),
+    older_than_days: Optional[int] = Query(None, ge=1, description="Only sessions unused for this many days")
+):
+    """Delete all of a user's sessions, or those unused for ``older_than_days``, in the background."""
+    if current_user["sub"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to delete these sessions")
+
+    background_tasks.add_task(
+        purge_sessions, session_repository, user_id=user_id, inactive_before=inactive_before(older_than_days)
+    )
+    return {"message": f"Deletion of the sessions of user {user_id} has been scheduled"}
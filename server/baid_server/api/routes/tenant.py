@@ -2,14 +2,17 @@
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
 from pydantic import BaseModel
 
 from baid_server.api.dependencies import get_current_user
+from baid_server.api.routes.sessions import get_session_repository, inactive_before, purge_sessions
+from baid_server.db.repositories.session_repository import SessionRepository
 from baid_server.db.repositories.tenant_repository import TenantRepository
 from baid_server.db.repositories.user_repository import UserRepository
 from baid_server.models.tenant import TenantCreate, TenantResponse
 from baid_server.models.user import UserInfo
+from baid_server.services.service_factory import ServiceFactory
 
 router = APIRouter(prefix="/api/tenants", tags=["tenants"])
 
@@ -80,3 +83,39 @@ async def get_tenant_users(
     """Get a tenant by ID."""
     users = await user_repository.get_users_by_tenant(tenant_id)
     return [UserInfo(**user) for user in users]
+
+
+@router.delete("/{tenant_id}/answer-cache")
+async def invalidate_answer_cache(
+    tenant_id: UUID,
+    current_user: dict = Depends(get_current_user)
+):
+    """Drop every cached /consult answer for a tenant."""
+    if not current_user.get("admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can invalidate the answer cache of a tenant",
+        )
+    answer_cache = ServiceFactory.initialize_answer_cache()
+    removed = await answer_cache.invalidate(tenant_id) if answer_cache else 0
+    return {"tenant_id": str(tenant_id), "removed": removed}
+
+
+@router.delete("/{tenant_id}/sessions", status_code=status.HTTP_202_ACCEPTED)
+async def delete_tenant_sessions(
+    tenant_id: UUID,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user),
+    session_repository: SessionRepository = Depends(get_session_repository),
+    older_than_days: Optional[int] = Query(None, ge=1, description="Only sessions unused for this many days"),
+):
+    """Delete the sessions of every user of a tenant in the background."""
+    if not current_user.get("admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can delete the sessions of a tenant",
+        )
+    background_tasks.add_task(
+        purge_sessions, session_repository, tenant_id=tenant_id, inactive_before=inactive_before(older_than_days)
+    )
+    return {"tenant_id": str(tenant_id), "message": "Deletion of the tenant's sessions has been scheduled"}
@@ -1,36 +1,23 @@
 """User management routes."""
 import logging
 import os
-import re
-from typing import Dict, List, Any
+from typing import Dict, Iterator, List, Any, Optional
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from jinja2 import Environment, FileSystemLoader
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from baid_server.api.dependencies import get_current_user
-from baid_server.db.repositories.user_repository import UserRepository
+from baid_server.config import settings
+from baid_server.db.repositories.user_repository import DASHBOARD_SORT_COLUMNS, USERS_SCOPE, UserRepository
 from baid_server.db.repositories.message_repository import MessageRepository
-from baid_server.db.database import get_db_pool
+from baid_server.db.repositories.user_limit_repository import ALL_USERS, UserLimitRepository
+from baid_server.db.database import get_db_pool, mark_written
 
 
 logger = logging.getLogger(__name__)
 
 
-def estimate_tokens(text: str) -> int:
-    """Estimate the number of tokens in a text string.
-    
-    This is a simple approximation based on common tokenization patterns.
-    For more accurate counts, you would use a tokenizer like tiktoken or GPT-2 tokenizer.
-    """
-    # Split by whitespace for words
-    words = text.split()
-    # Count punctuation and special characters
-    punctuation = len(re.findall(r'[.,!?;:()\[\]{}\'\"-]', text))
-    # Estimate: roughly 1.3 tokens per word for English text
-    return int(len(words) * 1.3) + punctuation
-
-
 def format_relative_time(timestamp: datetime) -> str:
     """Format a timestamp as a relative time string (e.g., '5 minutes ago')."""
     if not timestamp:
@@ -65,6 +52,14 @@ def format_relative_time(timestamp: datetime) -> str:
         return f'{int(years)} years ago'
 
 
+# Templates are compiled once per process; compiled bytecode also survives restarts
+templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'templates')),
+    bytecode_cache=FileSystemBytecodeCache(settings.TEMPLATE_CACHE_DIR) if settings.TEMPLATE_CACHE_DIR else FileSystemBytecodeCache(),
+    # Only check templates for changes while developing
+    auto_reload=settings.ENVIRONMENT in ("local", "development"),
+)
+
 # Create router
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -114,6 +109,8 @@ async def update_user_status(request: Request):
                 """,
                 user_id, status
             )
+            await UserLimitRepository.notify_changed(conn, user_id)
+        mark_written(USERS_SCOPE)
         
         logger.info(f"Updated status for user {user_id} to {status}")
         return {"success": True, "message": f"User status updated to {status}"}
@@ -171,6 +168,8 @@ async def update_token_limit(request: Request):
                 """,
                 user_id, str(token_limit)
             )
+            await UserLimitRepository.notify_changed(conn, user_id)
+        mark_written(USERS_SCOPE)
         
         logger.info(f"Updated token limit for user {user_id} to {token_limit}")
         return {"success": True, "message": f"Token limit updated to {token_limit}"}
@@ -216,6 +215,8 @@ async def update_default_token_limit(request: Request):
                 """,
                 str(token_limit)
             )
+            await UserLimitRepository.notify_changed(conn, ALL_USERS)
+        mark_written(USERS_SCOPE)
         
         logger.info(f"Updated default token limit for new users to {token_limit}")
         return {"success": True, "message": f"Default token limit updated to {token_limit}"}
@@ -229,108 +230,90 @@ async def update_default_token_limit(request: Request):
 
 
 @router.get("/dashboard", response_class=HTMLResponse)
-async def get_users_dashboard():
-    """Get a dashboard showing all users with message counts, token counts, and actions."""
+async def get_users_dashboard(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    sort: str = Query("created_at", pattern="^(" + "|".join(DASHBOARD_SORT_COLUMNS) + ")$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+):
+    """Get a dashboard showing a page of users with message counts, token counts, and actions."""
     try:
-        # Get database connection
-        pool = await get_db_pool()
-        
-        # Get global default token limit
-        async with pool.acquire() as conn:
-            # Get default token limit
-            default_limit_row = await conn.fetchrow("""
-                SELECT setting_value, updated_at FROM global_settings 
-                WHERE setting_key = 'default_token_limit'
-            """)
-            
-            default_token_limit = int(default_limit_row["setting_value"]) if default_limit_row else 100000
-            
-            # Set the default token limit value for the UI
-            default_token_limit_updated = default_limit_row["updated_at"] if default_limit_row else None
-            
-            # First get all users with message count and last active time
-            users = await conn.fetch("""
-                SELECT u.id, u.email, u.name, u.picture, u.created_at,
-                       COUNT(m.id) as message_count,
-                       MAX(m.timestamp) as last_active
-                FROM users u
-                LEFT JOIN messages m ON u.email = m.user_id
-                GROUP BY u.id, u.email, u.name, u.picture, u.created_at
-                ORDER BY u.created_at DESC
-            """)
-            
-            # Format the results
-            users_data = []
-            
-            # For each user, get their messages to calculate token counts
-            for user in users:
-                user_id = user["email"]
-                
-                # Get all messages for this user
-                messages = await conn.fetch("""
-                    SELECT content FROM messages WHERE user_id = $1
-                """, user_id)
-                
-                # Calculate token count
-                token_count = 0
-                for msg in messages:
-                    token_count += estimate_tokens(msg["content"])
-                
-                # Get user-specific token limit if it exists
-                user_limit_row = await conn.fetchrow("""
-                    SELECT setting_value FROM user_settings 
-                    WHERE user_id = $1 AND setting_key = 'token_limit'
-                """, user_id)
-                
-                token_limit = int(user_limit_row["setting_value"]) if user_limit_row else default_token_limit
-                
-                # Get user status
-                status_row = await conn.fetchrow("""
-                    SELECT status FROM user_status WHERE user_id = $1
-                """, user_id)
-                
-                status = status_row["status"] if status_row else "active"
-                
-                # Format the last active time as a relative time string
-                last_active_relative = format_relative_time(user["last_active"]) if user["last_active"] else 'Never'
-                
-                users_data.append({
-                    "id": user["id"],
-                    "email": user["email"],
-                    "name": user["name"],
-                    "picture": user["picture"],
-                    "created_at": user["created_at"].isoformat() if user["created_at"] else None,
-                    "last_active": user["last_active"].isoformat() if user["last_active"] else None,
-                    "last_active_relative": last_active_relative,
-                    "message_count": user["message_count"],
-                    "token_count": token_count,
-                    "token_limit": token_limit,
-                    "token_percentage": min(round((token_count / token_limit) * 100), 100) if token_limit > 0 else 0,
-                    "status": status
-                })
-            
-            logger.info(f"Retrieved {len(users_data)} users for dashboard")
-        
-        # Generate HTML response
-        html_content = generate_users_html(users_data, default_token_limit)
-        return HTMLResponse(content=html_content)
+        dashboard = await UserRepository().get_dashboard_page(
+            limit=page_size,
+            offset=(page - 1) * page_size,
+            sort=sort,
+            descending=order == "desc",
+        )
+
+        # Format the results
+        users_data = []
+        for user in dashboard["users"]:
+            token_count = user["token_count"]
+            token_limit = user["token_limit"]
+
+            # Format the last active time as a relative time string
+            last_active_relative = format_relative_time(user["last_active"]) if user["last_active"] else 'Never'
+
+            users_data.append({
+                "id": user["id"],
+                "email": user["email"],
+                "name": user["name"],
+                "picture": user["picture"],
+                "created_at": user["created_at"].isoformat() if user["created_at"] else None,
+                "last_active": user["last_active"].isoformat() if user["last_active"] else None,
+                "last_active_relative": last_active_relative,
+                "message_count": user["message_count"],
+                "token_count": token_count,
+                "token_limit": token_limit,
+                "token_percentage": min(round((token_count / token_limit) * 100), 100) if token_limit > 0 else 0,
+                "status": user["status"]
+            })
+
+        logger.info(f"Retrieved {len(users_data)} of {dashboard['total']} users for dashboard")
+
+        pagination = {
+            "page": page,
+            "page_size": page_size,
+            "total": dashboard["total"],
+            "pages": max(1, -(-dashboard["total"] // page_size)),
+            "sort": sort,
+            "order": order,
+        }
+
+        # Stream the HTML as it renders
+        return StreamingResponse(
+            stream_users_html(users_data, dashboard["default_token_limit"], pagination),
+            media_type="text/html"
+        )
     
     except Exception as e:
         logger.error(f"Error fetching users dashboard: {str(e)}")
         return HTMLResponse(content=f"<h1>Error</h1><p>{str(e)}</p>", status_code=500)
 
 
-def generate_users_html(users: List[Dict[str, Any]], default_token_limit: int = 100000) -> str:
-    """Generate HTML for the users dashboard using Jinja2 template."""
-    # Set up Jinja2 environment
-    templates_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'templates')
-    env = Environment(loader=FileSystemLoader(templates_dir))
-    template = env.get_template('users/dashboard.html')
-    
-    # Render the template with the provided data
-    html = template.render(
+def _buffered(chunks: Iterator[str], size: int = 16384) -> Iterator[str]:
+    """Join the many small chunks Jinja yields into writes of about ``size`` characters."""
+    buffer: List[str] = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_users_html(
+    users: List[Dict[str, Any]],
+    default_token_limit: int = 100000,
+    pagination: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    """Render the users dashboard progressively."""
+    template = templates.get_template('users/dashboard.html')
+    return _buffered(template.generate(
         users=users,
-        default_token_limit=default_token_limit
-    )
-    
-    return html
+        default_token_limit=default_token_limit,
+        pagination=pagination
+    ))
@@ -50,10 +50,122 @@ class Settings(BaseSettings):
     JWT_SECRET: Optional[str] = None
     GCS_SYNC_BUCKET: str = "baid-sync-storage"
 
+    # Write-behind message persistence
+    MESSAGE_SINK_ENABLED: bool = True
+    MESSAGE_SINK_MAX_QUEUE_SIZE: int = 1000
+    MESSAGE_SINK_BATCH_SIZE: int = 100
+    MESSAGE_SINK_FLUSH_INTERVAL: float = 0.5  # seconds
+
+    # Session mapping cache
+    SESSION_CACHE_MAX_SIZE: int = 10000
+    SESSION_CACHE_TTL: float = 300.0  # seconds
+    SESSION_TOUCH_FLUSH_INTERVAL: float = 30.0  # seconds
+
+    # CI analysis coalescing and caching
+    CI_ANALYSIS_CACHE_ENABLED: bool = True
+    CI_ANALYSIS_CACHE_BACKEND: str = "memory"  # "memory" or "postgres"
+    CI_ANALYSIS_CACHE_TTL: float = 3600.0  # seconds
+    CI_ANALYSIS_CACHE_MAX_SIZE: int = 1000
+    RESPONSE_CACHE_PURGE_INTERVAL: float = 300.0  # seconds
+
+    # /consult answer cache (clients must also opt in per request)
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_BACKEND: str = "memory"  # "memory" or "postgres"
+    ANSWER_CACHE_TTL: float = 86400.0  # seconds
+    ANSWER_CACHE_MAX_SIZE: int = 5000
+
+    # Resumable /consult streams
+    STREAM_RESUME_ENABLED: bool = True
+    STREAM_RESUME_TTL: float = 120.0  # seconds a finished stream stays replayable
+    STREAM_RESUME_MAX_STREAMS: int = 1000
+
+    # Agent engine retries, shared by all agent services
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 1.0  # seconds
+    RETRY_MAX_DELAY: float = 10.0  # seconds
+    RETRY_BUDGET_RATIO: float = 0.2  # retries allowed per request in steady state
+    RETRY_BUDGET_MAX_TOKENS: float = 10.0
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = 30.0  # seconds
+
+    # Upstream scheduler for agent engine calls (per server instance)
+    UPSTREAM_SCHEDULER_ENABLED: bool = True
+    UPSTREAM_MAX_CONCURRENCY: int = 16
+    UPSTREAM_PER_TENANT_LIMIT: int = 8
+    UPSTREAM_PER_USER_LIMIT: int = 2
+    UPSTREAM_MAX_QUEUE_DEPTH: int = 64
+    UPSTREAM_MAX_TENANT_QUEUE_DEPTH: int = 16
+    UPSTREAM_QUEUE_TIMEOUT: float = 30.0  # seconds
+    UPSTREAM_TENANT_WEIGHTS: str = ""  # "tenant_id=2,other_tenant_id=0.5"
+
+    # Static prompt instructions: "every_turn", "session" (once per agent session)
+    # or "deployed" (part of the deployed agent's instruction)
+    PROMPT_INSTRUCTIONS_MODE: str = "session"
+
+    # Conversation history management
+    HISTORY_MANAGEMENT_ENABLED: bool = True
+    HISTORY_AGENT_SESSION_TOKEN_BUDGET: int = 32000  # rotate the agent session beyond this
+    HISTORY_WINDOW_TOKENS: int = 4000  # recent turns carried into a rotated session
+    HISTORY_SUMMARY_TOKENS: int = 1000  # rolling summary of older turns
+    HISTORY_PAGE_MAX_SIZE: int = 500
+
+    # Per-user token usage counters
+    TOKEN_USAGE_CACHE_TTL: float = 5.0  # seconds
+    TOKEN_USAGE_RECONCILE_INTERVAL: float = 3600.0  # seconds
+    TOKEN_USAGE_RECONCILE_QUIET_PERIOD: float = 300.0  # seconds without new messages
+    TOKEN_USAGE_RECONCILE_BATCH_SIZE: int = 500
+
+    # API key validation cache and batched last_used_at updates
+    API_KEY_CACHE_TTL: float = 60.0  # seconds a deleted key may stay valid on other instances
+    API_KEY_CACHE_MAX_SIZE: int = 10000
+    API_KEY_USAGE_FLUSH_INTERVAL: float = 60.0  # seconds
+
+    # Bulk session deletion; agent engine sessions are deleted by a background task
+    SESSION_PURGE_BATCH_SIZE: int = 100  # sessions per transaction
+    SESSION_PURGE_LOCK_TIMEOUT: float = 2.0  # seconds a batch may wait for a lock
+    SESSION_PURGE_MAX_PASSES: int = 5  # passes retrying sessions skipped because they were in use
+    SESSION_PURGE_RETRY_DELAY: float = 5.0  # seconds between passes
+    REMOTE_SESSION_DELETION_INTERVAL: float = 10.0  # seconds
+    REMOTE_SESSION_DELETION_BATCH_SIZE: int = 50
+    REMOTE_SESSION_DELETION_MAX_ATTEMPTS: int = 8
+
+    # Monthly partitions of the messages table
+    MESSAGE_PARTITIONS_AHEAD: int = 3  # months of partitions created in advance
+    MESSAGE_RETENTION_DAYS: Optional[int] = None  # drop months older than this; None keeps everything
+    MESSAGE_PARTITION_MAINTENANCE_INTERVAL: float = 21600.0  # seconds
+    # "heuristic", or "vertex:<model>" for the model's local tokenizer (needs sentencepiece)
+    TOKENIZER: str = "heuristic"
+    TOKEN_COUNT_MEMO_SIZE: int = 50000  # memoized counts of long texts, by content hash
+
+    # Per-user limit cache, invalidated across instances by LISTEN/NOTIFY
+    USER_LIMITS_CACHE_TTL: float = 60.0  # seconds, bounds staleness if a notification is lost
+    USER_LIMITS_LISTEN_INTERVAL: float = 30.0  # seconds between listener reconnect checks
+
+    # Database connection pool, per worker process
+    WEB_CONCURRENCY: int = 1  # uvicorn workers per instance (uvicorn reads the same variable)
+    DB_MAX_CONNECTIONS: int = 20  # connections one instance may open, split across its workers
+    DB_POOL_MAX_SIZE: Optional[int] = None  # overrides the split of DB_MAX_CONNECTIONS
+    DB_POOL_MIN_SIZE: int = 2
+    DB_POOL_MAX_INACTIVE_LIFETIME: float = 300.0  # seconds before idle connections are closed
+    DB_STATEMENT_CACHE_SIZE: int = 200  # 0 behind a transaction-pooling proxy such as PgBouncer
+    DB_COMMAND_TIMEOUT: Optional[float] = 60.0  # seconds
+
+    # Optional read replica for read-only repository methods (same pool sizing)
+    DB_REPLICA_CONNECTION_SECRET: Optional[str] = None
+    DB_READ_YOUR_WRITES_WINDOW: float = 5.0  # seconds a writer's reads stay on the primary
+
+    # Compiled template bytecode; defaults to a per-user temporary directory
+    TEMPLATE_CACHE_DIR: Optional[str] = None
+
+    # Prometheus metrics endpoint, served to scrapers presenting METRICS_TOKEN as a bearer token
+    METRICS_ENABLED: bool = True
+
     # Secrets
     AGENT_ENGINE_ID: Optional[SecretStr] = None
     GOOGLE_CLIENT_SECRET: Optional[SecretStr] = None
     DB_PASSWORD: Optional[SecretStr] = None
+    DB_REPLICA_URL: Optional[SecretStr] = None  # takes precedence over DB_REPLICA_CONNECTION_SECRET
+    METRICS_TOKEN: Optional[SecretStr] = None
 
     # Database config
     model_config = SettingsConfigDict(
@@ -103,6 +215,12 @@ class Settings(BaseSettings):
                         setattr(self, field_name, int(env_value))
                     except ValueError:
                         pass  # Skip if conversion fails
+                # Handle float fields
+                elif field_info and field_info.annotation is float:
+                    try:
+                        setattr(self, field_name, float(env_value))
+                    except ValueError:
+                        pass  # Skip if conversion fails
                 # Handle all other fields
                 else:
                     setattr(self, field_name, env_value)
@@ -1,12 +1,21 @@
 """Database connection management."""
+import asyncio
+import functools
+import inspect
 import logging
 import os
-from typing import Optional
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence
 
 import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
 from google.cloud import secretmanager
 
 from baid_server.config import settings
+from baid_server.utils.cache import TTLCache
+from baid_server.utils.lazy import AsyncLazy
+from baid_server.utils.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +30,159 @@ DB_USER = settings.DB_USER
 DB_PASSWORD = settings.DB_PASSWORD.get_secret_value() if settings.DB_PASSWORD else None
 PROJECT_ID = settings.PROJECT_ID
 
-# Global connection pool
-db_pool: Optional[asyncpg.Pool] = None
+# Queries prepared on every new connection, registered by the repositories with hot_query()
+HOT_QUERIES: List[str] = []
+
+POOL_ACQUIRE_WAIT = REGISTRY.histogram(
+    "db_pool_acquire_wait_seconds", "Time spent waiting for a pooled database connection", ["pool"])
+POOL_ACQUIRE_TIMEOUTS = REGISTRY.counter(
+    "db_pool_acquire_timeouts_total", "Connection acquisitions that timed out", ["pool"])
+POOL_CONNECTIONS = REGISTRY.gauge(
+    "db_pool_connections", "Pooled database connections by state", ["pool", "state"])
+QUERY_DURATION = REGISTRY.histogram(
+    "db_query_duration_seconds", "Database query latency by statement type", ["statement"])
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+_STATEMENT_TYPES = {"select", "insert", "update", "delete", "with"}
+
+
+def hot_query(query: str) -> str:
+    """Register a query to be prepared on every pooled connection; returns it unchanged."""
+    HOT_QUERIES.append(query)
+    return query
+
+
+def pool_max_size() -> int:
+    """Connections per worker process, splitting the instance budget across uvicorn workers."""
+    if settings.DB_POOL_MAX_SIZE:
+        return settings.DB_POOL_MAX_SIZE
+    return max(settings.DB_POOL_MIN_SIZE, settings.DB_MAX_CONNECTIONS // max(settings.WEB_CONCURRENCY, 1))
+
+
+def _statement_type(query: str) -> str:
+    keyword = query.lstrip().split(None, 1)[0].lower() if query.strip() else ""
+    return keyword if keyword in _STATEMENT_TYPES else "other"
+
+
+class AppConnection(asyncpg.Connection):
+    """Connection that times its queries and runs hot queries as prepared statements."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hot_statements: Dict[str, PreparedStatement] = {}
+
+    async def prepare_hot_statements(self, queries: Sequence[str]) -> None:
+        for query in queries:
+            try:
+                self._hot_statements[query] = await self.prepare(query)
+            except asyncpg.PostgresError as e:
+                # e.g. migrations not applied yet; the query still runs unprepared
+                logger.warning(f"Could not prepare hot query: {str(e)}")
+
+    async def _run_hot(self, method: str, query: str, args: Sequence[Any], **kwargs) -> Any:
+        statement = self._hot_statements.get(query)
+        started = time.perf_counter()
+        try:
+            if statement is not None:
+                try:
+                    return await getattr(statement, method)(*args, **kwargs)
+                except asyncpg.exceptions.InvalidCachedStatementError:
+                    # The schema changed under the statement; fall back to the statement cache
+                    del self._hot_statements[query]
+            return await getattr(super(), method)(query, *args, **kwargs)
+        finally:
+            QUERY_DURATION.observe(time.perf_counter() - started, statement=_statement_type(query))
+
+    async def fetch(self, query, *args, timeout=None, record_class=None) -> list:
+        if record_class is not None:
+            return await self._timed(super().fetch(query, *args, timeout=timeout, record_class=record_class), query)
+        return await self._run_hot("fetch", query, args, timeout=timeout)
+
+    async def fetchrow(self, query, *args, timeout=None, record_class=None):
+        if record_class is not None:
+            return await self._timed(super().fetchrow(query, *args, timeout=timeout, record_class=record_class), query)
+        return await self._run_hot("fetchrow", query, args, timeout=timeout)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        return await self._run_hot("fetchval", query, args, column=column, timeout=timeout)
+
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        return await self._timed(super().execute(query, *args, timeout=timeout), query)
+
+    async def executemany(self, command: str, args, *, timeout: Optional[float] = None):
+        return await self._timed(super().executemany(command, args, timeout=timeout), command)
+
+    @staticmethod
+    async def _timed(awaitable, query: str) -> Any:
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            QUERY_DURATION.observe(time.perf_counter() - started, statement=_statement_type(query))
+
+
+async def _init_connection(conn: AppConnection) -> None:
+    """Prepare the hot queries once per connection instead of on their first use."""
+    if settings.DB_STATEMENT_CACHE_SIZE > 0:
+        await conn.prepare_hot_statements(HOT_QUERIES)
+
+
+class _MeteredAcquire:
+    """Mirror of asyncpg's acquire context that goes through the metered pool."""
+
+    def __init__(self, pool: "MeteredPool", timeout: Optional[float]):
+        self._pool = pool
+        self._timeout = timeout
+        self._connection = None
+
+    async def __aenter__(self):
+        self._connection = await self._pool._acquire(self._timeout)
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        connection, self._connection = self._connection, None
+        await self._pool.release(connection)
+
+    def __await__(self):
+        return self._pool._acquire(self._timeout).__await__()
+
+
+class MeteredPool:
+    """asyncpg pool recording how long callers wait for a connection and how many are in use."""
+
+    def __init__(self, pool: asyncpg.Pool, name: str = PRIMARY):
+        self._pool = pool
+        self.name = name
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pool, name)
+
+    def acquire(self, *, timeout: Optional[float] = None) -> _MeteredAcquire:
+        return _MeteredAcquire(self, timeout)
+
+    async def _acquire(self, timeout: Optional[float]):
+        started = time.perf_counter()
+        try:
+            connection = await self._pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            POOL_ACQUIRE_TIMEOUTS.inc(pool=self.name)
+            logger.warning(f"Timed out waiting for a {self.name} database connection ({self._pool.get_size()} open)")
+            raise
+        finally:
+            POOL_ACQUIRE_WAIT.observe(time.perf_counter() - started, pool=self.name)
+        self._update_gauges()
+        return connection
+
+    async def release(self, connection, *, timeout: Optional[float] = None) -> None:
+        await self._pool.release(connection, timeout=timeout)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        idle = self._pool.get_idle_size()
+        POOL_CONNECTIONS.set(self._pool.get_size() - idle, pool=self.name, state="in_use")
+        POOL_CONNECTIONS.set(idle, pool=self.name, state="idle")
 
 
 async def get_secret(secret_id: str) -> str:
@@ -40,40 +200,165 @@ async def get_secret(secret_id: str) -> str:
         logger.error(f"Error accessing secret {secret_id}: {str(e)}")
         raise
 
-async def get_db_pool() -> asyncpg.Pool:
+async def _create_pool(connection_string: str, name: str) -> MeteredPool:
+    max_size = pool_max_size()
+    pool = await asyncpg.create_pool(
+        dsn=connection_string,
+        min_size=min(settings.DB_POOL_MIN_SIZE, max_size),
+        max_size=max_size,
+        max_inactive_connection_lifetime=settings.DB_POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        command_timeout=settings.DB_COMMAND_TIMEOUT,
+        connection_class=AppConnection,
+        init=_init_connection,
+        timeout=30
+    )
+    POOL_CONNECTIONS.set(0, pool=name, state="in_use")
+
+    logger.info(f"Database {name} connection pool created successfully (max {max_size} connections)")
+    return MeteredPool(pool, name=name)
+
+
+async def _create_db_pool() -> MeteredPool:
+    try:
+        # Get connection string from Secret Manager in production or env vars in development
+        if os.getenv("ENVIRONMENT") == "development" and DB_PASSWORD:
+            # For local development, use env vars
+            connection_string = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+            logger.info("Using local database connection from environment variables")
+        else:
+            # For production, get from Secret Manager
+            connection_string = await get_secret(DB_CONNECTION_SECRET)
+            logger.info(f"Using database connection from Secret Manager: {DB_CONNECTION_SECRET}")
+
+        return await _create_pool(connection_string, PRIMARY)
+    except Exception as e:
+        logger.error(f"Failed to create database connection pool: {str(e)}")
+        raise
+
+
+async def _create_replica_pool() -> Optional[MeteredPool]:
+    if settings.DB_REPLICA_URL:
+        connection_string = settings.DB_REPLICA_URL.get_secret_value()
+    elif settings.DB_REPLICA_CONNECTION_SECRET:
+        connection_string = await get_secret(settings.DB_REPLICA_CONNECTION_SECRET)
+    else:
+        return None
+    return await _create_pool(connection_string, REPLICA)
+
+
+# Global connection pools, created by the first caller even when many arrive at once
+db_pool: AsyncLazy[MeteredPool] = AsyncLazy(_create_db_pool, name="database connection pool")
+# None when no replica is configured
+replica_pool: AsyncLazy[Optional[MeteredPool]] = AsyncLazy(
+    _create_replica_pool, name="database replica connection pool")
+
+# Keys (a user id or a scope such as "tenants") written recently by this process.
+# Reads for them stay on the primary until the replica has had time to catch up.
+_recent_writes: TTLCache[str, bool] = TTLCache(
+    maxsize=100000, ttl=settings.DB_READ_YOUR_WRITES_WINDOW)
+
+# Key of the read-only repository call in progress, None outside one
+_read_key: ContextVar[Optional[str]] = ContextVar("db_read_key", default=None)
+
+
+async def get_db_pool() -> MeteredPool:
     """Get a connection pool to the PostgreSQL database."""
-    global db_pool
-    if db_pool is None:
-        try:
-            # Get connection string from Secret Manager in production or env vars in development
-            if os.getenv("ENVIRONMENT") == "development" and DB_PASSWORD:
-                # For local development, use env vars
-                connection_string = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-                logger.info("Using local database connection from environment variables")
-            else:
-                # For production, get from Secret Manager
-                connection_string = await get_secret(DB_CONNECTION_SECRET)
-                logger.info(f"Using database connection from Secret Manager: {DB_CONNECTION_SECRET}")
-
-            # Create connection pool
-            db_pool = await asyncpg.create_pool(
-                dsn=connection_string,
-                min_size=1,
-                max_size=10,
-                timeout=30
-            )
-
-            logger.info("Database connection pool created successfully")
-        except Exception as e:
-            logger.error(f"Failed to create database connection pool: {str(e)}")
-            raise
-    return db_pool
+    return await db_pool.get()
+
+
+def mark_written(key: str) -> None:
+    """Record a write so that reads for ``key`` see it for the read-your-writes window."""
+    _recent_writes.set(key, True)
+
+
+async def get_read_pool() -> Optional[MeteredPool]:
+    """The replica pool if the current repository call may read from it, otherwise None."""
+    key = _read_key.get()
+    if key is None or _recent_writes.get(key) is not None:
+        return None
+    try:
+        return await replica_pool.get()
+    except Exception as e:
+        # The replica is retried after a backoff; until then reads use the primary
+        logger.warning(f"Database replica unavailable, reading from the primary: {str(e)}")
+        return None
+
+
+def _routing_key(method: Callable, by: Optional[str], scope: Optional[str]) -> Callable[..., str]:
+    if scope is not None:
+        return lambda *args, **kwargs: scope
+    signature = inspect.signature(method)
+
+    def key(*args, **kwargs) -> str:
+        return str(signature.bind(*args, **kwargs).arguments[by])
+    return key
+
+
+def reads(by: Optional[str] = "user_id", scope: Optional[str] = None):
+    """Mark a repository method as read-only, so that it may run on the replica.
+
+    Reads are keyed by the method argument named ``by`` or by a fixed ``scope``;
+    after a write to the same key they use the primary for
+    ``settings.DB_READ_YOUR_WRITES_WINDOW`` seconds. The method must get its pool
+    from ``_get_pool``, which consults ``get_read_pool``; an async generator must
+    do so before its first item, as the key is only set until then.
+    """
+    def decorator(method):
+        routing_key = _routing_key(method, by, scope)
+        if inspect.isasyncgenfunction(method):
+            @functools.wraps(method)
+            async def read_generator(*args, **kwargs):
+                items = method(*args, **kwargs)
+                try:
+                    # Reset before yielding, so the caller's own queries between items stay on the primary
+                    token = _read_key.set(routing_key(*args, **kwargs))
+                    try:
+                        item = await items.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _read_key.reset(token)
+                    yield item
+                    async for item in items:
+                        yield item
+                finally:
+                    await items.aclose()
+            return read_generator
+
+        @functools.wraps(method)
+        async def read(*args, **kwargs):
+            token = _read_key.set(routing_key(*args, **kwargs))
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _read_key.reset(token)
+        return read
+    return decorator
+
+
+def writes(by: Optional[str] = "user_id", scope: Optional[str] = None):
+    """Mark a repository method as writing to the primary data of a key; see ``reads``."""
+    def decorator(method):
+        routing_key = _routing_key(method, by, scope)
+
+        @functools.wraps(method)
+        async def write(*args, **kwargs):
+            token = _read_key.set(None)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _read_key.reset(token)
+                # Also after a failure: the write may have committed before the error
+                mark_written(routing_key(*args, **kwargs))
+        return write
+    return decorator
 
 
 async def close_db_pool():
-    """Close the database connection pool."""
-    global db_pool
-    if db_pool:
-        await db_pool.close()
-        logger.info("Database connection pool closed")
-        db_pool = None
+    """Close the database connection pools."""
+    for lazy_pool in (replica_pool, db_pool):
+        pool = lazy_pool.reset()
+        if pool:
+            await pool.close()
+            logger.info(f"Database {pool.name} connection pool closed")
@@ -1,13 +1,49 @@
 """Message repository for database operations."""
 import logging
-from typing import List, Dict, Any, Optional
+import re
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Dict, Any, Optional, Sequence, Tuple
 
 import asyncpg
 
-from baid_server.db.database import get_db_pool
+from baid_server.db.database import get_db_pool, get_read_pool, mark_written, reads, writes
+from baid_server.db.repositories.token_usage_repository import TokenUsageRepository
+from baid_server.utils.tokens import count_tokens_async, count_tokens_batch_async
 
 logger = logging.getLogger(__name__)
 
+# Monthly partitions of messages are named messages_pYYYYMM (see 000010_partition_messages.sql)
+PARTITION_PREFIX = "messages_p"
+DEFAULT_PARTITION = "messages_default"
+# Partition maintenance runs on one instance at a time
+_PARTITION_LOCK_ID = 0x6d657373  # "mess"
+_PARTITION_BOUND = re.compile(r"FROM \((?:MINVALUE|'([^']+)')\) TO \((?:MAXVALUE|'([^']+)')\)")
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _parse_partition_bound(bound: str) -> Optional[Tuple[Optional[datetime], Optional[datetime]]]:
+    """(lower, upper) of a range partition, None for unbounded ends; None for the default partition."""
+    match = _PARTITION_BOUND.search(bound)
+    if match is None:
+        return None
+    lower, upper = match.groups()
+    return (
+        datetime.fromisoformat(lower) if lower else None,
+        datetime.fromisoformat(upper) if upper else None,
+    )
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
 
 class MessageRepository:
 
@@ -15,41 +51,207 @@ class MessageRepository:
         self._db_pool = db_pool
     
     async def _get_pool(self) -> asyncpg.Pool:
+        read_pool = await get_read_pool()
+        if read_pool is not None:
+            return read_pool
         if self._db_pool is None:
             return await get_db_pool()
         return self._db_pool
 
+    @writes()
     async def store_message(self, user_id: str, session_id: str, role: str, content: str) -> None:
         logger.debug(f"Storing message: user_id={user_id}, session_id={session_id}, role={role}")
+        token_count = await count_tokens_async(content)
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             try:
-                await conn.execute('''
-                INSERT INTO messages (user_id, session_id, role, content)
-                VALUES ($1, $2, $3, $4)
-                ''', user_id, session_id, role, content)
+                async with conn.transaction():
+                    await conn.execute('''
+                    INSERT INTO messages (user_id, session_id, role, content, token_count)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ''', user_id, session_id, role, content, token_count)
+                    await TokenUsageRepository.increment(conn, [(user_id, token_count, None)])
                 logger.debug("Message stored successfully")
             except Exception as e:
                 logger.error(f"Error storing message: {str(e)}")
                 # Continue execution even if message storage fails
 
+    async def store_messages(self, messages: Sequence[Tuple[str, str, str, str, datetime]]) -> None:
+        """Store a batch of (user_id, session_id, role, content, timestamp) rows in one round trip.
 
-    async def get_session_history(self, user_id: str, session_id: str) -> List[Dict[str, Any]]:
+        Timestamps are passed explicitly so that messages flushed together keep their order.
+        """
+        if not messages:
+            return
+        logger.debug(f"Storing batch of {len(messages)} messages")
+        token_counts = await count_tokens_batch_async([message[3] for message in messages])
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany('''
+                INSERT INTO messages (user_id, session_id, role, content, timestamp, token_count)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ''', [(*message, token_count) for message, token_count in zip(messages, token_counts)])
+                await TokenUsageRepository.increment(conn, [
+                    (user_id, token_count, timestamp)
+                    for (user_id, _, _, _, timestamp), token_count in zip(messages, token_counts)
+                ])
+        for user_id in {message[0] for message in messages}:
+            mark_written(user_id)
+
+
+    @staticmethod
+    def _history_entry(row: asyncpg.Record) -> Dict[str, Any]:
+        return {
+            "id": row['id'],
+            "role": row['role'],
+            "message": row['content'],
+            "timestamp": row['timestamp'].isoformat() if row['timestamp'] else None
+        }
+
+    @reads()
+    async def get_session_history(
+            self,
+            user_id: str,
+            session_id: str,
+            limit: Optional[int] = None,
+            after: Optional[Tuple[datetime, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Return a session's messages oldest first, starting after the (timestamp, id) keyset position."""
+        after_timestamp, after_id = after or (None, None)
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             rows = await conn.fetch('''
-            SELECT role, content, timestamp 
+            SELECT id, role, content, timestamp 
             FROM messages 
             WHERE user_id = $1 AND session_id = $2 
-            ORDER BY timestamp ASC
-            ''', user_id, session_id)
+              AND ($3::timestamptz IS NULL OR (timestamp, id) > ($3, $4))
+            ORDER BY timestamp ASC, id ASC
+            LIMIT $5
+            ''', user_id, session_id, after_timestamp, after_id, limit)
+
+        return [self._history_entry(row) for row in rows]
 
-        history = []
+    @reads()
+    async def iter_session_history(
+            self,
+            user_id: str,
+            session_id: str,
+            after: Optional[Tuple[datetime, int]] = None,
+            prefetch: int = 100
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a session's messages through a server-side cursor, ``prefetch`` rows at a time."""
+        after_timestamp, after_id = after or (None, None)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            # Cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                async for row in conn.cursor('''
+                SELECT id, role, content, timestamp
+                FROM messages
+                WHERE user_id = $1 AND session_id = $2
+                  AND ($3::timestamptz IS NULL OR (timestamp, id) > ($3, $4))
+                ORDER BY timestamp ASC, id ASC
+                ''', user_id, session_id, after_timestamp, after_id, prefetch=prefetch):
+                    yield self._history_entry(row)
+
+    async def get_messages_after(self, user_id: str, session_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        """Return the messages of a session with an id greater than ``after_id``, oldest first."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch('''
+            SELECT id, role, content
+            FROM messages
+            WHERE user_id = $1 AND session_id = $2 AND id > $3
+            ORDER BY id ASC
+            ''', user_id, session_id, after_id)
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    async def _get_partitions(conn: asyncpg.Connection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+        """(name, lower bound, upper bound) of each range partition of messages."""
+        rows = await conn.fetch('''
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+        ''')
+        partitions = []
         for row in rows:
-            history.append({
-                "role": row['role'],
-                "message": row['content'],
-                "timestamp": row['timestamp'].isoformat() if row['timestamp'] else None
-            })
-        
-        return history
+            bounds = _parse_partition_bound(row['bound'])
+            if bounds is not None:
+                partitions.append((row['name'], *bounds))
+        return partitions
+
+    async def ensure_partitions(self, conn: asyncpg.Connection, months_ahead: int = 3, now: Optional[datetime] = None) -> int:
+        """Create the monthly partitions from the current month to ``months_ahead`` months later.
+
+        Months already covered by a partition are skipped. Rows of a new month that
+        landed in the default partition (e.g. from a far-off client clock) are moved
+        into its partition first: a plain CREATE ... PARTITION OF fails while they are
+        there. Returns how many were created.
+        """
+        partitions = await self._get_partitions(conn)
+        current = _month_start(now or datetime.now(timezone.utc))
+        created = 0
+        for offset in range(months_ahead + 1):
+            start = _add_months(current, offset)
+            if any((lower is None or lower <= start) and (upper is None or start < upper)
+                   for _, lower, upper in partitions):
+                continue
+            end = _add_months(start, 1)
+            name = f"{PARTITION_PREFIX}{start:%Y%m}"
+            # Bounds are formatted from datetimes: DDL takes no query parameters
+            lower, upper = f"'{start.isoformat()}'", f"'{end.isoformat()}'"
+            async with conn.transaction():
+                await conn.execute(
+                    f"CREATE TABLE {_quote_identifier(name)} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+                await conn.execute(f'''
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION}
+                    WHERE timestamp >= {lower} AND timestamp < {upper}
+                    RETURNING *
+                )
+                INSERT INTO {_quote_identifier(name)} SELECT * FROM moved
+                ''')
+                await conn.execute(
+                    f"ALTER TABLE messages ATTACH PARTITION {_quote_identifier(name)} "
+                    f"FOR VALUES FROM ({lower}) TO ({upper})"
+                )
+            partitions.append((name, start, end))
+            created += 1
+            logger.info(f"Created messages partition {name}")
+        return created
+
+    async def drop_expired_partitions(self, conn: asyncpg.Connection, retention_days: int, now: Optional[datetime] = None) -> int:
+        """Drop the partitions holding only messages older than ``retention_days``.
+
+        The users' token usage counters are reduced by the dropped messages in the
+        same transaction. Returns how many partitions were dropped.
+        """
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+        dropped = 0
+        for name, _, upper in await self._get_partitions(conn):
+            if upper is None or upper > cutoff:
+                continue
+            async with conn.transaction():
+                await TokenUsageRepository.subtract_partition(conn, name)
+                await conn.execute(f"DROP TABLE {_quote_identifier(name)}")
+            dropped += 1
+            logger.info(f"Dropped messages partition {name} (messages before {upper.isoformat()})")
+        return dropped
+
+    async def maintain_partitions(self, months_ahead: int = 3, retention_days: Optional[int] = None) -> None:
+        """Create upcoming monthly partitions and, with a retention period, drop expired ones."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", _PARTITION_LOCK_ID):
+                logger.debug("Messages partitions are being maintained by another instance")
+                return
+            try:
+                await self.ensure_partitions(conn, months_ahead)
+                if retention_days:
+                    await self.drop_expired_partitions(conn, retention_days)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", _PARTITION_LOCK_ID)
@@ -0,0 +1,71 @@
+"""Queue of agent engine sessions waiting to be deleted."""
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+
+from baid_server.db.database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteSessionDeletionRepository:
+
+    def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
+        self._db_pool = db_pool
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._db_pool is None:
+            return await get_db_pool()
+        return self._db_pool
+
+    @staticmethod
+    async def enqueue(conn: asyncpg.Connection, sessions: Iterable[Tuple[str, str]]) -> None:
+        """Queue (user_id, agent_session_id) pairs for deletion; call in the transaction deleting them locally."""
+        sessions = list(dict.fromkeys(sessions))
+        if not sessions:
+            return
+        await conn.execute('''
+        INSERT INTO remote_session_deletions (user_id, agent_session_id)
+        SELECT * FROM unnest($1::text[], $2::text[])
+        ON CONFLICT (user_id, agent_session_id) DO NOTHING
+        ''', [user_id for user_id, _ in sessions], [agent_session_id for _, agent_session_id in sessions])
+
+    async def claim(self, limit: int, lease: float, max_attempts: int) -> List[Dict[str, Any]]:
+        """Take up to ``limit`` due deletions for ``lease`` seconds.
+
+        Claimed rows are not handed out again until the lease expires, so several
+        instances can process the queue and a crashed worker's claims are retried.
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch('''
+            UPDATE remote_session_deletions
+            SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $2),
+                attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM remote_session_deletions
+                WHERE next_attempt_at <= CURRENT_TIMESTAMP AND attempts < $3
+                ORDER BY next_attempt_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_id, agent_session_id, attempts
+            ''', limit, float(lease), max_attempts)
+        return [dict(row) for row in rows]
+
+    async def complete(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM remote_session_deletions WHERE id = ANY($1::bigint[])", ids)
+
+    async def retry_later(self, deletion_id: int, error: str, delay: float) -> None:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute('''
+            UPDATE remote_session_deletions
+            SET next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $2), last_error = $3
+            WHERE id = $1
+            ''', deletion_id, float(delay), error)
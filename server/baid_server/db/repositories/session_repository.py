@@ -1,24 +1,94 @@
 """Session repository for database operations."""
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+from uuid import UUID
 
 import asyncpg
 
-from baid_server.db.database import get_db_pool
+from baid_server.config import settings
+from baid_server.db.database import get_db_pool, get_read_pool, hot_query, mark_written, reads, writes
+from baid_server.db.repositories.remote_session_deletion_repository import RemoteSessionDeletionRepository
+from baid_server.db.repositories.token_usage_repository import TokenUsageRepository
+from baid_server.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+_SESSION_EXISTS_QUERY = hot_query("SELECT id FROM user_sessions WHERE user_id = $1 AND session_id = $2")
+
 
 class SessionRepository:
+    # (user_id, session_id) pairs known to have a mapping, shared by all instances
+    _known_sessions: TTLCache[Tuple[str, str], bool] = TTLCache(
+        maxsize=settings.SESSION_CACHE_MAX_SIZE,
+        ttl=settings.SESSION_CACHE_TTL,
+    )
+    # Latest use of each session, waiting to be written to last_used_at
+    _pending_touches: Dict[Tuple[str, str], datetime] = {}
+    # (agent_session_id, agent_session_tokens) of recently used sessions, pending tokens included
+    _agent_sessions: TTLCache[Tuple[str, str], Tuple[str, int]] = TTLCache(
+        maxsize=settings.SESSION_CACHE_MAX_SIZE,
+        ttl=settings.SESSION_CACHE_TTL,
+    )
+    # Tokens sent into each session's agent session, waiting to be added to agent_session_tokens
+    _pending_agent_tokens: Dict[Tuple[str, str], int] = {}
+
     def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
         self._db_pool = db_pool
     
     async def _get_pool(self) -> asyncpg.Pool:
+        read_pool = await get_read_pool()
+        if read_pool is not None:
+            return read_pool
         if self._db_pool is None:
             return await get_db_pool()
         return self._db_pool
 
+    @classmethod
+    def clear_cache(cls) -> None:
+        cls._known_sessions.clear()
+        cls._pending_touches.clear()
+        cls._agent_sessions.clear()
+        cls._pending_agent_tokens.clear()
+
+    def _forget(self, session: Tuple[str, str]) -> None:
+        self._known_sessions.pop(session)
+        self._pending_touches.pop(session, None)
+        self._agent_sessions.pop(session)
+        self._pending_agent_tokens.pop(session, None)
+
+    def touch_session(self, user_id: str, session_id: str) -> None:
+        """Record that a session was used; last_used_at is updated by flush_session_touches."""
+        self._pending_touches[(user_id, session_id)] = datetime.now(timezone.utc)
+
+    async def flush_session_touches(self) -> int:
+        """Write the coalesced last_used_at updates in one batch and return how many were written."""
+        if not self._pending_touches:
+            return 0
+        pending = dict(self._pending_touches)
+        self._pending_touches.clear()
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                await conn.executemany('''
+                UPDATE user_sessions
+                SET last_used_at = GREATEST(last_used_at, $3)
+                WHERE user_id = $1 AND session_id = $2
+                ''', [(user_id, session_id, used_at) for (user_id, session_id), used_at in pending.items()])
+        except Exception:
+            # Keep the touches for the next flush, with any newer use recorded meanwhile
+            for session, used_at in pending.items():
+                self._pending_touches[session] = max(used_at, self._pending_touches.get(session, used_at))
+            raise
+        logger.debug(f"Flushed {len(pending)} session touches")
+        return len(pending)
+
+    @writes()
     async def store_session_mapping(self, user_id: str, session_id: str) -> None:
+        if (user_id, session_id) in self._known_sessions:
+            self.touch_session(user_id, session_id)
+            return
         logger.info(f"Storing/updating session mapping: user_id={user_id}, session_id={session_id}")
         pool = await self._get_pool()
         async with pool.acquire() as conn:
@@ -29,24 +99,106 @@ class SessionRepository:
                 ON CONFLICT (user_id, session_id)
                 DO UPDATE SET last_used_at = CURRENT_TIMESTAMP
                 ''', user_id, session_id)
+                self._known_sessions.set((user_id, session_id), True)
                 logger.info(f"Session mapping stored/updated: user_id={user_id}, session_id={session_id}")
             except Exception as e:
                 logger.error(f"Error storing session mapping: {str(e)}")
                 raise
 
     async def session_exists(self, user_id: str, session_id: str) -> bool:
+        if (user_id, session_id) in self._known_sessions:
+            return True
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             try:
-                result = await conn.fetchval('''
-                SELECT id FROM user_sessions
-                WHERE user_id = $1 AND session_id = $2
-                ''', user_id, session_id)
+                result = await conn.fetchval(_SESSION_EXISTS_QUERY, user_id, session_id)
+                if result is not None:
+                    self._known_sessions.set((user_id, session_id), True)
                 return result is not None
             except Exception as e:
                 logger.error(f"Error checking session existence: {str(e)}")
                 return False
 
+    async def get_agent_session(self, user_id: str, session_id: str) -> Tuple[str, int]:
+        """Return the agent-side session backing a user session and the tokens sent into it.
+
+        Sessions that were never rotated are backed by the agent session of the same id.
+        Recently used sessions are served from the cache without a query.
+        """
+        key = (user_id, session_id)
+        cached = self._agent_sessions.get(key)
+        if cached is not None:
+            return cached
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow('''
+            SELECT agent_session_id, agent_session_tokens FROM user_sessions
+            WHERE user_id = $1 AND session_id = $2
+            ''', user_id, session_id)
+        if row is None:
+            return session_id, 0
+        agent_session = (row['agent_session_id'] or session_id,
+                         row['agent_session_tokens'] + self._pending_agent_tokens.get(key, 0))
+        self._agent_sessions.set(key, agent_session)
+        return agent_session
+
+    async def rotate_agent_session(self, user_id: str, session_id: str, agent_session_id: str, tokens: int = 0) -> None:
+        """Point a user session at a fresh agent session seeded with ``tokens`` of carried-over history."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                previous = await conn.fetchval('''
+                UPDATE user_sessions s
+                SET agent_session_id = $3, agent_session_tokens = $4
+                FROM (
+                    SELECT id, COALESCE(agent_session_id, session_id) AS agent_session_id
+                    FROM user_sessions
+                    WHERE user_id = $1 AND session_id = $2
+                    FOR UPDATE
+                ) old
+                WHERE s.id = old.id
+                RETURNING old.agent_session_id
+                ''', user_id, session_id, agent_session_id, tokens)
+                # The agent session rotated away from is no longer referenced
+                if previous is not None and previous != agent_session_id:
+                    await RemoteSessionDeletionRepository.enqueue(conn, [(user_id, previous)])
+        # Tokens not flushed yet were sent into the previous agent session
+        self._pending_agent_tokens.pop((user_id, session_id), None)
+        if previous is not None:
+            self._agent_sessions.set((user_id, session_id), (agent_session_id, tokens))
+        logger.info(f"Rotated session {session_id} of user {user_id} to agent session {agent_session_id}")
+
+    def add_agent_session_tokens(self, user_id: str, session_id: str, tokens: int) -> None:
+        """Record tokens sent into a session's agent session; written by flush_agent_session_tokens."""
+        key = (user_id, session_id)
+        self._pending_agent_tokens[key] = self._pending_agent_tokens.get(key, 0) + tokens
+        cached = self._agent_sessions.get(key)
+        if cached is not None:
+            self._agent_sessions.set(key, (cached[0], cached[1] + tokens))
+
+    async def flush_agent_session_tokens(self) -> int:
+        """Add the coalesced agent session tokens in one batch and return how many sessions were updated."""
+        if not self._pending_agent_tokens:
+            return 0
+        pending = dict(self._pending_agent_tokens)
+        self._pending_agent_tokens.clear()
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                await conn.executemany('''
+                UPDATE user_sessions
+                SET agent_session_tokens = agent_session_tokens + $3
+                WHERE user_id = $1 AND session_id = $2
+                ''', [(user_id, session_id, tokens) for (user_id, session_id), tokens in pending.items()])
+        except Exception:
+            # Keep the increments for the next flush, on top of any recorded meanwhile
+            for session, tokens in pending.items():
+                self._pending_agent_tokens[session] = self._pending_agent_tokens.get(session, 0) + tokens
+            raise
+        logger.debug(f"Flushed agent session tokens of {len(pending)} sessions")
+        return len(pending)
+
+    @reads()
     async def get_user_sessions(self, user_id: str) -> List[Dict[str, Any]]:
         pool = await self._get_pool()
         async with pool.acquire() as conn:
@@ -68,17 +220,129 @@ class SessionRepository:
         
         return sessions
 
+    @writes()
     async def delete_session(self, user_id: str, session_id: str) -> None:
+        self._forget((user_id, session_id))
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             # Use a transaction to ensure both deletions happen or neither does
             async with conn.transaction():
-                await conn.execute(
-                    "DELETE FROM user_sessions WHERE user_id = $1 AND session_id = $2",
+                agent_session_id = await conn.fetchval(
+                    "DELETE FROM user_sessions WHERE user_id = $1 AND session_id = $2 RETURNING agent_session_id",
                     user_id, session_id
                 )
 
+                # Deleted messages no longer count towards the user's token usage
+                await TokenUsageRepository.subtract_session(conn, user_id, session_id)
+
                 await conn.execute(
                     "DELETE FROM messages WHERE user_id = $1 AND session_id = $2",
                     user_id, session_id
                 )
+
+                await conn.execute(
+                    "DELETE FROM session_summaries WHERE user_id = $1 AND session_id = $2",
+                    user_id, session_id
+                )
+
+                # The agent engine sessions, including one the session was rotated to,
+                # are deleted by the remote-session-deletions background task
+                await RemoteSessionDeletionRepository.enqueue(
+                    conn, [(user_id, session_id), (user_id, agent_session_id or session_id)]
+                )
+
+    async def delete_sessions(
+            self,
+            user_id: Optional[str] = None,
+            tenant_id: Optional[UUID] = None,
+            inactive_before: Optional[datetime] = None,
+            batch_size: int = 100,
+            pause: float = 0.05,
+            max_passes: int = 5,
+            retry_delay: float = 5.0,
+    ) -> int:
+        """Delete every session matching all of the given filters, ``batch_size`` sessions per transaction.
+
+        Each batch is a short transaction that skips sessions locked by live
+        traffic and fails instead of waiting longer than
+        ``settings.SESSION_PURGE_LOCK_TIMEOUT`` for any other lock. Skipped
+        sessions are retried by up to ``max_passes`` passes, ``retry_delay``
+        seconds apart; any still left are logged. The agent engine sessions are
+        queued for the remote-session-deletions task. Returns the number of
+        sessions deleted.
+        """
+        if user_id is None and tenant_id is None and inactive_before is None:
+            raise ValueError("At least one of user_id, tenant_id or inactive_before is required")
+        filters = (user_id, tenant_id, inactive_before)
+        pool = await self._get_pool()
+        deleted = 0
+        for attempt in range(1, max_passes + 1):
+            deleted += await self._delete_session_batches(pool, filters, batch_size, pause)
+            remaining = await self._count_matching_sessions(pool, filters)
+            if not remaining:
+                break
+            if attempt == max_passes:
+                logger.warning(f"{remaining} sessions matching {filters} were locked and are left for a later purge")
+                break
+            logger.info(f"{remaining} sessions were locked, retrying in {retry_delay:.0f}s")
+            await asyncio.sleep(retry_delay)
+        return deleted
+
+    @staticmethod
+    async def _count_matching_sessions(pool: asyncpg.Pool, filters: Tuple) -> int:
+        async with pool.acquire() as conn:
+            return await conn.fetchval('''
+            SELECT count(*) FROM user_sessions
+            WHERE ($1::text IS NULL OR user_id = $1)
+              AND ($2::uuid IS NULL OR user_id IN (SELECT email FROM users WHERE tenant_id = $2))
+              AND ($3::timestamptz IS NULL OR last_used_at < $3)
+            ''', *filters)
+
+    async def _delete_session_batches(self, pool: asyncpg.Pool, filters: Tuple, batch_size: int, pause: float) -> int:
+        """One pass of delete_sessions: batches until none is full, skipping locked sessions."""
+        deleted = 0
+        while True:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = '{int(settings.SESSION_PURGE_LOCK_TIMEOUT * 1000)}ms'")
+                    rows = await conn.fetch('''
+                    DELETE FROM user_sessions
+                    WHERE id IN (
+                        SELECT id FROM user_sessions
+                        WHERE ($1::text IS NULL OR user_id = $1)
+                          AND ($2::uuid IS NULL OR user_id IN (SELECT email FROM users WHERE tenant_id = $2))
+                          AND ($3::timestamptz IS NULL OR last_used_at < $3)
+                        LIMIT $4
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING user_id, session_id, COALESCE(agent_session_id, session_id) AS agent_session_id
+                    ''', *filters, batch_size)
+                    if not rows:
+                        break
+                    sessions = [(row['user_id'], row['session_id']) for row in rows]
+                    user_ids = [user for user, _ in sessions]
+                    session_ids = [session for _, session in sessions]
+
+                    await TokenUsageRepository.subtract_sessions(conn, sessions)
+                    for table in ("messages", "session_summaries"):
+                        await conn.execute(f'''
+                        DELETE FROM {table} t
+                        USING unnest($1::text[], $2::text[]) AS d(user_id, session_id)
+                        WHERE t.user_id = d.user_id AND t.session_id = d.session_id
+                        ''', user_ids, session_ids)
+                    await RemoteSessionDeletionRepository.enqueue(conn, [
+                        pair for row in rows
+                        for pair in ((row['user_id'], row['session_id']), (row['user_id'], row['agent_session_id']))
+                    ])
+
+            for session in sessions:
+                self._forget(session)
+            for user in set(user_ids):
+                mark_written(user)
+            deleted += len(rows)
+            logger.info(f"Deleted a batch of {len(rows)} sessions ({deleted} so far)")
+            if len(rows) < batch_size:
+                break
+            # Let other work use the connections between batches
+            await asyncio.sleep(pause)
+        return deleted
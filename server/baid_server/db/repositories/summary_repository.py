@@ -0,0 +1,49 @@
+"""Session summary repository for database operations."""
+import logging
+from typing import Dict, Any, Optional
+
+import asyncpg
+
+from baid_server.db.database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryRepository:
+
+    def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
+        self._db_pool = db_pool
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._db_pool is None:
+            return await get_db_pool()
+        return self._db_pool
+
+    async def get_latest_summary(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the most recent rolling summary of a session, if any."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow('''
+            SELECT summary, summarized_until_id, token_count
+            FROM session_summaries
+            WHERE user_id = $1 AND session_id = $2
+            ORDER BY id DESC
+            LIMIT 1
+            ''', user_id, session_id)
+        return dict(row) if row else None
+
+    async def store_summary(
+            self,
+            user_id: str,
+            session_id: str,
+            summary: str,
+            summarized_until_id: int,
+            token_count: int
+    ) -> None:
+        logger.debug(f"Storing summary for session {session_id} up to message {summarized_until_id}")
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute('''
+            INSERT INTO session_summaries (user_id, session_id, summary, summarized_until_id, token_count)
+            VALUES ($1, $2, $3, $4, $5)
+            ''', user_id, session_id, summary, summarized_until_id, token_count)
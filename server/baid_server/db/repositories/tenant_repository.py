@@ -5,9 +5,14 @@ from uuid import UUID
 
 import asyncpg
 
+from baid_server.db.database import get_read_pool, reads, writes
+
 logger = logging.getLogger(__name__)
 
 
+TENANTS_SCOPE = "tenants"
+
+
 class TenantRepository:
     """Repository for tenant-related database operations."""
 
@@ -17,10 +22,14 @@ class TenantRepository:
     async def _get_pool(self):
         """Get the database pool."""
         from baid_server.db.database import get_db_pool
+        read_pool = await get_read_pool()
+        if read_pool is not None:
+            return read_pool
         if not self._db_pool:
             self._db_pool = await get_db_pool()
         return self._db_pool
 
+    @writes(scope=TENANTS_SCOPE)
     async def create_tenant(self, name: str, slug: str) -> UUID:
         """Create a new tenant."""
         pool = await self._get_pool()
@@ -38,6 +47,7 @@ class TenantRepository:
                 logger.error(f"Error creating tenant: {str(e)}")
                 raise
 
+    @reads(scope=TENANTS_SCOPE)
     async def get_tenant_by_id(self, tenant_id: UUID) -> Dict[str, Any]:
         """Get a tenant by ID."""
         pool = await self._get_pool()
@@ -59,6 +69,7 @@ class TenantRepository:
                 "updated_at": row["updated_at"]
             }
 
+    @reads(scope=TENANTS_SCOPE)
     async def get_tenant_by_slug(self, slug: str) -> Dict[str, Any]:
         """Get a tenant by slug."""
         pool = await self._get_pool()
@@ -80,6 +91,7 @@ class TenantRepository:
                 "updated_at": row["updated_at"]
             }
 
+    @reads(scope=TENANTS_SCOPE)
     async def list_tenants(self) -> List[Dict[str, Any]]:
         """List all tenants."""
         pool = await self._get_pool()
@@ -102,6 +114,7 @@ class TenantRepository:
                 
             return tenants
 
+    @writes(scope=TENANTS_SCOPE)
     async def update_tenant(self, tenant_id: UUID, name: str, slug: str) -> bool:
         """Update a tenant."""
         pool = await self._get_pool()
@@ -123,6 +136,7 @@ class TenantRepository:
                 logger.error(f"Error updating tenant: {str(e)}")
                 raise
 
+    @writes(scope=TENANTS_SCOPE)
     async def delete_tenant(self, tenant_id: UUID) -> bool:
         """Delete a tenant (will fail if there are associated users or API keys)."""
         pool = await self._get_pool()
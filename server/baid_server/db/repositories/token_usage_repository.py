@@ -0,0 +1,172 @@
+"""Token usage repository for database operations."""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from baid_server.config import settings
+from baid_server.db.database import get_db_pool, hot_query
+from baid_server.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_USAGE_QUERY = hot_query("SELECT token_count FROM user_token_usage WHERE user_id = $1")
+
+
+class TokenUsageRepository:
+    """Running per-user token counters kept next to the messages they summarize."""
+
+    # Recent counter reads; a few seconds of staleness is fine for limit checks
+    _usage_cache: TTLCache[str, int] = TTLCache(maxsize=10000, ttl=settings.TOKEN_USAGE_CACHE_TTL)
+
+    def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
+        self._db_pool = db_pool
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._db_pool is None:
+            return await get_db_pool()
+        return self._db_pool
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        cls._usage_cache.clear()
+
+    @staticmethod
+    async def increment(conn: asyncpg.Connection, messages: Iterable[Tuple[str, int, Optional[datetime]]]) -> None:
+        """Add (user_id, token_count, timestamp) messages to their users' counters on ``conn``.
+
+        Called inside the transaction that inserts the messages, so counters and
+        messages commit together. Users are updated in a fixed order to avoid deadlocks.
+        """
+        totals: Dict[str, List] = defaultdict(lambda: [0, 0, None])
+        for user_id, token_count, timestamp in messages:
+            total = totals[user_id]
+            total[0] += token_count
+            total[1] += 1
+            if timestamp is not None and (total[2] is None or timestamp > total[2]):
+                total[2] = timestamp
+        await conn.executemany('''
+        INSERT INTO user_token_usage (user_id, token_count, message_count, last_message_at)
+        VALUES ($1, $2, $3, COALESCE($4, CURRENT_TIMESTAMP))
+        ON CONFLICT (user_id) DO UPDATE SET
+            token_count = user_token_usage.token_count + EXCLUDED.token_count,
+            message_count = user_token_usage.message_count + EXCLUDED.message_count,
+            last_message_at = GREATEST(user_token_usage.last_message_at, EXCLUDED.last_message_at),
+            updated_at = CURRENT_TIMESTAMP
+        ''', [(user_id, *totals[user_id]) for user_id in sorted(totals)])
+
+    @staticmethod
+    async def subtract_session(conn: asyncpg.Connection, user_id: str, session_id: str) -> None:
+        """Remove a session's messages from the user's counter; call before deleting them."""
+        await conn.execute('''
+        UPDATE user_token_usage u
+        SET token_count = GREATEST(u.token_count - s.token_count, 0),
+            message_count = GREATEST(u.message_count - s.message_count, 0),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT COALESCE(SUM(token_count), 0) AS token_count, COUNT(*) AS message_count
+            FROM messages
+            WHERE user_id = $1 AND session_id = $2
+        ) s
+        WHERE u.user_id = $1
+        ''', user_id, session_id)
+
+    @staticmethod
+    async def subtract_sessions(conn: asyncpg.Connection, sessions: Sequence[Tuple[str, str]]) -> None:
+        """Remove the messages of many (user_id, session_id) sessions from the counters; call before deleting them."""
+        await conn.execute('''
+        UPDATE user_token_usage u
+        SET token_count = GREATEST(u.token_count - s.token_count, 0),
+            message_count = GREATEST(u.message_count - s.message_count, 0),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT m.user_id, SUM(m.token_count) AS token_count, COUNT(*) AS message_count
+            FROM messages m
+            JOIN unnest($1::text[], $2::text[]) AS d(user_id, session_id)
+              ON m.user_id = d.user_id AND m.session_id = d.session_id
+            GROUP BY m.user_id
+        ) s
+        WHERE u.user_id = s.user_id
+        ''', [user_id for user_id, _ in sessions], [session_id for _, session_id in sessions])
+
+    @staticmethod
+    async def subtract_partition(conn: asyncpg.Connection, partition: str) -> None:
+        """Remove a messages partition from every user's counter; call before dropping it."""
+        await conn.execute(f'''
+        UPDATE user_token_usage u
+        SET token_count = GREATEST(u.token_count - p.token_count, 0),
+            message_count = GREATEST(u.message_count - p.message_count, 0),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, SUM(token_count) AS token_count, COUNT(*) AS message_count
+            FROM "{partition.replace('"', '""')}"
+            GROUP BY user_id
+        ) p
+        WHERE u.user_id = p.user_id
+        ''')
+
+    async def record_model_usage(self, user_id: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Add the token usage the model reported for a turn."""
+        if not prompt_tokens and not completion_tokens:
+            return
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute('''
+            INSERT INTO user_token_usage (user_id, prompt_tokens, completion_tokens)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET
+                prompt_tokens = user_token_usage.prompt_tokens + EXCLUDED.prompt_tokens,
+                completion_tokens = user_token_usage.completion_tokens + EXCLUDED.completion_tokens
+            ''', user_id, prompt_tokens, completion_tokens)
+
+    async def get_token_usage(self, user_id: str) -> int:
+        """Tokens used by a user, from the counter table (one primary key lookup)."""
+        cached = self._usage_cache.get(user_id)
+        if cached is not None:
+            return cached
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            usage = await conn.fetchval(_USAGE_QUERY, user_id)
+        usage = usage or 0
+        self._usage_cache.set(user_id, usage)
+        return usage
+
+    async def reconcile(self, quiet_period: float = 300.0, batch_size: int = 500) -> int:
+        """Recompute counters that changed since they were last reconciled.
+
+        Only users idle for ``quiet_period`` seconds are recomputed, at most
+        ``batch_size`` per run. Returns how many counters were reconciled.
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute('''
+            WITH stale AS (
+                SELECT user_id FROM user_token_usage
+                WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                  AND (reconciled_at IS NULL OR reconciled_at < updated_at)
+                ORDER BY updated_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            ), totals AS (
+                SELECT s.user_id,
+                       COALESCE(SUM(m.token_count), 0) AS token_count,
+                       COUNT(m.id) AS message_count,
+                       MAX(m.timestamp) AS last_message_at
+                FROM stale s
+                LEFT JOIN messages m ON m.user_id = s.user_id
+                GROUP BY s.user_id
+            )
+            UPDATE user_token_usage u
+            SET token_count = t.token_count,
+                message_count = t.message_count,
+                last_message_at = t.last_message_at,
+                reconciled_at = CURRENT_TIMESTAMP
+            FROM totals t
+            WHERE u.user_id = t.user_id
+            ''', float(quiet_period), batch_size)
+        reconciled = int(result.split()[-1])
+        if reconciled:
+            logger.info(f"Reconciled token usage of {reconciled} users")
+        return reconciled
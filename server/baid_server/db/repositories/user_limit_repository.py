@@ -0,0 +1,124 @@
+"""User limit repository for database operations."""
+import logging
+from typing import Optional, Tuple
+
+import asyncpg
+
+from baid_server.config import settings
+from baid_server.db.database import get_db_pool, hot_query
+from baid_server.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Channel announcing changes to user_status, user_settings or the default limit
+LIMITS_CHANNEL = "user_limits_changed"
+# Notification payload for changes that affect every user
+ALL_USERS = "*"
+DEFAULT_TOKEN_LIMIT = 100000
+
+_LIMITS_QUERY = hot_query('''
+SELECT
+    (SELECT status FROM user_status WHERE user_id = $1) AS status,
+    (SELECT setting_value FROM user_settings
+     WHERE user_id = $1 AND setting_key = 'token_limit') AS user_limit,
+    (SELECT setting_value FROM global_settings
+     WHERE setting_key = 'default_token_limit') AS default_limit
+''')
+
+
+class UserLimitRepository:
+    """Restriction status and token limit of users, cached per instance.
+
+    Changes are announced with NOTIFY on ``LIMITS_CHANNEL``; every instance
+    listens and drops its cached entries, so the TTL only bounds staleness when
+    a notification is lost.
+    """
+
+    # user_id -> (is_restricted, token_limit)
+    _limits_cache: TTLCache[str, Tuple[bool, int]] = TTLCache(maxsize=10000, ttl=settings.USER_LIMITS_CACHE_TTL)
+
+    def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
+        self._db_pool = db_pool
+        self._listen_conn: Optional[asyncpg.Connection] = None
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._db_pool is None:
+            return await get_db_pool()
+        return self._db_pool
+
+    @classmethod
+    def clear_cache(cls) -> None:
+        cls._limits_cache.clear()
+
+    @classmethod
+    def invalidate(cls, user_id: str) -> None:
+        """Forget the cached limits of a user, or of everyone for ``ALL_USERS``."""
+        if user_id == ALL_USERS:
+            cls._limits_cache.clear()
+        else:
+            cls._limits_cache.pop(user_id)
+
+    @classmethod
+    async def notify_changed(cls, conn: asyncpg.Connection, user_id: str) -> None:
+        """Announce a limit change to every instance; call on the connection that made it."""
+        cls.invalidate(user_id)
+        await conn.execute("SELECT pg_notify($1, $2)", LIMITS_CHANNEL, user_id)
+
+    async def get_limits(self, user_id: str) -> Tuple[bool, int]:
+        """Return (is_restricted, token_limit) for a user in a single round trip."""
+        cached = self._limits_cache.get(user_id)
+        if cached is not None:
+            return cached
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(_LIMITS_QUERY, user_id)
+
+        is_restricted = bool(row["status"]) and row["status"].lower() == "restricted"
+        limit = row["user_limit"] or row["default_limit"]
+        limits = (is_restricted, int(limit) if limit else DEFAULT_TOKEN_LIMIT)
+        self._limits_cache.set(user_id, limits)
+        return limits
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        self.invalidate(payload)
+
+    def _on_termination(self, connection) -> None:
+        # Notifications may be missed until the listener is restarted
+        logger.warning("User limit listener connection closed; clearing cached limits")
+        self.clear_cache()
+
+    @property
+    def is_listening(self) -> bool:
+        return self._listen_conn is not None and not self._listen_conn.is_closed()
+
+    async def listen(self) -> None:
+        """Hold a connection listening for limit changes made by any instance."""
+        if self.is_listening:
+            return
+        pool = await self._get_pool()
+        if self._listen_conn is not None:
+            # Hand the lost connection back so the pool can replace it
+            conn, self._listen_conn = self._listen_conn, None
+            await pool.release(conn)
+        conn = await pool.acquire()
+        try:
+            await conn.add_listener(LIMITS_CHANNEL, self._on_notification)
+            conn.add_termination_listener(self._on_termination)
+        except Exception:
+            await pool.release(conn)
+            raise
+        self._listen_conn = conn
+        # Anything cached before now may have missed a notification
+        self.clear_cache()
+        logger.info(f"Listening for user limit changes on {LIMITS_CHANNEL}")
+
+    async def unlisten(self) -> None:
+        if self._listen_conn is None:
+            return
+        conn, self._listen_conn = self._listen_conn, None
+        pool = await self._get_pool()
+        try:
+            conn.remove_termination_listener(self._on_termination)
+            await conn.remove_listener(LIMITS_CHANNEL, self._on_notification)
+        finally:
+            await pool.release(conn)
@@ -1,26 +1,69 @@
 """User repository for database operations."""
 import logging
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional, List
 from uuid import UUID
 
 import asyncpg
 
+from baid_server.config import settings
+from baid_server.db.database import get_read_pool, hot_query, reads, writes
+from baid_server.db.repositories.user_limit_repository import DEFAULT_TOKEN_LIMIT
+from baid_server.utils.api_keys import cache_key, hash_api_key, lookup_prefix, new_salt, verify_api_key
+from baid_server.utils.cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+# Read-your-writes key of reads across many users (the dashboard, tenant listings)
+USERS_SCOPE = "users"
+
+_USER_TENANT_QUERY = hot_query("SELECT tenant_id FROM users WHERE email = $1")
+
+# Sort keys accepted by the users dashboard, mapped to columns of its query
+DASHBOARD_SORT_COLUMNS = {
+    "created_at": "created_at",
+    "email": "email",
+    "last_active": "last_active",
+    "messages": "message_count",
+    "tokens": "token_count",
+    "usage": "token_ratio",
+    "status": "status",
+}
+
 
 class UserRepository:
     """Repository for user-related database operations."""
 
+    # Tenant of each user, shared by all instances; users rarely change tenant
+    _user_tenants: TTLCache[str, Optional[UUID]] = TTLCache(maxsize=10000, ttl=600)
+    # Recently validated API keys by digest; a deleted key stays valid on other instances for the TTL at most
+    _validated_keys: TTLCache[bytes, Dict[str, Any]] = TTLCache(
+        maxsize=settings.API_KEY_CACHE_MAX_SIZE,
+        ttl=settings.API_KEY_CACHE_TTL,
+    )
+    # Latest use of each API key id, waiting to be written to last_used_at
+    _pending_key_uses: Dict[int, datetime] = {}
+
     def __init__(self, db_pool: Optional[asyncpg.Pool] = None):
         self._db_pool = db_pool
 
+    @classmethod
+    def clear_cache(cls) -> None:
+        cls._user_tenants.clear()
+        cls._validated_keys.clear()
+        cls._pending_key_uses.clear()
+
     async def _get_pool(self):
         """Get the database pool."""
         from baid_server.db.database import get_db_pool
+        read_pool = await get_read_pool()
+        if read_pool is not None:
+            return read_pool
         if not self._db_pool:
             self._db_pool = await get_db_pool()
         return self._db_pool
 
+    @writes(scope=USERS_SCOPE)
     async def store_user(self, userinfo: Dict[str, Any], tenant_id: Optional[UUID] = None):
         """Store a user in the database."""
         email = userinfo.get("email")
@@ -50,6 +93,19 @@ class UserRepository:
                 logger.error(f"Error storing user: {str(e)}")
                 raise
 
+    async def get_user_tenant_id(self, user_id: str) -> Optional[UUID]:
+        """Get the tenant a user belongs to, or None for unknown users."""
+        if user_id in self._user_tenants:
+            return self._user_tenants.get(user_id)
+
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            tenant_id = await conn.fetchval(_USER_TENANT_QUERY, user_id)
+
+        tenant_id = UUID(str(tenant_id)) if tenant_id else None
+        self._user_tenants.set(user_id, tenant_id)
+        return tenant_id
+
     async def add_to_waitlist(
             self,
             email: str,
@@ -74,7 +130,7 @@ class UserRepository:
                 raise
 
     async def store_api_key(self, user_id: str, api_key: str, name: str, tenant_id: Optional[UUID] = None, expires_at=None):
-        """Store a new API key for a user."""
+        """Store a new API key for a user; only its salted hash is kept."""
         # If no tenant_id is provided, get the user's tenant
         if tenant_id is None:
             pool = await self._get_pool()
@@ -83,14 +139,16 @@ class UserRepository:
                 SELECT tenant_id FROM users WHERE email = $1
                 ''', user_id)
 
+        salt = new_salt()
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             try:
                 result = await conn.fetchval('''
-                INSERT INTO api_keys (user_id, api_key, name, tenant_id, expires_at)
-                VALUES ($1, $2, $3, $4, $5)
+                INSERT INTO api_keys (user_id, key_prefix, key_salt, key_hash, name, tenant_id, expires_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
                 RETURNING id
-                ''', user_id, api_key, name, str(tenant_id) if tenant_id else None, expires_at)
+                ''', user_id, lookup_prefix(api_key), salt, hash_api_key(api_key, salt), name,
+                    str(tenant_id) if tenant_id else None, expires_at)
 
                 logger.info(f"API key stored for user: {user_id}")
                 return str(result)
@@ -145,32 +203,80 @@ class UserRepository:
         pool = await self._get_pool()
         async with pool.acquire() as conn:
             await conn.execute(query, *params)
+        # Keys are cached by digest, not id; deletions are rare enough to drop them all
+        self._validated_keys.clear()
 
     async def validate_api_key(self, api_key: str):
-        """Validate an API key and return user info if valid."""
+        """Validate an API key and return user info if valid.
+
+        Validations are cached for ``settings.API_KEY_CACHE_TTL`` seconds and the
+        key's last_used_at is written later by ``flush_api_key_uses``.
+        """
+        digest = cache_key(api_key)
+        key = self._validated_keys.get(digest)
+        if key is not None and key["expires_at"] is not None and key["expires_at"] <= datetime.now(timezone.utc):
+            self._validated_keys.pop(digest)
+            return None
+        if key is None:
+            key = await self._find_api_key(api_key)
+            if key is None:
+                return None
+            self._validated_keys.set(digest, key)
+
+        self._pending_key_uses[key["key_id"]] = datetime.now(timezone.utc)
+        return {field: key[field] for field in ("email", "name", "user_id", "tenant_id", "tenant_name", "tenant_slug")}
+
+    async def _find_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
         pool = await self._get_pool()
         async with pool.acquire() as conn:
-            # Find the API key and join with users table to get user info
-            row = await conn.fetchrow('''
-            SELECT u.email, u.name, k.user_id, k.tenant_id, t.name as tenant_name, t.slug as tenant_slug
+            # Find the candidate keys by prefix and join with users table to get user info
+            rows = await conn.fetch('''
+            SELECT k.id, k.key_salt, k.key_hash, k.expires_at,
+                   u.email, u.name, k.user_id, k.tenant_id, t.name as tenant_name, t.slug as tenant_slug
             FROM api_keys k
             JOIN users u ON k.user_id = u.email
             JOIN tenants t ON k.tenant_id = t.id
-            WHERE k.api_key = $1 
+            WHERE k.key_prefix = $1
               AND (k.expires_at IS NULL OR k.expires_at > NOW())
-            ''', api_key)
-
-        if row:
-            return {
-                "email": row["email"],
-                "name": row["name"],
-                "user_id": row["user_id"],
-                "tenant_id": UUID(row["tenant_id"]),
-                "tenant_name": row["tenant_name"],
-                "tenant_slug": row["tenant_slug"]
-            }
+            ''', lookup_prefix(api_key))
+
+        for row in rows:
+            if verify_api_key(api_key, row["key_salt"], row["key_hash"]):
+                return {
+                    "key_id": row["id"],
+                    "expires_at": row["expires_at"],
+                    "email": row["email"],
+                    "name": row["name"],
+                    "user_id": row["user_id"],
+                    "tenant_id": UUID(row["tenant_id"]),
+                    "tenant_name": row["tenant_name"],
+                    "tenant_slug": row["tenant_slug"]
+                }
         return None
-        
+
+    async def flush_api_key_uses(self) -> int:
+        """Write the coalesced last_used_at updates of API keys in one batch and return how many were written."""
+        if not self._pending_key_uses:
+            return 0
+        pending = dict(self._pending_key_uses)
+        self._pending_key_uses.clear()
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                await conn.executemany('''
+                UPDATE api_keys
+                SET last_used_at = GREATEST(last_used_at, $2)
+                WHERE id = $1
+                ''', list(pending.items()))
+        except Exception:
+            # Keep the uses for the next flush unless a later one was recorded meanwhile
+            for key_id, used_at in pending.items():
+                self._pending_key_uses[key_id] = max(used_at, self._pending_key_uses.get(key_id, used_at))
+            raise
+        logger.debug(f"Flushed {len(pending)} API key uses")
+        return len(pending)
+
+    @reads(scope=USERS_SCOPE)
     async def get_users_by_tenant(self, tenant_id: UUID) -> List[Dict[str, Any]]:
         """Get all users belonging to a specific tenant."""
         pool = await self._get_pool()
@@ -192,3 +298,60 @@ class UserRepository:
                 })
                 
             return users
+
+    @reads(scope=USERS_SCOPE)
+    async def get_dashboard_page(
+            self,
+            limit: int = 50,
+            offset: int = 0,
+            sort: str = "created_at",
+            descending: bool = True,
+    ) -> Dict[str, Any]:
+        """One page of users with their usage, limit and status, in a single query.
+
+        Usage comes from the per-user counters, so the cost depends on the number
+        of users shown rather than on the amount of stored chat history.
+        """
+        column = DASHBOARD_SORT_COLUMNS[sort]
+        direction = "DESC" if descending else "ASC"
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(f'''
+            WITH defaults AS (
+                SELECT COALESCE(g.setting_value::BIGINT, {DEFAULT_TOKEN_LIMIT}) AS default_token_limit,
+                       g.updated_at AS default_token_limit_updated
+                FROM (SELECT 1) one
+                LEFT JOIN global_settings g ON g.setting_key = 'default_token_limit'
+            ), dashboard AS (
+                SELECT u.id, u.email, u.name, u.picture, u.created_at,
+                       COALESCE(t.message_count, 0) AS message_count,
+                       t.last_message_at AS last_active,
+                       COALESCE(t.token_count, 0) AS token_count,
+                       COALESCE(us.setting_value::BIGINT, d.default_token_limit) AS token_limit,
+                       COALESCE(s.status, 'active') AS status
+                FROM users u
+                CROSS JOIN defaults d
+                LEFT JOIN user_token_usage t ON t.user_id = u.email
+                LEFT JOIN user_settings us ON us.user_id = u.email AND us.setting_key = 'token_limit'
+                LEFT JOIN user_status s ON s.user_id = u.email
+            ), page AS (
+                SELECT *, token_count::FLOAT / NULLIF(token_limit, 0) AS token_ratio
+                FROM dashboard
+                ORDER BY {column} {direction} NULLS LAST, id {direction}
+                LIMIT $1 OFFSET $2
+            )
+            SELECT d.default_token_limit, d.default_token_limit_updated,
+                   (SELECT COUNT(*) FROM users) AS total, p.*
+            FROM defaults d
+            LEFT JOIN page p ON TRUE
+            ORDER BY p.{column} {direction} NULLS LAST, p.id {direction}
+            ''', limit, offset)
+
+        first = rows[0]
+        return {
+            "default_token_limit": first["default_token_limit"],
+            "default_token_limit_updated": first["default_token_limit_updated"],
+            "total": first["total"],
+            # A page past the end comes back as a single row of NULLs
+            "users": [dict(row) for row in rows if row["id"] is not None],
+        }
@@ -1,9 +1,9 @@
 import os
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
 # Set environment
@@ -20,10 +20,12 @@ from baid_server.config import settings
 settings.print_variables()
 
 from baid_server.api.routes import auth, agent, sessions, waitlist, api_key, auth_api_key, ci_error, users, tenant, sync
+from baid_server.api.dependencies import verify_metrics_token
 from baid_server.api.middleware import TokenLimitMiddleware
 from baid_server.db.database import get_db_pool, close_db_pool
 from baid_server.services.service_factory import ServiceFactory
 from baid_server.utils.git_utils import get_git_commit_sha
+from baid_server.utils.metrics import REGISTRY
 
 # Create FastAPI application
 @asynccontextmanager
@@ -35,12 +37,21 @@ async def lifespan(app: FastAPI):
 
         # Initialize agent service
         await ServiceFactory.initialize_agent_service()
+
+        # Start periodic maintenance tasks
+        await ServiceFactory.start_background_tasks()
         yield
     except Exception as e:
         logger.error(f"Failed to initialize services: {str(e)}")
         yield
     finally:
         # Cleanup on shutdown
+        try:
+            # Flush queued messages before the pool goes away
+            await ServiceFactory.shutdown()
+            logger.info("Background workers drained")
+        except Exception as e:
+            logger.error(f"Error draining background workers: {str(e)}")
         try:
             await close_db_pool()
             logger.info("Database connection pool closed")
@@ -129,6 +140,16 @@ async def health_check():
         )
 
 
+# Prometheus scrape endpoint; per-tenant and pool metrics are not public
+if settings.METRICS_ENABLED:
+    if not settings.METRICS_TOKEN:
+        logger.warning("METRICS_TOKEN is not set, /metrics rejects every request")
+
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_token)])
+    async def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # Register routers
 app.include_router(auth)
 app.include_router(agent)
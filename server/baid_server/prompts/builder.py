@@ -0,0 +1,118 @@
+"""
+Prompt assembly for the agent engine.
+
+Static instructions (the response format and the analyzer role) form a fixed
+prefix that is sent once per session, or never when they are deployed with the
+agent. Later turns only carry the dynamic part; the instructions are already in
+the session history, where the backend can serve them from its context cache.
+"""
+import logging
+from typing import Any, Dict, Optional
+
+from baid_server.prompts.format import CI_RESPONSE_FORMAT, RESPONSE_FORMAT
+from baid_server.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Where the static instructions come from
+INSTRUCTIONS_EVERY_TURN = "every_turn"
+INSTRUCTIONS_ONCE_PER_SESSION = "session"
+INSTRUCTIONS_DEPLOYED = "deployed"
+INSTRUCTION_MODES = (INSTRUCTIONS_EVERY_TURN, INSTRUCTIONS_ONCE_PER_SESSION, INSTRUCTIONS_DEPLOYED)
+
+# Instruction sets, primed independently per session
+CONSULT = "consult"
+CI_ANALYSIS = "ci_analysis"
+
+# Kept byte-for-byte stable so that it is a cacheable prefix
+CONSULT_INSTRUCTIONS = f"""Your responses should follow the JSON format specified strictly, for this and every later message in this conversation.
+{RESPONSE_FORMAT}"""
+
+CI_ANALYSIS_INSTRUCTIONS = f"""You are a CI error analyzer.
+For every CI failure in this conversation, analyze the error and provide a solution. Focus on the specific issue in the CI pipeline and be very actionable.
+Your response should include:
+1. A clear explanation of what went wrong
+2. A brief explanation of the error
+3. A probable fix
+Focus on being practical and specific with your solution.
+
+Make sure your response is in the following JSON format:
+{CI_RESPONSE_FORMAT}
+
+Stream your response as a series of rfc8259 JSON format only. Do not include any other characters or formatting. Each chunk should be a valid JSON object.
+"""
+
+INSTRUCTIONS_SEPARATOR = "\n\n---\n\n"
+
+
+class PromptBuilder:
+    """Builds per-turn messages, prefixing static instructions only when needed."""
+
+    def __init__(
+            self,
+            mode: str = INSTRUCTIONS_ONCE_PER_SESSION,
+            max_sessions: int = 10000,
+            session_ttl: float = 86400.0,
+    ):
+        if mode not in INSTRUCTION_MODES:
+            raise ValueError(f"Unknown prompt instruction mode: {mode}")
+        self.mode = mode
+        self._primed: TTLCache[tuple, bool] = TTLCache(maxsize=max_sessions, ttl=session_ttl)
+
+    def needs_instructions(self, session_id: Optional[str], kind: str = CONSULT) -> bool:
+        """Whether the next turn of ``session_id`` must carry the ``kind`` instructions."""
+        if self.mode == INSTRUCTIONS_DEPLOYED:
+            return False
+        if self.mode == INSTRUCTIONS_EVERY_TURN or not session_id:
+            return True
+        return self._primed.get((kind, session_id)) is None
+
+    def mark_primed(self, session_id: str, kind: str = CONSULT) -> None:
+        """Record that the session history now contains the ``kind`` instructions."""
+        if self.mode == INSTRUCTIONS_ONCE_PER_SESSION:
+            self._primed.set((kind, session_id), True)
+
+    def _with_instructions(self, kind: str, instructions: str, message: str, session_id: Optional[str]) -> str:
+        if self.needs_instructions(session_id, kind):
+            return instructions + INSTRUCTIONS_SEPARATOR + message
+        return message
+
+    def consult_message(
+            self,
+            session_id: Optional[str],
+            user_input: str,
+            context: Dict[str, Any],
+            history: Optional[str] = None,
+    ) -> str:
+        """Message for a /consult turn about the optionally open file.
+
+        ``history`` carries earlier turns into a freshly rotated agent session.
+        """
+        if context.get("is_open", False):
+            message = f"{user_input}\n\nFile content: {context.get('file_content', '')}" + "\n" + user_input
+        else:
+            message = user_input
+        if history:
+            message = history + INSTRUCTIONS_SEPARATOR + message
+        return self._with_instructions(CONSULT, CONSULT_INSTRUCTIONS, message, session_id)
+
+    def ci_analysis_message(self, session_id: Optional[str], command: str, stdout: str, stderr: str) -> str:
+        """Message asking to analyze one CI failure."""
+        message = f"""I'm facing an error in my CI pipeline. Please help me fix it.
+
+## Command
+```
+{command}
+```
+
+## Standard Output
+```
+{stdout}
+```
+
+## Error Output
+```
+{stderr}
+```
+"""
+        return self._with_instructions(CI_ANALYSIS, CI_ANALYSIS_INSTRUCTIONS, message, session_id)
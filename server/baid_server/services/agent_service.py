@@ -2,18 +2,28 @@ import asyncio
 import logging
 import os
 import re
-from typing import Dict, Any, AsyncGenerator, Optional
+from typing import Dict, Any, AsyncGenerator, List, Optional
 from dataclasses import dataclass
+from uuid import UUID
 
 from google.adk.sessions import VertexAiSessionService, Session
+from google.api_core.exceptions import NotFound
+from google.genai.errors import ClientError
 from vertexai import agent_engines
 from vertexai.agent_engines import AgentEngine
 from google.cloud.aiplatform_v1.services.reasoning_engine_execution_service import ReasoningEngineExecutionServiceClient
 
 from baid_server.db.repositories.message_repository import MessageRepository
 from baid_server.db.repositories.session_repository import SessionRepository
+from baid_server.db.repositories.token_usage_repository import TokenUsageRepository
+from baid_server.services.answer_cache import AnswerCache, CachedAnswer
+from baid_server.services.history_manager import HistoryManager
+from baid_server.services.message_sink import MessageSink
+from baid_server.services.retry_policy import CircuitOpenError, RetryPolicy, SentEventTracker
 from baid_server.utils.response_parser import ResponseParser
-from baid_server.prompts import RESPONSE_FORMAT
+from baid_server.utils.stream_options import StreamOptions, raw_sse_event
+from baid_server.utils.tokens import count_tokens_batch_async
+from baid_server.prompts.builder import PromptBuilder
 
 logger = logging.getLogger(__name__)
 
@@ -47,9 +57,21 @@ class AgentService:
             response_processor: ResponseParser,
             config: AgentConfig = None,
             session_service: Optional[VertexAiSessionService] = None,
+            message_sink: Optional[MessageSink] = None,
+            answer_cache: Optional[AnswerCache] = None,
+            retry_policy: Optional[RetryPolicy] = None,
+            prompt_builder: Optional[PromptBuilder] = None,
+            history_manager: Optional[HistoryManager] = None,
+            token_usage_repository: Optional[TokenUsageRepository] = None,
     ):
         self.config = config or AgentConfig()
         self.message_repository = message_repository
+        self.message_sink = message_sink
+        self.answer_cache = answer_cache
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.history_manager = history_manager
+        self.token_usage_repository = token_usage_repository
         self.session_repository = session_repository
         self.response_processor = response_processor
         api_endpoint = f"{self.config.location}-aiplatform.googleapis.com"
@@ -83,23 +105,92 @@ class AgentService:
         agent = self.get_agent()
         return agent.create_session(user_id=user_id)
 
-    def delete_session(self, user_id: str, session_id: str) -> None:
-        self.session_service.delete_session(
-            app_name=self.config.reasoning_engine_app_name,
-            user_id=user_id,
-            session_id=session_id
-        )
+    async def delete_session(self, user_id: str, session_id: str) -> None:
+        """Delete an agent engine session; one that no longer exists counts as deleted."""
+        try:
+            await self.session_service.delete_session(
+                app_name=self.config.reasoning_engine_app_name,
+                user_id=user_id,
+                session_id=session_id
+            )
+        except NotFound:
+            logger.info(f"Agent session {session_id} of user {user_id} was already deleted")
+        except ClientError as e:
+            if e.code != 404:
+                raise
+            logger.info(f"Agent session {session_id} of user {user_id} was already deleted")
+
+    async def _store_message(self, user_id: str, session_id: str, role: str, content: str) -> None:
+        """Persist a message through the write-behind sink when one is configured."""
+        if self.message_sink is not None:
+            await self.message_sink.enqueue(user_id, session_id, role, content)
+        else:
+            await self.message_repository.store_message(user_id, session_id, role, content)
+
+    async def _ensure_session_mapping(self, request_id: str, user_id: str, session_id: str) -> None:
+        if not await self.session_repository.session_exists(user_id, session_id):
+            await self.session_repository.store_session_mapping(user_id, session_id)
+            logger.info(f"[{request_id}] Stored existing session {session_id} for user {user_id}")
+        else:
+            self.session_repository.touch_session(user_id, session_id)
+
+    async def _record_cached_turn(
+            self,
+            request_id: str,
+            user_id: str,
+            session_id: Optional[str],
+            user_input: str,
+            cached: CachedAnswer,
+    ) -> None:
+        """Record a replayed answer in the session like a generated one, without the agent engine.
+
+        The turn is counted against the agent session's budget although the agent never saw it,
+        so rotation carries the stored turn over as if it had. A request without a session only
+        gets the answer: creating one would need the agent engine.
+        """
+        if not session_id:
+            logger.info(f"[{request_id}] Cached answer served outside of a session")
+            return
+        await self._ensure_session_mapping(request_id, user_id, session_id)
+        await self._store_message(user_id, session_id, "user", user_input)
+        await self._store_message(user_id, session_id, "assistant", cached.response_text)
+        if self.history_manager is not None:
+            self.history_manager.record_turn(
+                user_id, session_id, sum(await count_tokens_batch_async([user_input, cached.response_text]))
+            )
+
+    async def _record_model_usage(self, user_id: str, prompt_tokens: int, completion_tokens: int) -> None:
+        try:
+            await self.token_usage_repository.record_model_usage(user_id, prompt_tokens, completion_tokens)
+        except Exception as e:
+            logger.error(f"Error recording model token usage for user {user_id}: {str(e)}")
 
     async def process_query(
             self,
             user_id: str,
             session_id: Optional[str],
             user_input: str,
-            context: Dict[str, Any] = {}
+            context: Dict[str, Any] = {},
+            stream_options: Optional[StreamOptions] = None,
+            use_answer_cache: bool = False,
+            tenant_id: Optional[UUID] = None
     ) -> AsyncGenerator[str, None]:
         request_id = os.urandom(4).hex()
+        stream_options = stream_options or StreamOptions()
         logger.info(f"[{request_id}] Processing query for user {user_id}")
 
+        # Replay a cached answer to the same question about the same file, before any agent engine call
+        cache_key = None
+        if use_answer_cache and self.answer_cache is not None:
+            cache_key = AnswerCache.key_for(user_input, context, stream_options)
+            cached = await self.answer_cache.get(tenant_id, user_id, cache_key)
+            if cached is not None:
+                logger.info(f"[{request_id}] Serving cached answer ({len(cached.events)} events)")
+                await self._record_cached_turn(request_id, user_id, session_id, user_input, cached)
+                for sse_data in cached.events:
+                    yield sse_data
+                return
+
         # Get agent instance
         agent: AgentEngine = self.get_agent()
 
@@ -110,47 +201,61 @@ class AgentService:
             await self.session_repository.store_session_mapping(user_id, session_id)
             logger.info(f"[{request_id}] Created new session {session_id} for user {user_id}")
         else:
-            if not await self.session_repository.session_exists(user_id, session_id):
-                await self.session_repository.store_session_mapping(user_id, session_id)
-                logger.info(f"[{request_id}] Stored existing session {session_id} for user {user_id}")
+            await self._ensure_session_mapping(request_id, user_id, session_id)
 
-        # Extract context information
-        file_content = context.get("file_content", "")
-        is_open = context.get("is_open", False)
+        # Long sessions continue in a fresh agent session seeded with a bounded history
+        agent_session_id, history = session_id, None
+        if self.history_manager is not None:
+            agent_session = await self.history_manager.agent_session_for(
+                user_id, session_id, lambda: agent.create_session(user_id=user_id)["id"]
+            )
+            agent_session_id, history = agent_session.agent_session_id, agent_session.carry_over
 
-        # Prepare message with format instructions
-        if is_open:
-            message = f"{user_input}\n\nFile content: {file_content}" + "\n" + user_input
-        else:
-            message = user_input
-
-        message = message + "\n\n" + f"""
-        Your response should follow the JSON format specified strictly.
-        {RESPONSE_FORMAT}
-        """
+        # Prepare message; format instructions are only sent until the session has them
+        message = self.prompt_builder.consult_message(agent_session_id, user_input, context, history=history)
 
         # Store user message in database
-        await self.message_repository.store_message(user_id, session_id, "user", user_input)
+        await self._store_message(user_id, session_id, "user", user_input)
 
         # Process response using AgentEngine directly
         full_response = ""
+        emitted: List[str] = []
         logger.info(f"[{request_id}] Started streaming query")
 
-        max_retries = 3
-        retry_count = 0
+        try:
+            self.retry_policy.begin()
+        except CircuitOpenError as e:
+            logger.warning(f"[{request_id}] Rejecting query: {str(e)}")
+            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+            yield "data: [DONE]\n\n"
+            return
+
+        # Blocks already streamed are not repeated when a retry regenerates them
+        sent_events = SentEventTracker()
+        attempt = 0
         success = False
 
-        while retry_count < max_retries and not success:
+        while not success:
+            attempt += 1
+            sent_events.new_attempt()
+            # Usage reported by the model for the calls of this attempt
+            prompt_tokens = completion_tokens = 0
             try:
                 # Use AgentEngine's stream_query method directly
                 processed_events = 0
                 for event in agent.stream_query(
                         user_id=user_id,
-                        session_id=session_id,
+                        session_id=agent_session_id,
                         message=message,
                 ):
                     logger.debug(f"[{request_id}] Event from AgentEngine: {event}")
 
+                    # Partial events repeat the usage of the model call they belong to
+                    usage = event.get('usage_metadata')
+                    if usage and not event.get('partial'):
+                        prompt_tokens += usage.get('prompt_token_count') or 0
+                        completion_tokens += usage.get('candidates_token_count') or 0
+
                     # Use dictionary key access instead of hasattr
                     content = event.get('content')
                     if content:
@@ -162,13 +267,23 @@ class AgentService:
                                     text_chunk = text
                                     text_chunk = re.sub(r'^```json\s*\n?', '', text_chunk)
                                     text_chunk = re.sub(r'\n?```\s*$', '', text_chunk)
-                                    async for sse_data in ResponseParser.process_incoming_chunk(text_chunk):
-                                        logger.info(f"[{request_id}] Processed SSE data: {repr(sse_data)}")
-                                        if sse_data:
-                                            processed_events += 1
-                                            yield sse_data
+                                    if stream_options.includes_blocks:
+                                        async for sse_data in ResponseParser.process_incoming_chunk(text_chunk, stream_options.code_encoding):
+                                            logger.info(f"[{request_id}] Processed SSE data: {repr(sse_data)}")
+                                            if sse_data:
+                                                processed_events += 1
+                                                if sent_events.should_send(sse_data):
+                                                    emitted.append(sse_data)
+                                                    yield sse_data
                                     full_response += text_chunk
-                                    yield f"data: {text_chunk}\n\n"
+                                    if stream_options.includes_raw:
+                                        # Raw deltas only count as progress when no blocks are requested
+                                        if not stream_options.includes_blocks:
+                                            processed_events += 1
+                                        raw_data = raw_sse_event(text_chunk)
+                                        if sent_events.should_send(raw_data):
+                                            emitted.append(raw_data)
+                                            yield raw_data
 
                     # Handle final response - check if method exists or if it's a flag
                     is_final = False
@@ -186,36 +301,47 @@ class AgentService:
 
                 if processed_events > 0:
                     success = True
+                    self.retry_policy.record_success()
+                    self.prompt_builder.mark_primed(agent_session_id)
                 else:
                     # No events processed, consider this a failed attempt
                     raise Exception("No events were processed from the stream response")
 
             except Exception as e:
-                retry_count += 1
                 logger.error(
-                    f"[{request_id}] Error in query or processing (attempt {retry_count}/{max_retries}): {str(e)}")
+                    f"[{request_id}] Error in query or processing (attempt {attempt}/{self.retry_policy.max_attempts}): {str(e)}")
 
                 # Clear the response for retry
                 full_response = ""
 
-                if retry_count >= max_retries:
-                    # If we've exhausted all retries, inform the client
-                    logger.error(f"[{request_id}] Max retries ({max_retries}) reached, giving up")
-                    yield f"data: {{\"error\": \"Failed after {max_retries} attempts. Last error: {str(e)}\"}}\n\n"
+                backoff_time = self.retry_policy.next_delay(attempt)
+                if backoff_time is None:
+                    # Out of attempts, retry budget or circuit: inform the client
+                    logger.error(f"[{request_id}] Giving up after {attempt} attempts")
+                    yield f"data: {{\"error\": \"Failed after {attempt} attempts. Last error: {str(e)}\"}}\n\n"
                     # Send final markers even after error
                     session_data = f"data: {{\"session_id\": \"{session_id}\"}}\n\n"
                     yield session_data
                     yield "data: [DONE]\n\n"
                     return
 
-                # Wait before retrying (exponential backoff)
-                backoff_time = 2 ** retry_count  # 2, 4, 8 seconds
-                logger.info(f"[{request_id}] Waiting {backoff_time} seconds before retry")
+                logger.info(f"[{request_id}] Waiting {backoff_time:.2f} seconds before retry")
                 await asyncio.sleep(backoff_time)
 
         # Store assistant response in database
         if full_response:
             logger.info(f"[{request_id}] Storing assistant response in database")
-            await self.message_repository.store_message(user_id, session_id, "assistant", full_response)
+            await self._store_message(user_id, session_id, "assistant", full_response)
+            if self.history_manager is not None:
+                self.history_manager.record_turn(
+                    user_id, session_id, sum(await count_tokens_batch_async([message, full_response]))
+                )
+            if self.token_usage_repository is not None:
+                await self._record_model_usage(user_id, prompt_tokens, completion_tokens)
+
+            # Only answers streamed cleanly on the first attempt are worth replaying
+            if cache_key is not None and attempt == 1:
+                emitted.append("data: [DONE]\n\n")
+                await self.answer_cache.set(tenant_id, user_id, cache_key, CachedAnswer(full_response, emitted))
 
         yield "data: [DONE]\n\n"
\ No newline at end of file
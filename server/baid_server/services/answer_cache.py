@@ -0,0 +1,78 @@
+"""Opt-in cache of /consult answers keyed on the prompt and the file it is about."""
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from baid_server.services.response_cache import ResponseCache
+from baid_server.utils.stream_options import StreamOptions
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_HEADER = "X-Answer-Cache"
+ANSWER_CACHE_QUERY_PARAM = "answer_cache"
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", prompt.lower()).strip())
+
+
+def wants_answer_cache(headers, query_params) -> bool:
+    """Clients opt in per request with X-Answer-Cache: on (or ?answer_cache=on)."""
+    value = query_params.get(ANSWER_CACHE_QUERY_PARAM) or headers.get(ANSWER_CACHE_HEADER) or ""
+    return value.strip().lower() in ("on", "true", "1", "yes")
+
+
+@dataclass
+class CachedAnswer:
+    """A cached answer: the raw agent text for history and the SSE events to replay."""
+    response_text: str
+    events: List[str]
+
+
+class AnswerCache:
+    """Answers cached per tenant, so an invalidation only touches one tenant.
+
+    Users without a tenant each get a namespace of their own.
+    """
+
+    def __init__(self, cache: ResponseCache, ttl: float):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def namespace(tenant_id: Optional[UUID], user_id: Optional[str] = None) -> str:
+        return f"answers:{tenant_id}" if tenant_id else f"answers:user:{user_id}"
+
+    @staticmethod
+    def key_for(user_input: str, context: Dict[str, Any], stream_options: StreamOptions) -> str:
+        """Build the cache key from the prompt, the open file content and the negotiated stream."""
+        file_content = context.get("file_content", "") if context.get("is_open", False) else ""
+        file_hash = hashlib.sha256(file_content.encode("utf-8")).hexdigest()
+        parts = [
+            normalize_prompt(user_input),
+            file_hash,
+            stream_options.format.value,
+            stream_options.code_encoding.value,
+        ]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, tenant_id: Optional[UUID], user_id: str, key: str) -> Optional[CachedAnswer]:
+        entry = await self.cache.get(self.namespace(tenant_id, user_id), key)
+        if not entry:
+            return None
+        return CachedAnswer(response_text=entry[0], events=entry[1:])
+
+    async def set(self, tenant_id: Optional[UUID], user_id: str, key: str, answer: CachedAnswer) -> None:
+        await self.cache.set(self.namespace(tenant_id, user_id), key, [answer.response_text, *answer.events], self.ttl)
+
+    async def invalidate(self, tenant_id: UUID) -> int:
+        removed = await self.cache.invalidate(self.namespace(tenant_id))
+        logger.info(f"Invalidated {removed} cached answers for tenant {tenant_id}")
+        return removed
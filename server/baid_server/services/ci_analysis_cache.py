@@ -0,0 +1,103 @@
+"""Single-flight coalescing and caching of CI error analyses."""
+import hashlib
+import json
+import logging
+import re
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from baid_server.models.ci_error import CIErrorRequest
+from baid_server.services.response_cache import ResponseCache
+from baid_server.utils.stream_broadcast import StreamBroadcast
+
+logger = logging.getLogger(__name__)
+
+CACHE_HIT = "hit"
+CACHE_COALESCED = "coalesced"
+CACHE_MISS = "miss"
+
+# Volatile fragments of CI output that should not make otherwise identical failures differ
+_MASKS = [
+    # ISO-8601 and log-style timestamps
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<timestamp>"),
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}(?:[.,]\d+)?\b"), "<time>"),
+    # Durations such as "12.3s" or "450 ms"
+    (re.compile(r"\b\d+(?:\.\d+)?\s?(?:ms|s|sec|seconds|m|min)\b"), "<duration>"),
+    # UUIDs, then commit SHAs, container ids and other long hex ids
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"\b(?:0x)?[0-9a-fA-F]{7,}\b"), "<hex>"),
+    # Directory part of absolute POSIX and Windows paths, keeping the file name
+    (re.compile(r"(?:/[\w.@+-]+)+/(?=[\w.@+-]+)"), "<path>/"),
+    (re.compile(r"\b[A-Za-z]:\\(?:[\w.@+ -]+\\)+(?=[\w.@+-]+)"), "<path>\\\\"),
+]
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_ci_output(text: str) -> str:
+    """Mask timestamps, paths and ids, and collapse whitespace."""
+    for pattern, replacement in _MASKS:
+        text = pattern.sub(replacement, text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def fingerprint_ci_request(request: CIErrorRequest) -> str:
+    """Fingerprint a CI error request so that repeats of the same failure share a key."""
+    normalized = "\0".join(normalize_ci_output(part) for part in (request.command, request.stdout, request.stderr))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(events: List[str]) -> bool:
+    """Only complete, error free analyses are cached."""
+    if not events or events[-1] != "data: [DONE]\n\n":
+        return False
+    for event in events:
+        try:
+            payload = json.loads(event[len("data: "):])
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and "error" in payload:
+            return False
+    return True
+
+
+class CIAnalysisCoalescer:
+    """Shares one upstream analysis between identical concurrent requests and caches the result."""
+
+    def __init__(self, cache: ResponseCache, ttl: float):
+        self.cache = cache
+        self.ttl = ttl
+        self._in_flight: Dict[Tuple[str, str], StreamBroadcast] = {}
+
+    async def open(
+            self,
+            namespace: str,
+            fingerprint: str,
+            start_stream: Callable[[], AsyncIterator[str]],
+    ) -> Tuple[str, AsyncIterator[str]]:
+        """Return the cache status and the event stream for a request.
+
+        ``start_stream`` is only called when neither a cached nor an in-flight
+        analysis exists for the fingerprint.
+        """
+        cached = await self.cache.get(namespace, fingerprint)
+        if cached is not None:
+            return CACHE_HIT, self._replay(cached)
+
+        key = (namespace, fingerprint)
+        broadcast = self._in_flight.get(key)
+        if broadcast is not None:
+            return CACHE_COALESCED, broadcast.subscribe()
+
+        async def on_complete(finished: StreamBroadcast) -> None:
+            self._in_flight.pop(key, None)
+            if finished.error is None and is_cacheable(finished.events):
+                await self.cache.set(namespace, fingerprint, finished.events, self.ttl)
+                logger.info(f"Cached CI analysis {fingerprint[:12]} ({len(finished.events)} events)")
+
+        broadcast = StreamBroadcast(start_stream(), on_complete=on_complete)
+        self._in_flight[key] = broadcast.start()
+        return CACHE_MISS, broadcast.subscribe()
+
+    @staticmethod
+    async def _replay(events: List[str]) -> AsyncIterator[str]:
+        for event in events:
+            yield event
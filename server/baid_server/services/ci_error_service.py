@@ -12,6 +12,8 @@ from vertexai import agent_engines
 from vertexai.agent_engines import AgentEngine
 
 from baid_server.core.parser.agent_response import parse_ci_response
+from baid_server.prompts.builder import CI_ANALYSIS, PromptBuilder
+from baid_server.services.retry_policy import CircuitOpenError, RetryPolicy, SentEventTracker
 from baid_server.utils.ci_response_parser import CiResponseParser
 
 logger = logging.getLogger(__name__)
@@ -44,8 +46,12 @@ class CIErrorService:
     def __init__(
         self,
         config: Optional[CIErrorServiceConfig] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
     ):
         self.config = config or CIErrorServiceConfig()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.prompt_builder = prompt_builder or PromptBuilder()
         api_endpoint = f"{self.config.location}-aiplatform.googleapis.com"
         self.execution_client = ReasoningEngineExecutionServiceClient(
             client_options={"api_endpoint": api_endpoint}
@@ -93,13 +99,17 @@ class CIErrorService:
             )
 
             # Initialize retry mechanism
-            max_retries = 3
-            retry_count = 0
+            self.retry_policy.begin()
+            sent_events = SentEventTracker()
+            max_retries = self.retry_policy.max_attempts
+            attempt = 0
             success = False
 
-            while retry_count < max_retries and not success:
+            while not success:
+                attempt += 1
+                sent_events.new_attempt()
                 try:
-                    logger.info(f"[{request_id}] Attempt {retry_count + 1}/{max_retries} to query reasoning engine")
+                    logger.info(f"[{request_id}] Attempt {attempt}/{max_retries} to query reasoning engine")
                     stream_response = self.execution_client.stream_query_reasoning_engine(stream_request)
 
                     full_response = ""
@@ -131,33 +141,41 @@ class CIErrorService:
                             logger.info(f"[{request_id}] Processed SSE data: {repr(sse_data)}")
                             if sse_data:
                                 processed_events += 1
-                                yield sse_data
-                                await asyncio.sleep(1)
+                                if sent_events.should_send(sse_data):
+                                    yield sse_data
+                                    await asyncio.sleep(1)
 
                     # If we processed at least one event without exceptions, mark as success
                     if processed_events > 0:
                         success = True
+                        self.retry_policy.record_success()
+                        # The analyzer instructions are in the session now; follow-ups leave them out
+                        self.prompt_builder.mark_primed(session_id, CI_ANALYSIS)
                     else:
                         raise Exception("No events were processed from the stream response")
 
 
                 except Exception as e:
-                    retry_count += 1
-                    logger.error(f"[{request_id}] Attempt {retry_count}/{max_retries} failed: {str(e)}", exc_info=True)
-                    if retry_count < max_retries:
-                        backoff_time = min(2 ** retry_count, 10)  # Cap at 10 seconds
-                        logger.info(f"[{request_id}] Retrying in {backoff_time} seconds...")
+                    logger.error(f"[{request_id}] Attempt {attempt}/{max_retries} failed: {str(e)}", exc_info=True)
+                    backoff_time = self.retry_policy.next_delay(attempt)
+                    if backoff_time is not None:
+                        logger.info(f"[{request_id}] Retrying in {backoff_time:.2f} seconds...")
                         await asyncio.sleep(backoff_time)
                     else:
-                        logger.error(f"[{request_id}] All {max_retries} attempts failed")
+                        logger.error(f"[{request_id}] Giving up after {attempt} attempts")
                         yield f"data: {{\"error\": \"Internal server error\"}}\n\n"
                         yield "data: [DONE]\n\n"
+                        return
 
             if success:
                 final_marker = "data: [DONE]\n\n"
                 logger.info(f"[{request_id}] Yielding final marker: {final_marker}")
                 yield final_marker
 
+        except CircuitOpenError as e:
+            logger.warning(f"[{request_id}] Rejecting CI error analysis: {str(e)}")
+            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+            yield "data: [DONE]\n\n"
         except Exception as e:
             logger.error(f"[{request_id}] Error in analyze_error: {str(e)}", exc_info=True)
             error_msg = str(e)
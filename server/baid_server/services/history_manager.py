@@ -0,0 +1,213 @@
+"""
+Bounded conversation history for long sessions.
+
+The agent engine replays the whole history of its session on every turn, so a
+user session is backed by an agent session that is rotated once the tokens sent
+into it exceed a budget. The fresh agent session is seeded with a rolling
+extractive summary of older turns plus a token-budgeted window of the most
+recent ones, which keeps per-turn cost flat as the user session grows.
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from baid_server.db.repositories.message_repository import MessageRepository
+from baid_server.db.repositories.session_repository import SessionRepository
+from baid_server.db.repositories.summary_repository import SummaryRepository
+from baid_server.services.message_sink import MessageSink
+from baid_server.utils.tokens import count_tokens, count_tokens_async, count_tokens_batch, offload_tokenizing
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+SUMMARY_LINE_TOKENS = 40
+
+
+@dataclass
+class AgentSession:
+    """The agent session to query, and the history to seed it with if it was just created."""
+    agent_session_id: str
+    carry_over: Optional[str] = None
+
+
+def plain_text(content: str) -> str:
+    """Readable text of a stored message; assistant messages are JSON block responses."""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content.strip()
+
+    texts: List[str] = []
+
+    def collect(node: Any) -> None:
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "content" and isinstance(value, str):
+                    texts.append(value)
+                else:
+                    collect(value)
+        elif isinstance(node, list):
+            for item in node:
+                collect(item)
+
+    collect(data)
+    return " ".join(texts).strip() if texts else content.strip()
+
+
+def _longest_fitting_prefix(length: int, fits: Callable[[int], bool]) -> int:
+    """Largest n in [0, length] with fits(n), for a ``fits`` that only turns false as n grows."""
+    low, high = 0, length
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most ``max_tokens`` tokens, on a word boundary where possible.
+
+    The cut is checked with the configured tokenizer; token counts grow with the
+    prefix, so the longest prefix within budget is found by bisection.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    def fits(prefix: str) -> bool:
+        return count_tokens(prefix + " ...") <= max_tokens
+
+    words = text.split()
+    kept = _longest_fitting_prefix(len(words), lambda n: fits(" ".join(words[:n])))
+    if kept:
+        return " ".join(words[:kept]) + " ..."
+    # Not even the first word fits, e.g. minified code: cut inside it
+    first = words[0] if words else text
+    return first[:_longest_fitting_prefix(len(first), lambda n: fits(first[:n]))] + " ..."
+
+
+def split_window(messages: List[Dict[str, Any]], window_tokens: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split messages into (older, recent) where recent is the newest run fitting in the budget.
+
+    The newest message is always part of the window, truncated if necessary.
+    """
+    used = 0
+    start = len(messages)
+    token_counts = count_tokens_batch([plain_text(message["content"]) for message in messages])
+    for index in range(len(messages) - 1, -1, -1):
+        tokens = token_counts[index]
+        if start < len(messages) and used + tokens > window_tokens:
+            break
+        used += tokens
+        start = index
+    return messages[:start], messages[start:]
+
+
+def summarize(previous_summary: str, messages: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Extend a rolling summary with the first sentence of each message, keeping the newest lines."""
+    lines = previous_summary.splitlines() if previous_summary else []
+    for message in messages:
+        first_sentence = _SENTENCE_END.split(plain_text(message["content"]), maxsplit=1)[0]
+        lines.append(f"- {message['role']}: {truncate_tokens(first_sentence, SUMMARY_LINE_TOKENS)}")
+
+    # Drop the oldest lines once the summary is over budget
+    while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def format_carry_over(summary: str, recent: List[Dict[str, Any]], window_tokens: int) -> str:
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation:\n{summary}")
+    if recent:
+        turns = "\n".join(
+            f"{message['role']}: {truncate_tokens(plain_text(message['content']), window_tokens)}"
+            for message in recent
+        )
+        parts.append(f"Most recent messages of the conversation:\n{turns}")
+    return "\n\n".join(parts)
+
+
+class HistoryManager:
+    """Keeps the history replayed by the agent engine within a token budget."""
+
+    def __init__(
+            self,
+            message_repository: MessageRepository,
+            session_repository: SessionRepository,
+            summary_repository: SummaryRepository,
+            agent_session_token_budget: int = 32000,
+            window_tokens: int = 4000,
+            summary_tokens: int = 1000,
+            message_sink: Optional[MessageSink] = None,
+    ):
+        self.message_repository = message_repository
+        self.message_sink = message_sink
+        self.session_repository = session_repository
+        self.summary_repository = summary_repository
+        self.agent_session_token_budget = agent_session_token_budget
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+
+    async def agent_session_for(
+            self,
+            user_id: str,
+            session_id: str,
+            create_agent_session: Callable[[], str],
+    ) -> AgentSession:
+        """Return the agent session for the next turn, rotating it when over budget.
+
+        Steady-state turns are answered from the session repository's cache without a query.
+        """
+        agent_session_id, tokens = await self.session_repository.get_agent_session(user_id, session_id)
+        if tokens < self.agent_session_token_budget:
+            return AgentSession(agent_session_id)
+
+        carry_over = await self.compact(user_id, session_id)
+        new_agent_session_id = create_agent_session()
+        await self.session_repository.rotate_agent_session(
+            user_id, session_id, new_agent_session_id, await count_tokens_async(carry_over)
+        )
+        logger.info(f"Session {session_id} used {tokens} tokens; continuing in agent session {new_agent_session_id}")
+        return AgentSession(new_agent_session_id, carry_over)
+
+    async def compact(self, user_id: str, session_id: str) -> str:
+        """Fold turns older than the window into the rolling summary and return the carry-over text."""
+        # The previous turn may still be waiting in the write-behind sink
+        if self.message_sink is not None:
+            await self.message_sink.flush()
+        previous = await self.summary_repository.get_latest_summary(user_id, session_id)
+        summary = previous["summary"] if previous else ""
+        after_id = previous["summarized_until_id"] if previous else 0
+
+        messages = await self.message_repository.get_messages_after(user_id, session_id, after_id)
+        # Windowing and summarizing count tokens throughout; keep a model tokenizer off the event loop
+        summary, summary_tokens, summarized_until_id, carry_over = await offload_tokenizing(
+            self._fold, summary, messages
+        )
+        if summarized_until_id is not None:
+            await self.summary_repository.store_summary(
+                user_id, session_id, summary, summarized_until_id, summary_tokens
+            )
+        return carry_over
+
+    def _fold(self, summary: str, messages: List[Dict[str, Any]]) -> Tuple[str, int, Optional[int], str]:
+        """(summary, its tokens, id of the last summarized message or None, carry-over text)."""
+        older, recent = split_window(messages, self.window_tokens)
+        summarized_until_id = None
+        if older:
+            summary = summarize(summary, older, self.summary_tokens)
+            summarized_until_id = older[-1]["id"]
+        summary_tokens = count_tokens(summary) if summarized_until_id is not None else 0
+        return summary, summary_tokens, summarized_until_id, format_carry_over(summary, recent, self.window_tokens)
+
+    def record_turn(self, user_id: str, session_id: str, tokens: int) -> None:
+        """Account for the tokens a turn added to the agent session's history.
+
+        The count is batched; the session repository writes it with its periodic flush.
+        """
+        self.session_repository.add_agent_session_tokens(user_id, session_id, tokens)
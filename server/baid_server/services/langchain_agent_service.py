@@ -12,7 +12,8 @@ from vertexai.agent_engines.templates.langchain import LangchainAgent
 from baid_server.core.parser.agent_response import parse_langchain_agent_stream
 from baid_server.db.repositories.message_repository import MessageRepository
 from baid_server.db.repositories.session_repository import SessionRepository
-from baid_server.prompts import RESPONSE_FORMAT
+from baid_server.prompts.builder import PromptBuilder
+from baid_server.services.retry_policy import CircuitOpenError, RetryPolicy, SentEventTracker
 from baid_server.utils.response_parser import ResponseParser
 
 logger = logging.getLogger(__name__)
@@ -46,8 +47,12 @@ class LangchainAgentService:
         session_repository: SessionRepository,
         response_processor: ResponseParser,
         config: AgentConfig = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
     ):
         self.config = config or AgentConfig()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.prompt_builder = prompt_builder or PromptBuilder()
         self.message_repository = message_repository
         self.session_repository = session_repository
         self.response_processor = response_processor
@@ -87,20 +92,8 @@ class LangchainAgentService:
                 await self.session_repository.store_session_mapping(user_id, session_id)
                 logger.info(f"[{request_id}] Stored existing session {session_id} for user {user_id}")
 
-        # Extract context information
-        file_content = context.get("file_content", "")
-        is_open = context.get("is_open", False)
-
-        # Prepare message with format instructions
-        if is_open:
-            message = f"{user_input}\n\nFile content: {file_content}" + "\n" + user_input
-        else:
-            message = user_input
-
-        message = message + "\n\n" + f"""
-        Your response should follow the JSON format specified strictly.
-        {RESPONSE_FORMAT}
-        """
+        # Prepare message; format instructions are only sent until the session has them
+        message = self.prompt_builder.consult_message(session_id, user_input, context)
 
         # Store user message in database
         await self.message_repository.store_message(user_id, session_id, "user", user_input)
@@ -109,15 +102,19 @@ class LangchainAgentService:
         full_response = ""
 
         try:
-            # Implement retry mechanism - attempt up to 3 times
-            max_retries = 3
-            retry_count = 0
+            # Implement retry mechanism shared with the other agent services
+            self.retry_policy.begin()
+            sent_events = SentEventTracker()
+            max_retries = self.retry_policy.max_attempts
+            attempt = 0
             success = False
 
-            while retry_count < max_retries and not success:
+            while not success:
+                attempt += 1
+                sent_events.new_attempt()
                 try:
                     logger.info(
-                        f"[{request_id}] Attempt {retry_count + 1}/{max_retries} to query and process reasoning engine response")
+                        f"[{request_id}] Attempt {attempt}/{max_retries} to query and process reasoning engine response")
                     processed_events = 0
 
                     for idx, event in enumerate(parse_langchain_agent_stream(agent.stream_query(
@@ -152,37 +149,38 @@ class LangchainAgentService:
                             logger.info(f"[{request_id}] Processed SSE data: {repr(sse_data)}")
                             if sse_data:
                                 processed_events += 1
-                                yield sse_data
-                                await asyncio.sleep(1)
+                                if sent_events.should_send(sse_data):
+                                    yield sse_data
+                                    await asyncio.sleep(1)
 
                     # If we processed at least one event without exceptions, mark as success
                     if processed_events > 0:
                         success = True
+                        self.retry_policy.record_success()
+                        self.prompt_builder.mark_primed(session_id)
                     else:
                         # No events processed, consider this a failed attempt
                         raise Exception("No events were processed from the stream response")
 
                 except Exception as e:
-                    retry_count += 1
                     logger.error(
-                        f"[{request_id}] Error in query or processing (attempt {retry_count}/{max_retries}): {str(e)}")
+                        f"[{request_id}] Error in query or processing (attempt {attempt}/{max_retries}): {str(e)}")
 
                     # Clear the response for retry
                     full_response = ""
 
-                    if retry_count >= max_retries:
-                        # If we've exhausted all retries, inform the client
-                        logger.error(f"[{request_id}] Max retries ({max_retries}) reached, giving up")
-                        yield f"data: {{\"error\": \"Failed after {max_retries} attempts. Last error: {str(e)}\"}}\n\n"
+                    backoff_time = self.retry_policy.next_delay(attempt)
+                    if backoff_time is None:
+                        # Out of attempts, retry budget or circuit: inform the client
+                        logger.error(f"[{request_id}] Giving up after {attempt} attempts")
+                        yield f"data: {{\"error\": \"Failed after {attempt} attempts. Last error: {str(e)}\"}}\n\n"
                         # Send final markers even after error
                         session_data = f"data: {{\"session_id\": \"{session_id}\"}}\n\n"
                         yield session_data
                         yield "data: [DONE]\n\n"
                         return
 
-                    # Wait before retrying (exponential backoff)
-                    backoff_time = 2 ** retry_count  # 2, 4, 8 seconds
-                    logger.info(f"[{request_id}] Waiting {backoff_time} seconds before retry")
+                    logger.info(f"[{request_id}] Waiting {backoff_time:.2f} seconds before retry")
                     await asyncio.sleep(backoff_time)
 
 
@@ -197,6 +195,10 @@ class LangchainAgentService:
                 final_marker = "data: [DONE]\n\n"
                 logger.info(f"[{request_id}] Yielding final marker: {final_marker}")
                 yield final_marker
+        except CircuitOpenError as e:
+            logger.warning(f"[{request_id}] Rejecting query: {str(e)}")
+            yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+            yield "data: [DONE]\n\n"
         except Exception as e:
             print("Error in streaming response", e)
             logger.error(f"[{request_id}] Error in streaming response: {str(e)}", exc_info=True)
@@ -0,0 +1,142 @@
+"""Write-behind sink that persists chat messages off the response path."""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from baid_server.db.repositories.message_repository import MessageRepository
+
+logger = logging.getLogger(__name__)
+
+# (user_id, session_id, role, content, timestamp)
+PendingMessage = Tuple[str, str, str, str, datetime]
+
+# Queue marker asking the drain task to flush what it has and exit
+_STOP = object()
+
+
+def _release(flushed: asyncio.Future) -> None:
+    """Wake a flush() caller, unless it stopped waiting."""
+    if not flushed.done():
+        flushed.set_result(None)
+
+
+class MessageSink:
+    """Bounded in-process queue of messages drained in batches by a background task.
+
+    A batch is flushed when it reaches ``batch_size`` messages or when ``flush_interval``
+    seconds have passed since its first message. When the sink is not running or the
+    queue is full, messages are written directly so nothing is dropped. ``flush`` waits
+    for everything queued before it, for readers that need the latest messages.
+    """
+
+    def __init__(
+            self,
+            message_repository: MessageRepository,
+            max_queue_size: int = 1000,
+            batch_size: int = 100,
+            flush_interval: float = 0.5,
+    ):
+        self.message_repository = message_repository
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._accepting = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._accepting and self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+        self._accepting = True
+        logger.info(f"Message sink started (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+
+    async def stop(self) -> None:
+        """Flush every queued message and stop the drain task."""
+        if not self.is_running:
+            return
+        # New messages are written directly from here on
+        self._accepting = False
+        await self._queue.put(_STOP)
+        await self._task
+        leftovers = []
+        flush_requests = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if isinstance(item, asyncio.Future):
+                flush_requests.append(item)
+            elif item is not _STOP:
+                leftovers.append(item)
+        if leftovers:
+            await self._flush(leftovers)
+        for flushed in flush_requests:
+            _release(flushed)
+        self._task = None
+        self._queue = None
+        logger.info("Message sink stopped")
+
+    async def enqueue(self, user_id: str, session_id: str, role: str, content: str) -> None:
+        """Queue a message for persistence, writing it directly if the sink cannot take it."""
+        message = (user_id, session_id, role, content, datetime.now(timezone.utc))
+        if self.is_running:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                logger.warning("Message sink queue is full, writing message directly")
+        await self._flush([message])
+
+    async def flush(self) -> None:
+        """Return once every message queued so far has been written."""
+        if not self.is_running:
+            return
+        # The drain task writes its batch when it reaches the marker; the queue is FIFO
+        flushed = asyncio.get_running_loop().create_future()
+        await self._queue.put(flushed)
+        await flushed
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            if isinstance(item, asyncio.Future):
+                _release(item)
+                continue
+            batch: List[PendingMessage] = [item]
+            flushed = None
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, asyncio.Future):
+                    flushed = item
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if flushed is not None:
+                _release(flushed)
+
+    async def _flush(self, batch: List[PendingMessage]) -> None:
+        try:
+            await self.message_repository.store_messages(batch)
+            logger.debug(f"Flushed {len(batch)} messages")
+        except Exception as e:
+            # Continue execution even if message storage fails
+            logger.error(f"Error flushing {len(batch)} messages: {str(e)}")
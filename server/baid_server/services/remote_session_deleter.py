@@ -0,0 +1,62 @@
+"""Background deletion of agent engine sessions queued by session deletes."""
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from baid_server.db.repositories.remote_session_deletion_repository import RemoteSessionDeletionRepository
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteSessionDeleter:
+    """Works through the remote_session_deletions queue, a batch per run.
+
+    ``delete_session(user_id, agent_session_id)`` is the agent engine
+    coroutine; it must treat an already deleted session as deleted. Failed
+    deletions are retried with an exponential backoff and left in the queue
+    after ``max_attempts``.
+    """
+
+    def __init__(
+            self,
+            repository: RemoteSessionDeletionRepository,
+            delete_session: Callable[[str, str], Awaitable[None]],
+            batch_size: int = 50,
+            concurrency: int = 4,
+            max_attempts: int = 8,
+            retry_delay: float = 60.0,
+            lease: float = 300.0,
+    ):
+        self.repository = repository
+        self.delete_session = delete_session
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _delete(self, deletion) -> bool:
+        async with self._semaphore:
+            try:
+                await self.delete_session(deletion["user_id"], deletion["agent_session_id"])
+                return True
+            except Exception as e:
+                delay = self.retry_delay * 2 ** (deletion["attempts"] - 1)
+                if deletion["attempts"] >= self.max_attempts:
+                    logger.error(f"Giving up deleting agent session {deletion['agent_session_id']}: {str(e)}")
+                else:
+                    logger.warning(f"Failed to delete agent session {deletion['agent_session_id']}, "
+                                   f"retrying in {delay:.0f}s: {str(e)}")
+                await self.repository.retry_later(deletion["id"], str(e), delay)
+                return False
+
+    async def run_once(self) -> int:
+        """Delete one batch of due sessions; returns how many were deleted."""
+        deletions = await self.repository.claim(self.batch_size, self.lease, self.max_attempts)
+        if not deletions:
+            return 0
+        results = await asyncio.gather(*(self._delete(deletion) for deletion in deletions))
+        done = [deletion["id"] for deletion, deleted in zip(deletions, results) if deleted]
+        await self.repository.complete(done)
+        logger.info(f"Deleted {len(done)} of {len(deletions)} queued agent sessions")
+        return len(done)
@@ -0,0 +1,129 @@
+"""Caches of completed SSE responses, replayed instead of re-running the agent."""
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+import asyncpg
+
+from baid_server.db.database import get_db_pool
+from baid_server.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache(ABC):
+    """Stores the SSE events of a finished response under a namespace and key.
+
+    Namespaces group entries that are invalidated together, e.g. per tenant.
+    """
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> Optional[List[str]]:
+        """Return the cached events, or None on a miss."""
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, events: List[str], ttl: float) -> None:
+        """Cache events for ``ttl`` seconds."""
+
+    @abstractmethod
+    async def invalidate(self, namespace: str) -> int:
+        """Drop every entry in a namespace and return how many were removed."""
+
+    async def purge_expired(self) -> None:
+        """Remove expired entries; in-memory caches expire lazily."""
+
+
+class InMemoryResponseCache(ResponseCache):
+    """Per-process LRU cache of responses."""
+
+    def __init__(self, max_size: int = 1000):
+        self._entries: TTLCache[tuple, List[str]] = TTLCache(maxsize=max_size)
+
+    async def get(self, namespace: str, key: str) -> Optional[List[str]]:
+        return self._entries.get((namespace, key))
+
+    async def set(self, namespace: str, key: str, events: List[str], ttl: float) -> None:
+        self._entries.set((namespace, key), list(events), ttl=ttl)
+
+    async def invalidate(self, namespace: str) -> int:
+        return self._entries.discard_where(lambda entry_key: entry_key[0] == namespace)
+
+
+class PostgresResponseCache(ResponseCache):
+    """Response cache shared by all server instances through the response_cache table.
+
+    Several caches share the table; ``scope`` is the namespace prefix whose rows
+    count towards ``max_size``.
+    """
+
+    def __init__(self, db_pool: Optional[asyncpg.Pool] = None, max_size: int = 10000, scope: str = ""):
+        self._db_pool = db_pool
+        self.max_size = max_size
+        self.scope = scope
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        if self._db_pool is None:
+            return await get_db_pool()
+        return self._db_pool
+
+    async def get(self, namespace: str, key: str) -> Optional[List[str]]:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            try:
+                events = await conn.fetchval('''
+                UPDATE response_cache
+                SET last_hit_at = CURRENT_TIMESTAMP
+                WHERE namespace = $1 AND cache_key = $2 AND expires_at > CURRENT_TIMESTAMP
+                RETURNING events
+                ''', namespace, key)
+            except Exception as e:
+                logger.error(f"Error reading response cache: {str(e)}")
+                return None
+        return json.loads(events) if events is not None else None
+
+    async def set(self, namespace: str, key: str, events: List[str], ttl: float) -> None:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            try:
+                await conn.execute('''
+                INSERT INTO response_cache (namespace, cache_key, events, expires_at)
+                VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP + make_interval(secs => $4))
+                ON CONFLICT (namespace, cache_key) DO UPDATE SET
+                    events = EXCLUDED.events,
+                    created_at = CURRENT_TIMESTAMP,
+                    last_hit_at = CURRENT_TIMESTAMP,
+                    expires_at = EXCLUDED.expires_at
+                ''', namespace, key, json.dumps(events), float(ttl))
+            except Exception as e:
+                logger.error(f"Error writing response cache: {str(e)}")
+
+    async def invalidate(self, namespace: str) -> int:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute("DELETE FROM response_cache WHERE namespace = $1", namespace)
+        return int(result.split()[-1])
+
+    async def purge_expired(self) -> None:
+        """Delete expired rows and evict the least recently hit rows above max_size."""
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM response_cache WHERE expires_at <= CURRENT_TIMESTAMP")
+            await conn.execute('''
+            DELETE FROM response_cache
+            WHERE (namespace, cache_key) IN (
+                SELECT namespace, cache_key FROM response_cache
+                WHERE starts_with(namespace, $2)
+                ORDER BY last_hit_at DESC
+                OFFSET $1
+            )
+            ''', self.max_size, self.scope)
+
+
+def create_response_cache(backend: str, max_size: int, scope: str = "") -> ResponseCache:
+    """Create a response cache for the configured backend ("memory" or "postgres")."""
+    if backend == "memory":
+        return InMemoryResponseCache(max_size=max_size)
+    if backend == "postgres":
+        return PostgresResponseCache(max_size=max_size, scope=scope)
+    raise ValueError(f"Unknown response cache backend: {backend}")
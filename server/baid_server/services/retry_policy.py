@@ -0,0 +1,186 @@
+"""
+Retry policy shared by the services that stream from the agent engine.
+
+Retries use full-jitter exponential backoff, draw from a global retry budget so
+they cannot multiply load during an upstream brownout, and stop early while the
+circuit breaker on the agent engine is open.
+"""
+import logging
+import random
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is rejected because the agent engine circuit is open."""
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of the request rate.
+
+    Every request deposits ``ratio`` tokens and every retry withdraws one, so in
+    steady state at most ``ratio`` retries are issued per request.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+    def record_request(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures and rejects calls for
+    ``reset_timeout`` seconds, then lets a single probe through (half-open).
+
+    A probe that reports neither success nor failure within ``probe_timeout``
+    seconds (an abandoned stream, a cancelled task) no longer blocks the next one.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+            self,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30.0,
+            probe_timeout: Optional[float] = None,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = reset_timeout if probe_timeout is None else probe_timeout
+        self._timer = timer
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._timer() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight():
+            self._probe_started = self._timer()
+            return True
+        return False
+
+    def _probe_in_flight(self) -> bool:
+        return self._probe_started is not None and self._timer() - self._probe_started < self.probe_timeout
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("Agent engine circuit closed")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        probing = self._probe_started is not None
+        if probing or self._failures >= self.failure_threshold:
+            if self._opened_at is None or probing:
+                logger.warning(f"Agent engine circuit opened after {self._failures} consecutive failures")
+            self._opened_at = self._timer()
+            self._probe_started = None
+
+
+class RetryPolicy:
+    """Decides whether and when a failed upstream attempt is retried.
+
+    Usage per logical request::
+
+        policy.begin()                     # raises CircuitOpenError
+        ...attempt...
+        policy.record_success()            # or
+        delay = policy.next_delay(attempt) # None -> give up
+    """
+
+    def __init__(
+            self,
+            max_attempts: int = 3,
+            base_delay: float = 1.0,
+            max_delay: float = 10.0,
+            budget: Optional[RetryBudget] = None,
+            breaker: Optional[CircuitBreaker] = None,
+            rng: Callable[[], float] = random.random,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self._rng = rng
+
+    def begin(self) -> None:
+        """Register a new request, rejecting it while the circuit is open."""
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Agent engine is temporarily unavailable, please try again shortly")
+        self.budget.record_request()
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter backoff: a random delay up to base_delay * 2**attempt, capped."""
+        return self._rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    def next_delay(self, attempt: int) -> Optional[float]:
+        """Record failed ``attempt`` (1-based) and return the delay before the next one,
+        or None when the request should give up."""
+        self.breaker.record_failure()
+        if attempt >= self.max_attempts:
+            return None
+        if not self.breaker.allow_request():
+            logger.warning("Not retrying: agent engine circuit is open")
+            return None
+        if not self.budget.try_acquire():
+            logger.warning("Not retrying: retry budget exhausted")
+            return None
+        return self.backoff(attempt)
+
+
+class SentEventTracker:
+    """Suppresses events that a retried attempt regenerates after the client already
+    received them.
+
+    Events are counted per attempt, so a block legitimately repeated within one
+    answer is still sent as often as it occurs.
+    """
+
+    def __init__(self):
+        self._sent: Counter = Counter()
+        self._attempt: Counter = Counter()
+
+    def new_attempt(self) -> None:
+        self._attempt = Counter()
+
+    def should_send(self, event: str) -> bool:
+        self._attempt[event] += 1
+        if self._attempt[event] <= self._sent[event]:
+            return False
+        self._sent[event] += 1
+        return True
@@ -1,14 +1,33 @@
 import os
 import logging
-from typing import Optional, TypeVar, Generic, Type
+from functools import partial
+from typing import List, Optional, TypeVar, Generic, Type
 
 from google.adk.sessions import VertexAiSessionService
 
+from baid_server.config import settings
 from baid_server.services.agent_service import AgentService, AgentConfig
+from baid_server.services.answer_cache import AnswerCache
+from baid_server.services.ci_analysis_cache import CIAnalysisCoalescer
 from baid_server.services.ci_error_service import CIErrorService, CIErrorServiceConfig
+from baid_server.services.history_manager import HistoryManager
+from baid_server.services.message_sink import MessageSink
+from baid_server.services.remote_session_deleter import RemoteSessionDeleter
+from baid_server.services.response_cache import create_response_cache
+from baid_server.services.retry_policy import CircuitBreaker, RetryBudget, RetryPolicy
+from baid_server.services.stream_registry import StreamRegistry
+from baid_server.services.upstream_scheduler import UpstreamScheduler, parse_tenant_weights
+from baid_server.prompts.builder import PromptBuilder
 from baid_server.db.repositories.message_repository import MessageRepository
+from baid_server.db.repositories.remote_session_deletion_repository import RemoteSessionDeletionRepository
 from baid_server.db.repositories.session_repository import SessionRepository
+from baid_server.db.repositories.summary_repository import SummaryRepository
+from baid_server.db.repositories.token_usage_repository import TokenUsageRepository
+from baid_server.db.repositories.user_limit_repository import UserLimitRepository
+from baid_server.db.repositories.user_repository import UserRepository
 from baid_server.services.langchain_agent_service import LangchainAgentService
+from baid_server.utils.background import PeriodicTask
+from baid_server.utils.lazy import AsyncLazy
 from baid_server.utils.response_parser import ResponseParser
 from baid_server.db.database import get_db_pool
 
@@ -17,60 +36,312 @@ logger = logging.getLogger(__name__)
 T = TypeVar('T')
 
 class ServiceFactory(Generic[T]):
-    _agent_service: Optional[AgentService] = None
-    _ci_error_service: Optional[CIErrorService] = None
+    # Built once by the first caller; concurrent first requests wait for the same build
+    _agent_service: AsyncLazy[AgentService] = AsyncLazy(
+        lambda: ServiceFactory._create_agent_service(), name="agent service")
+    _ci_error_service: AsyncLazy[CIErrorService] = AsyncLazy(
+        lambda: ServiceFactory._create_ci_error_service(), name="CI error service")
+    _message_sink: AsyncLazy[Optional[MessageSink]] = AsyncLazy(
+        lambda: ServiceFactory._create_message_sink(), name="message sink")
+    _background_tasks_started: AsyncLazy[None] = AsyncLazy(
+        lambda: ServiceFactory._start_background_tasks(), name="background tasks")
+    _ci_analysis_coalescer: Optional[CIAnalysisCoalescer] = None
+    _answer_cache: Optional[AnswerCache] = None
+    _stream_registry: Optional[StreamRegistry] = None
+    _retry_policy: Optional[RetryPolicy] = None
+    _upstream_scheduler: Optional[UpstreamScheduler] = None
+    _prompt_builder: Optional[PromptBuilder] = None
+    _user_limit_listener: Optional[UserLimitRepository] = None
+    _background_tasks: List[PeriodicTask] = []
 
     @classmethod
-    async def initialize_agent_service(cls) -> AgentService:
-        if cls._agent_service is None:
-            logger.info("Initializing agent service")
-            db_pool = await get_db_pool()
-            
-            cls._agent_service = AgentService(
-                config=AgentConfig(
-                    agent_engine_id=os.getenv("AGENT_ENGINE_ID", ""),
-                    project_id=os.getenv("PROJECT_ID", ""),
-                    location=os.getenv("LOCATION", ""),
+    async def initialize_message_sink(cls) -> Optional[MessageSink]:
+        return await cls._message_sink.get()
+
+    @classmethod
+    async def _create_message_sink(cls) -> Optional[MessageSink]:
+        if not settings.MESSAGE_SINK_ENABLED:
+            return None
+        logger.info("Initializing message sink")
+        message_sink = MessageSink(
+            message_repository=MessageRepository(db_pool=await get_db_pool()),
+            max_queue_size=settings.MESSAGE_SINK_MAX_QUEUE_SIZE,
+            batch_size=settings.MESSAGE_SINK_BATCH_SIZE,
+            flush_interval=settings.MESSAGE_SINK_FLUSH_INTERVAL,
+        )
+        await message_sink.start()
+        logger.info("Message sink initialized")
+        return message_sink
+
+    @classmethod
+    def initialize_answer_cache(cls) -> Optional[AnswerCache]:
+        if cls._answer_cache is None and settings.ANSWER_CACHE_ENABLED:
+            logger.info(f"Initializing answer cache ({settings.ANSWER_CACHE_BACKEND})")
+            cls._answer_cache = AnswerCache(
+                cache=create_response_cache(
+                    backend=settings.ANSWER_CACHE_BACKEND,
+                    max_size=settings.ANSWER_CACHE_MAX_SIZE,
+                    scope="answers:",
                 ),
-                session_service=VertexAiSessionService (
-                    project=os.getenv("PROJECT_ID", ""),
-                    location=os.getenv("LOCATION", "")
+                ttl=settings.ANSWER_CACHE_TTL,
+            )
+        return cls._answer_cache
+
+    @classmethod
+    def get_retry_policy(cls) -> RetryPolicy:
+        """The retry policy, budget and circuit breaker shared by every agent engine client."""
+        if cls._retry_policy is None:
+            cls._retry_policy = RetryPolicy(
+                max_attempts=settings.RETRY_MAX_ATTEMPTS,
+                base_delay=settings.RETRY_BASE_DELAY,
+                max_delay=settings.RETRY_MAX_DELAY,
+                budget=RetryBudget(
+                    ratio=settings.RETRY_BUDGET_RATIO,
+                    max_tokens=settings.RETRY_BUDGET_MAX_TOKENS,
                 ),
+                breaker=CircuitBreaker(
+                    failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                ),
+            )
+        return cls._retry_policy
+
+    @classmethod
+    def get_upstream_scheduler(cls) -> Optional[UpstreamScheduler]:
+        """The scheduler every agent engine call on this instance goes through."""
+        if cls._upstream_scheduler is None and settings.UPSTREAM_SCHEDULER_ENABLED:
+            cls._upstream_scheduler = UpstreamScheduler(
+                max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+                per_tenant_limit=settings.UPSTREAM_PER_TENANT_LIMIT,
+                per_user_limit=settings.UPSTREAM_PER_USER_LIMIT,
+                max_queue_depth=settings.UPSTREAM_MAX_QUEUE_DEPTH,
+                max_tenant_queue_depth=settings.UPSTREAM_MAX_TENANT_QUEUE_DEPTH,
+                queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+                tenant_weights=parse_tenant_weights(settings.UPSTREAM_TENANT_WEIGHTS),
+            )
+        return cls._upstream_scheduler
+
+    @classmethod
+    def get_prompt_builder(cls) -> PromptBuilder:
+        if cls._prompt_builder is None:
+            cls._prompt_builder = PromptBuilder(
+                mode=settings.PROMPT_INSTRUCTIONS_MODE,
+                max_sessions=settings.SESSION_CACHE_MAX_SIZE,
+            )
+        return cls._prompt_builder
+
+    @classmethod
+    def initialize_stream_registry(cls) -> Optional[StreamRegistry]:
+        if cls._stream_registry is None and settings.STREAM_RESUME_ENABLED:
+            cls._stream_registry = StreamRegistry(
+                replay_ttl=settings.STREAM_RESUME_TTL,
+                max_streams=settings.STREAM_RESUME_MAX_STREAMS,
+            )
+        return cls._stream_registry
+
+    @classmethod
+    async def initialize_agent_service(cls) -> AgentService:
+        return await cls._agent_service.get()
+
+    @classmethod
+    async def _create_agent_service(cls) -> AgentService:
+        logger.info("Initializing agent service")
+        db_pool = await get_db_pool()
+        message_sink = await cls.initialize_message_sink()
+        history_manager = None
+        if settings.HISTORY_MANAGEMENT_ENABLED:
+            history_manager = HistoryManager(
                 message_repository=MessageRepository(db_pool=db_pool),
                 session_repository=SessionRepository(db_pool=db_pool),
-                response_processor=ResponseParser()
+                summary_repository=SummaryRepository(db_pool=db_pool),
+                agent_session_token_budget=settings.HISTORY_AGENT_SESSION_TOKEN_BUDGET,
+                window_tokens=settings.HISTORY_WINDOW_TOKENS,
+                summary_tokens=settings.HISTORY_SUMMARY_TOKENS,
+                message_sink=message_sink,
             )
-            logger.info("Agent service initialized")
-        
-        return cls._agent_service
+
+        agent_service = AgentService(
+            config=AgentConfig(
+                agent_engine_id=os.getenv("AGENT_ENGINE_ID", ""),
+                project_id=os.getenv("PROJECT_ID", ""),
+                location=os.getenv("LOCATION", ""),
+            ),
+            session_service=VertexAiSessionService (
+                project=os.getenv("PROJECT_ID", ""),
+                location=os.getenv("LOCATION", "")
+            ),
+            message_repository=MessageRepository(db_pool=db_pool),
+            session_repository=SessionRepository(db_pool=db_pool),
+            response_processor=ResponseParser(),
+            message_sink=message_sink,
+            answer_cache=cls.initialize_answer_cache(),
+            retry_policy=cls.get_retry_policy(),
+            prompt_builder=cls.get_prompt_builder(),
+            history_manager=history_manager,
+            token_usage_repository=TokenUsageRepository(db_pool=db_pool)
+        )
+        logger.info("Agent service initialized")
+        return agent_service
 
     @classmethod
     def get_agent_service(cls) -> AgentService:
-        if cls._agent_service is None:
+        if not cls._agent_service.is_initialized:
             raise RuntimeError("AgentService not initialized")
-        return cls._agent_service
+        return cls._agent_service.value
 
     @classmethod
     async def initialize_ci_error_service(cls) -> CIErrorService:
-        if cls._ci_error_service is None:
-            logger.info("Initializing CI Error service")
-            cls._ci_error_service = CIErrorService(
-                config=CIErrorServiceConfig(
-                    agent_engine_id=os.getenv("AGENT_ENGINE_ID", ""),
-                    project_id=os.getenv("PROJECT_ID", ""),
-                    location=os.getenv("LOCATION", "")
-                )
-            )
-            logger.info("CI Error service initialized")
-        return cls._ci_error_service
+        return await cls._ci_error_service.get()
+
+    @classmethod
+    async def _create_ci_error_service(cls) -> CIErrorService:
+        logger.info("Initializing CI Error service")
+        ci_error_service = CIErrorService(
+            config=CIErrorServiceConfig(
+                agent_engine_id=os.getenv("AGENT_ENGINE_ID", ""),
+                project_id=os.getenv("PROJECT_ID", ""),
+                location=os.getenv("LOCATION", "")
+            ),
+            retry_policy=cls.get_retry_policy(),
+            prompt_builder=cls.get_prompt_builder()
+        )
+        logger.info("CI Error service initialized")
+        return ci_error_service
 
     @classmethod
     def get_ci_error_service(cls) -> CIErrorService:
-        if cls._ci_error_service is None:
+        if not cls._ci_error_service.is_initialized:
             raise RuntimeError("CIErrorService not initialized")
-        return cls._ci_error_service
+        return cls._ci_error_service.value
+
+    @classmethod
+    async def initialize_ci_analysis_coalescer(cls) -> Optional[CIAnalysisCoalescer]:
+        if cls._ci_analysis_coalescer is None and settings.CI_ANALYSIS_CACHE_ENABLED:
+            logger.info(f"Initializing CI analysis cache ({settings.CI_ANALYSIS_CACHE_BACKEND})")
+            cls._ci_analysis_coalescer = CIAnalysisCoalescer(
+                cache=create_response_cache(
+                    backend=settings.CI_ANALYSIS_CACHE_BACKEND,
+                    max_size=settings.CI_ANALYSIS_CACHE_MAX_SIZE,
+                    scope="ci:",
+                ),
+                ttl=settings.CI_ANALYSIS_CACHE_TTL,
+            )
+        return cls._ci_analysis_coalescer
+
+    @classmethod
+    async def start_background_tasks(cls) -> None:
+        await cls._background_tasks_started.get()
+
+    @classmethod
+    async def _start_background_tasks(cls) -> None:
+        db_pool = await get_db_pool()
+        cls._user_limit_listener = UserLimitRepository(db_pool=db_pool)
+        limits_listen_task = PeriodicTask(
+            name="user-limits-listen",
+            interval=settings.USER_LIMITS_LISTEN_INTERVAL,
+            func=cls._user_limit_listener.listen,
+            run_on_stop=False,
+        )
+        partition_task = PeriodicTask(
+            name="message-partitions",
+            interval=settings.MESSAGE_PARTITION_MAINTENANCE_INTERVAL,
+            func=partial(
+                MessageRepository(db_pool=db_pool).maintain_partitions,
+                months_ahead=settings.MESSAGE_PARTITIONS_AHEAD,
+                retention_days=settings.MESSAGE_RETENTION_DAYS,
+            ),
+            run_on_stop=False,
+        )
+        agent_service = await cls.initialize_agent_service()
+        remote_session_deleter = RemoteSessionDeleter(
+            repository=RemoteSessionDeletionRepository(db_pool=db_pool),
+            delete_session=agent_service.delete_session,
+            batch_size=settings.REMOTE_SESSION_DELETION_BATCH_SIZE,
+            max_attempts=settings.REMOTE_SESSION_DELETION_MAX_ATTEMPTS,
+        )
+        cls._background_tasks = [
+            limits_listen_task,
+            PeriodicTask(
+                name="session-touch-flush",
+                interval=settings.SESSION_TOUCH_FLUSH_INTERVAL,
+                func=SessionRepository(db_pool=db_pool).flush_session_touches,
+            ),
+            PeriodicTask(
+                name="agent-session-token-flush",
+                interval=settings.SESSION_TOUCH_FLUSH_INTERVAL,
+                func=SessionRepository(db_pool=db_pool).flush_agent_session_tokens,
+            ),
+            PeriodicTask(
+                name="api-key-usage-flush",
+                interval=settings.API_KEY_USAGE_FLUSH_INTERVAL,
+                func=UserRepository(db_pool=db_pool).flush_api_key_uses,
+            ),
+            partition_task,
+            PeriodicTask(
+                name="remote-session-deletions",
+                interval=settings.REMOTE_SESSION_DELETION_INTERVAL,
+                func=remote_session_deleter.run_once,
+                run_on_stop=False,
+            ),
+            PeriodicTask(
+                name="token-usage-reconcile",
+                interval=settings.TOKEN_USAGE_RECONCILE_INTERVAL,
+                func=partial(
+                    TokenUsageRepository(db_pool=db_pool).reconcile,
+                    quiet_period=settings.TOKEN_USAGE_RECONCILE_QUIET_PERIOD,
+                    batch_size=settings.TOKEN_USAGE_RECONCILE_BATCH_SIZE,
+                ),
+                run_on_stop=False,
+            ),
+        ]
+        coalescer = await cls.initialize_ci_analysis_coalescer()
+        if coalescer is not None and settings.CI_ANALYSIS_CACHE_BACKEND == "postgres":
+            cls._background_tasks.append(PeriodicTask(
+                name="ci-analysis-cache-purge",
+                interval=settings.RESPONSE_CACHE_PURGE_INTERVAL,
+                func=coalescer.cache.purge_expired,
+                run_on_stop=False,
+            ))
+        answer_cache = cls.initialize_answer_cache()
+        if answer_cache is not None and settings.ANSWER_CACHE_BACKEND == "postgres":
+            cls._background_tasks.append(PeriodicTask(
+                name="answer-cache-purge",
+                interval=settings.RESPONSE_CACHE_PURGE_INTERVAL,
+                func=answer_cache.cache.purge_expired,
+                run_on_stop=False,
+            ))
+        for task in cls._background_tasks:
+            await task.start()
+        # Listen right away; the periodic task only re-establishes a lost listener
+        await limits_listen_task.run_once()
+        # Partitions for the coming months must exist before the first interval has passed
+        await partition_task.run_once()
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        """Drain background workers owned by the services."""
+        for task in cls._background_tasks:
+            await task.stop()
+        cls._background_tasks = []
+        cls._background_tasks_started.reset()
+        if cls._user_limit_listener is not None:
+            await cls._user_limit_listener.unlisten()
+            cls._user_limit_listener = None
+        message_sink = cls._message_sink.reset()
+        if message_sink is not None:
+            await message_sink.stop()
 
     @classmethod
     def reset(cls) -> None:
-        cls._agent_service = None
-        cls._ci_error_service = None
+        cls._agent_service.reset()
+        cls._ci_error_service.reset()
+        cls._message_sink.reset()
+        cls._background_tasks_started.reset()
+        cls._ci_analysis_coalescer = None
+        cls._answer_cache = None
+        cls._stream_registry = None
+        cls._retry_policy = None
+        cls._upstream_scheduler = None
+        cls._prompt_builder = None
+        cls._user_limit_listener = None
+        cls._background_tasks = []
@@ -0,0 +1,84 @@
+"""Registry of resumable SSE streams kept alive independently of the client connection."""
+import logging
+import secrets
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from baid_server.utils.cache import TTLCache
+from baid_server.utils.stream_broadcast import StreamBroadcast
+
+logger = logging.getLogger(__name__)
+
+STREAM_ID_HEADER = "X-Stream-Id"
+
+
+@dataclass
+class ResumableStream:
+    """A running or recently finished stream owned by one user."""
+    stream_id: str
+    user_id: str
+    broadcast: StreamBroadcast
+
+
+def with_event_ids(events: AsyncIterator[str], first_id: int) -> AsyncIterator[str]:
+    """Prefix each SSE event with an ``id:`` field numbering events from ``first_id``."""
+    async def numbered():
+        event_id = first_id
+        async for event in events:
+            yield f"id: {event_id}\n{event}"
+            event_id += 1
+    return numbered()
+
+
+class StreamRegistry:
+    """Keeps a replay buffer per stream so that dropped clients can resume with Last-Event-ID.
+
+    Streams stay registered while they run (up to ``max_duration`` seconds) and for
+    ``replay_ttl`` seconds after they finish. A stream still running when it is
+    evicted to make room, or when it reaches ``max_duration``, is stopped.
+    """
+
+    def __init__(self, replay_ttl: float = 120.0, max_streams: int = 1000, max_duration: float = 1800.0):
+        self.replay_ttl = replay_ttl
+        self.max_duration = max_duration
+        self._streams: TTLCache[str, ResumableStream] = TTLCache(
+            maxsize=max_streams, ttl=max_duration, on_evict=self._on_evict
+        )
+
+    def start(self, user_id: str, source: AsyncIterator[str]) -> ResumableStream:
+        """Start consuming ``source`` in the background and register it for resumption."""
+        stream_id = secrets.token_urlsafe(16)
+
+        async def on_complete(broadcast: StreamBroadcast) -> None:
+            # Shorten the lifetime to the replay window once the answer is complete
+            if self._streams.get(stream_id) is not None:
+                self._streams.set(stream_id, stream, ttl=self.replay_ttl)
+
+        stream = ResumableStream(
+            stream_id=stream_id,
+            user_id=user_id,
+            broadcast=StreamBroadcast(source, on_complete=on_complete, max_duration=self.max_duration),
+        )
+        self._streams.set(stream_id, stream)
+        stream.broadcast.start()
+        logger.debug(f"Registered resumable stream {stream_id} for user {user_id}")
+        return stream
+
+    @staticmethod
+    def _on_evict(stream_id: str, stream: ResumableStream) -> None:
+        if not stream.broadcast.done:
+            logger.warning(f"Stopping stream {stream_id}: evicted from the stream registry")
+            stream.broadcast.close()
+
+    def get(self, stream_id: str, user_id: str) -> Optional[ResumableStream]:
+        """Return a stream if it is still buffered and belongs to ``user_id``."""
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.user_id != user_id:
+            return None
+        return stream
+
+    @staticmethod
+    def events(stream: ResumableStream, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Replay the events after ``last_event_id`` and follow the live stream."""
+        start = 0 if last_event_id is None else last_event_id + 1
+        return with_event_ids(stream.broadcast.subscribe(start), start)
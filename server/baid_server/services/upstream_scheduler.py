@@ -0,0 +1,252 @@
+"""
+Admission control and fair scheduling of agent engine calls.
+
+Every streaming call to the agent engine holds a slot for its whole duration.
+Slots are capped per instance, per tenant and per user; waiting calls are
+dispatched by weighted fair queuing across tenants, and new calls are rejected
+with a Retry-After hint once the queues are too deep.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Deque, Dict, Optional
+from uuid import UUID
+
+from baid_server.utils.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(Exception):
+    """Raised when a call is not admitted; ``retry_after`` is in whole seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_tenant_weights(value: str) -> Dict[str, float]:
+    """Parse "tenant-a=2,tenant-b=0.5" into a weight mapping."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        tenant_key, _, weight = item.partition("=")
+        weights[tenant_key.strip()] = float(weight)
+    return weights
+
+
+class Ticket:
+    """A call waiting for, or holding, an upstream slot."""
+
+    def __init__(self, tenant_key: str, user_id: str, enqueued_at: float):
+        self.tenant_key = tenant_key
+        self.user_id = user_id
+        self.enqueued_at = enqueued_at
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+
+@dataclass
+class _TenantState:
+    weight: float
+    virtual_time: float = 0.0
+    active: int = 0
+    queue: Deque[Ticket] = field(default_factory=deque)
+
+
+class UpstreamScheduler:
+    """Weighted fair scheduler with per-tenant and per-user concurrency caps.
+
+    A tenant's virtual time advances by ``1 / weight`` for every call it is
+    granted, and the waiting tenant with the lowest virtual time goes next, so
+    under contention tenants receive slots in proportion to their weights.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 16,
+            per_tenant_limit: int = 8,
+            per_user_limit: int = 2,
+            max_queue_depth: int = 64,
+            max_tenant_queue_depth: int = 16,
+            queue_timeout: float = 30.0,
+            tenant_weights: Optional[Dict[str, float]] = None,
+            service_time_estimate: float = 10.0,
+            registry: MetricsRegistry = REGISTRY,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_tenant_limit = per_tenant_limit
+        self.per_user_limit = per_user_limit
+        self.max_queue_depth = max_queue_depth
+        self.max_tenant_queue_depth = max_tenant_queue_depth
+        self.queue_timeout = queue_timeout
+        self.tenant_weights = tenant_weights or {}
+        self._timer = timer
+        self._tenants: Dict[str, _TenantState] = {}
+        self._user_active: Dict[str, int] = {}
+        self._in_flight = 0
+        self._queued = 0
+        self._virtual_clock = 0.0
+        # Moving average of how long a call holds its slot, for Retry-After
+        self._service_time = service_time_estimate
+
+        self._in_flight_gauge = registry.gauge(
+            "upstream_calls_in_flight", "Agent engine calls currently holding a slot")
+        self._queue_depth_gauge = registry.gauge(
+            "upstream_queue_depth", "Agent engine calls waiting for a slot")
+        self._requests = registry.counter(
+            "upstream_requests_total", "Agent engine calls by scheduling outcome", ["outcome"])
+        self._queue_wait = registry.histogram(
+            "upstream_queue_wait_seconds", "Time spent waiting for an upstream slot")
+        self._call_duration = registry.histogram(
+            "upstream_call_duration_seconds", "Time an agent engine call held its slot",
+            buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+
+    @staticmethod
+    def tenant_key(tenant_id: Optional[UUID], user_id: str) -> str:
+        """Users without a tenant are scheduled as their own tenant."""
+        return str(tenant_id) if tenant_id else f"user:{user_id}"
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self, waiting: int, slots: int) -> int:
+        """Seconds until ``waiting`` queued calls drain through ``slots`` slots."""
+        return max(1, math.ceil((waiting + 1) / max(slots, 1) * self._service_time))
+
+    def submit(self, tenant_key: str, user_id: str) -> Ticket:
+        """Queue a call, or raise SchedulerRejected when the queues are full."""
+        tenant = self._tenants.get(tenant_key)
+        if self._queued >= self.max_queue_depth:
+            self._requests.inc(outcome="rejected_queue_full")
+            raise SchedulerRejected(
+                "The assistant is busy, please retry shortly",
+                self.retry_after(self._queued, self.max_concurrency),
+            )
+        if tenant is not None and len(tenant.queue) >= self.max_tenant_queue_depth:
+            self._requests.inc(outcome="rejected_tenant_queue_full")
+            raise SchedulerRejected(
+                "Too many concurrent requests for your organization, please retry shortly",
+                self.retry_after(len(tenant.queue), self.per_tenant_limit),
+            )
+
+        if tenant is None:
+            tenant = self._tenants[tenant_key] = _TenantState(
+                weight=self.tenant_weights.get(tenant_key, 1.0),
+                virtual_time=self._virtual_clock,
+            )
+        elif not tenant.queue:
+            # A tenant that was not waiting does not bank credit for the idle period
+            tenant.virtual_time = max(tenant.virtual_time, self._virtual_clock)
+        ticket = Ticket(tenant_key, user_id, self._timer())
+        tenant.queue.append(ticket)
+        self._queued += 1
+        self._requests.inc(outcome="admitted")
+        self._dispatch()
+        self._update_gauges()
+        return ticket
+
+    async def wait(self, ticket: Ticket) -> None:
+        """Wait until the ticket holds a slot, raising SchedulerRejected on timeout."""
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._granted), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not ticket.granted:
+                tenant = self._tenants[ticket.tenant_key]
+                self.release(ticket)
+                self._requests.inc(outcome="timed_out")
+                raise SchedulerRejected(
+                    "Timed out waiting for the assistant, please retry shortly",
+                    self.retry_after(len(tenant.queue), self.per_tenant_limit),
+                )
+
+    def release(self, ticket: Ticket) -> None:
+        """Free the ticket's slot, or withdraw it from the queue if still waiting."""
+        if ticket.released:
+            return
+        ticket.released = True
+        tenant = self._tenants[ticket.tenant_key]
+        if ticket.granted:
+            duration = self._timer() - ticket.granted_at
+            self._call_duration.observe(duration)
+            self._service_time = 0.8 * self._service_time + 0.2 * duration
+            tenant.active -= 1
+            self._in_flight -= 1
+            self._user_active[ticket.user_id] -= 1
+            if not self._user_active[ticket.user_id]:
+                del self._user_active[ticket.user_id]
+        else:
+            tenant.queue.remove(ticket)
+            self._queued -= 1
+            ticket._granted.cancel()
+        if not tenant.active and not tenant.queue:
+            del self._tenants[ticket.tenant_key]
+        self._dispatch()
+        self._update_gauges()
+
+    def stream(self, ticket: Ticket, source: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Relay ``source`` once the ticket is granted, holding the slot until it ends."""
+        async def scheduled():
+            try:
+                try:
+                    await self.wait(ticket)
+                except SchedulerRejected as e:
+                    yield f"data: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
+                    yield "data: [DONE]\n\n"
+                    return
+                async for event in source:
+                    yield event
+            finally:
+                self.release(ticket)
+                if hasattr(source, "aclose"):
+                    await source.aclose()
+        return scheduled()
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.max_concurrency:
+            chosen = None
+            for tenant in self._tenants.values():
+                if not tenant.queue or tenant.active >= self.per_tenant_limit:
+                    continue
+                if chosen is not None and tenant.virtual_time >= chosen[0].virtual_time:
+                    continue
+                # Skip over callers whose user is at their cap instead of blocking the tenant
+                ticket = next(
+                    (t for t in tenant.queue if self._user_active.get(t.user_id, 0) < self.per_user_limit),
+                    None,
+                )
+                if ticket is not None:
+                    chosen = (tenant, ticket)
+            if chosen is None:
+                return
+            self._grant(*chosen)
+
+    def _grant(self, tenant: _TenantState, ticket: Ticket) -> None:
+        tenant.queue.remove(ticket)
+        self._queued -= 1
+        self._virtual_clock = tenant.virtual_time
+        tenant.virtual_time += 1.0 / tenant.weight
+        tenant.active += 1
+        self._in_flight += 1
+        self._user_active[ticket.user_id] = self._user_active.get(ticket.user_id, 0) + 1
+        ticket.granted_at = self._timer()
+        self._queue_wait.observe(ticket.granted_at - ticket.enqueued_at)
+        ticket._granted.set_result(True)
+
+    def _update_gauges(self) -> None:
+        self._in_flight_gauge.set(self._in_flight)
+        self._queue_depth_gauge.set(self._queued)
@@ -0,0 +1,40 @@
+"""
+API key generation and hashing.
+
+Keys are random, so a salted SHA-256 is enough to make a leaked ``api_keys``
+table useless while keeping validation cheap. The first characters of a key
+are stored in clear as an indexed lookup prefix; they identify the candidate
+rows but not enough of the key to guess the rest.
+"""
+import hashlib
+import hmac
+import secrets
+
+API_KEY_PREFIX = "baid_"
+# "baid_" and 8 hex characters (32 bits) of the key; must match 000012_hash_api_keys.sql
+LOOKUP_PREFIX_LENGTH = len(API_KEY_PREFIX) + 8
+
+
+def generate_api_key() -> str:
+    return f"{API_KEY_PREFIX}{secrets.token_hex(24)}"
+
+
+def lookup_prefix(api_key: str) -> str:
+    return api_key[:LOOKUP_PREFIX_LENGTH]
+
+
+def new_salt() -> str:
+    return secrets.token_hex(16)
+
+
+def hash_api_key(api_key: str, salt: str) -> str:
+    return hashlib.sha256((salt + api_key).encode("utf-8")).hexdigest()
+
+
+def verify_api_key(api_key: str, salt: str, key_hash: str) -> bool:
+    return hmac.compare_digest(hash_api_key(api_key, salt), key_hash)
+
+
+def cache_key(api_key: str) -> bytes:
+    """Digest under which a validated key is cached, so the key itself is not kept in memory."""
+    return hashlib.blake2b(api_key.encode("utf-8"), digest_size=16).digest()
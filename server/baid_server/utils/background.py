@@ -0,0 +1,57 @@
+"""
+Background task utilities.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run a coroutine function every ``interval`` seconds on the running event loop.
+
+    Errors raised by the function are logged and do not stop the schedule.
+    """
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]], run_on_stop: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_on_stop = run_on_stop
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.is_running:
+            return
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        logger.info(f"Started periodic task {self.name} (every {self.interval}s)")
+
+    async def stop(self) -> None:
+        """Cancel the schedule, running the function one last time if configured."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.run_on_stop:
+            await self.run_once()
+        logger.info(f"Stopped periodic task {self.name}")
+
+    async def run_once(self) -> None:
+        try:
+            await self.func()
+        except Exception as e:
+            logger.error(f"Periodic task {self.name} failed: {str(e)}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
@@ -0,0 +1,79 @@
+"""
+In-process caching utilities.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """A bounded LRU mapping whose entries expire ``ttl`` seconds after being set.
+
+    The cache is not thread-safe; it is meant to be shared by coroutines running on
+    one event loop. ``on_evict`` is called with the key and value of each entry
+    dropped to make room for a new one.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 60.0,
+            timer: Callable[[], float] = time.monotonic,
+            on_evict: Optional[Callable[[K, V], None]] = None,
+    ):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._on_evict = on_evict
+        self._data: "OrderedDict[K, tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Return the cached value and mark it as recently used."""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entry when full."""
+        self._data[key] = (self._timer() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (_, evicted) = self._data.popitem(last=False)
+            if self._on_evict is not None:
+                self._on_evict(evicted_key, evicted)
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Remove a key and return its value if it was still fresh."""
+        entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING or entry[0] <= self._timer():
+            return default
+        return entry[1]
+
+    def discard_where(self, predicate: Callable[[K], bool]) -> int:
+        """Remove every key matching ``predicate`` and return how many were removed."""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,95 @@
+"""
+Lazy, single-flight initialization of shared async resources.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AsyncLazy(Generic[T]):
+    """A value created once, on first use, by a coroutine function.
+
+    Concurrent callers share a single in-flight creation, so a burst of first
+    requests opens one pool or builds one service. A failed creation is
+    remembered: callers get the same error until a backoff, doubling up to
+    ``max_backoff``, has passed, instead of hammering a failing dependency.
+    """
+
+    def __init__(
+            self,
+            factory: Callable[[], Awaitable[T]],
+            name: str,
+            backoff: float = 1.0,
+            max_backoff: float = 30.0,
+            timer: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.name = name
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._timer = timer
+        self._value: Optional[T] = None
+        self._initialized = False
+        self._pending: Optional[asyncio.Future] = None
+        self._error: Optional[BaseException] = None
+        self._retry_at = 0.0
+        self._failures = 0
+
+    @property
+    def is_initialized(self) -> bool:
+        return self._initialized
+
+    @property
+    def value(self) -> Optional[T]:
+        """The value if it has been created, without creating it."""
+        return self._value
+
+    async def get(self) -> T:
+        if self._initialized:
+            return self._value
+        if self._error is not None and self._timer() < self._retry_at:
+            raise self._error
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._create())
+        # One caller being cancelled must not cancel the creation the others wait for
+        return await asyncio.shield(self._pending)
+
+    async def _create(self) -> T:
+        try:
+            value = await self.factory()
+        except Exception as e:
+            self._failures += 1
+            delay = min(self.backoff * 2 ** (self._failures - 1), self.max_backoff)
+            self._error = e
+            self._retry_at = self._timer() + delay
+            logger.error(f"Failed to initialize {self.name}, retrying in {delay:.1f}s: {str(e)}")
+            raise
+        else:
+            self._value = value
+            self._initialized = True
+            self._error = None
+            self._failures = 0
+            return value
+        finally:
+            self._pending = None
+
+    def set(self, value: T) -> None:
+        """Use an already created value."""
+        self._value = value
+        self._initialized = True
+        self._error = None
+
+    def reset(self) -> Optional[T]:
+        """Forget the value so that the next ``get`` creates it again; returns the old value."""
+        value = self._value
+        self._value = None
+        self._initialized = False
+        self._pending = None
+        self._error = None
+        self._failures = 0
+        return value
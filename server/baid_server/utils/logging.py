@@ -58,18 +58,22 @@ def get_logger(name: str = "baid_server"):
 
 
 # --- CORS logging middleware ---
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-
-class CORSMiddlewareLogging(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        origin = request.headers.get("origin")
-        if origin:
-            logger = get_logger()
-            logger.info(f"CORS request from origin: {origin} path: {request.url.path}")
-        return response
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+class CORSMiddlewareLogging:
+    """Log the origin of cross-origin requests; plain ASGI so responses stream through untouched."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            origin = Headers(scope=scope).get("origin")
+            if origin:
+                logger = get_logger()
+                logger.info(f"CORS request from origin: {origin} path: {scope['path']}")
+        await self.app(scope, receive, send)
 
 # Usage:
 # In main.py, after app creation:
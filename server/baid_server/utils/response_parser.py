@@ -6,13 +6,14 @@ from typing import Optional, Dict, Any, List, AsyncGenerator
 from pydantic import ValidationError
 
 from baid_server.core.models import JetbrainsResponse
+from baid_server.utils.stream_options import CodeEncoding
 
 logger = logging.getLogger(__name__)
 
 
 class ResponseParser:
     @staticmethod
-    async def process_incoming_chunk(data) -> AsyncGenerator[str, Any]:
+    async def process_incoming_chunk(data, code_encoding: CodeEncoding = CodeEncoding.BASE64) -> AsyncGenerator[str, Any]:
         try:
             # Handle both string (JSON) and dictionary inputs
             if isinstance(data, str):
@@ -25,7 +26,7 @@ class ResponseParser:
                 return
 
             # Extract blocks from the parsed data
-            blocks = ResponseParser.extract_blocks(JetbrainsResponse(**parsed_data))
+            blocks = ResponseParser.extract_blocks(JetbrainsResponse(**parsed_data), code_encoding)
             if blocks:
                 for block in blocks:
                     # Format each block
@@ -47,16 +48,19 @@ class ResponseParser:
             return content.replace('\n', '\\n').replace('\r', '\\r')
 
     @staticmethod
-    def extract_blocks(response: JetbrainsResponse) -> List[Dict[str, Any]]:
+    def extract_blocks(response: JetbrainsResponse, code_encoding: CodeEncoding = CodeEncoding.BASE64) -> List[Dict[str, Any]]:
 
         try:
             blocks = []
             for block in response.response.content.blocks:
                 block_dict = block.dict()
 
-                # If it's a code block, fix the content
+                # If it's a code block, encode the content as negotiated
                 if block_dict.get('type') == 'code' and 'content' in block_dict:
-                    if block_dict['content']:  # Only if content exists
+                    if code_encoding == CodeEncoding.JSON:
+                        # json.dumps escapes the content, tag it so clients skip base64 decoding
+                        block_dict['encoding'] = CodeEncoding.JSON.value
+                    elif block_dict['content']:  # Only if content exists
                         block_dict['content'] = ResponseParser.smart_json_fix_for_code(block_dict['content'])
 
                 blocks.append(block_dict)
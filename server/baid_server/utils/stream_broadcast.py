@@ -0,0 +1,105 @@
+"""
+Fan-out of a single async event stream to any number of subscribers.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBroadcast:
+    """Consume a source stream once in a background task and replay it to subscribers.
+
+    Every event is kept in an in-memory buffer so that subscribers joining late, or
+    reconnecting, receive the stream from any offset and then follow it live. The
+    source keeps running when subscribers go away, until it ends, ``max_duration``
+    seconds have passed or the broadcast is closed.
+    """
+
+    def __init__(
+            self,
+            source: AsyncIterator[str],
+            on_complete: Optional[Callable[["StreamBroadcast"], Awaitable[None]]] = None,
+            max_duration: Optional[float] = None,
+    ):
+        self._source = source
+        self._on_complete = on_complete
+        self._max_duration = max_duration
+        self._events: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def events(self) -> List[str]:
+        return self._events
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self._error
+
+    def start(self) -> "StreamBroadcast":
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+        return self
+
+    def close(self) -> None:
+        """Stop consuming the source; subscribers receive what was buffered so far."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def wait(self) -> None:
+        """Wait until the source stream is exhausted."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._done)
+
+    async def subscribe(self, start: int = 0) -> AsyncIterator[str]:
+        """Yield buffered events from ``start`` and then follow the live stream."""
+        position = start
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self._events) or self._done)
+                pending = self._events[position:]
+                finished = self._done
+            for event in pending:
+                yield event
+            position += len(pending)
+            if finished and position >= len(self._events):
+                return
+
+    async def _pump(self) -> None:
+        try:
+            async with asyncio.timeout(self._max_duration):
+                async for event in self._source:
+                    async with self._changed:
+                        self._events.append(event)
+                        self._changed.notify_all()
+        except TimeoutError as e:
+            logger.warning(f"Broadcast source exceeded {self._max_duration}s after {len(self._events)} events")
+            self._error = e
+        except asyncio.CancelledError:
+            logger.debug(f"Broadcast closed after {len(self._events)} events")
+        except Exception as e:
+            logger.error(f"Broadcast source failed after {len(self._events)} events: {str(e)}")
+            self._error = e
+        finally:
+            # Let the source release what it holds (e.g. an upstream scheduler slot)
+            if hasattr(self._source, "aclose"):
+                try:
+                    await self._source.aclose()
+                except Exception as e:
+                    logger.error(f"Closing broadcast source failed: {str(e)}")
+            async with self._changed:
+                self._done = True
+                self._changed.notify_all()
+            if self._on_complete is not None:
+                try:
+                    await self._on_complete(self)
+                except Exception as e:
+                    logger.error(f"Broadcast completion callback failed: {str(e)}")
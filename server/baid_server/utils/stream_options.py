@@ -0,0 +1,102 @@
+"""
+Stream negotiation for the SSE endpoints.
+
+Clients pick what the event stream carries through the ``X-Stream-Format``
+header or the ``stream_format`` query parameter, and how code block content
+is encoded through ``X-Code-Encoding`` or ``code_encoding``. Query parameters
+win when both are present.
+"""
+import re
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Mapping, Optional
+
+STREAM_FORMAT_HEADER = "X-Stream-Format"
+STREAM_FORMAT_QUERY_PARAM = "stream_format"
+CODE_ENCODING_HEADER = "X-Code-Encoding"
+CODE_ENCODING_QUERY_PARAM = "code_encoding"
+
+
+class StreamFormat(str, Enum):
+    """What the SSE stream carries for each agent text part."""
+    BLOCKS = "blocks"  # Parsed content blocks only
+    RAW = "raw"  # Raw agent text deltas only
+    BOTH = "both"  # Parsed blocks followed by the raw delta (legacy behaviour)
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> "StreamFormat":
+        """Parse a client supplied value, falling back to the default when empty."""
+        if not value:
+            return DEFAULT_STREAM_FORMAT
+        try:
+            return cls(value.strip().lower())
+        except ValueError:
+            allowed = ", ".join(member.value for member in cls)
+            raise ValueError(f"Unsupported stream format '{value}'. Expected one of: {allowed}")
+
+
+DEFAULT_STREAM_FORMAT = StreamFormat.BLOCKS
+
+
+class CodeEncoding(str, Enum):
+    """How the content of code blocks is encoded inside SSE events."""
+    BASE64 = "base64"  # Legacy clients decode base64 content
+    JSON = "json"  # Plain JSON-escaped string, tagged with "encoding": "json"
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> "CodeEncoding":
+        """Parse a client supplied value, falling back to the default when empty."""
+        if not value:
+            return DEFAULT_CODE_ENCODING
+        try:
+            return cls(value.strip().lower())
+        except ValueError:
+            allowed = ", ".join(member.value for member in cls)
+            raise ValueError(f"Unsupported code encoding '{value}'. Expected one of: {allowed}")
+
+
+# Clients that do not negotiate are assumed to be legacy base64 decoders
+DEFAULT_CODE_ENCODING = CodeEncoding.BASE64
+
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+def raw_sse_event(text: str) -> str:
+    """SSE event carrying ``text`` verbatim: one data field per line, which clients join with newlines."""
+    return "".join(f"data: {line}\n" for line in _LINE_BREAK.split(text)) + "\n"
+
+
+@dataclass(frozen=True)
+class StreamOptions:
+    """Options negotiated by the client for a single streaming response."""
+    format: StreamFormat = DEFAULT_STREAM_FORMAT
+    code_encoding: CodeEncoding = DEFAULT_CODE_ENCODING
+
+    @property
+    def includes_blocks(self) -> bool:
+        return self.format in (StreamFormat.BLOCKS, StreamFormat.BOTH)
+
+    @property
+    def includes_raw(self) -> bool:
+        return self.format in (StreamFormat.RAW, StreamFormat.BOTH)
+
+    @classmethod
+    def negotiate(cls, headers: Mapping[str, str], query_params: Mapping[str, str]) -> "StreamOptions":
+        """Build stream options from request headers and query parameters.
+
+        Raises:
+            ValueError: If the client asked for an unsupported value.
+        """
+        requested_format = query_params.get(STREAM_FORMAT_QUERY_PARAM) or headers.get(STREAM_FORMAT_HEADER)
+        requested_encoding = query_params.get(CODE_ENCODING_QUERY_PARAM) or headers.get(CODE_ENCODING_HEADER)
+        return cls(
+            format=StreamFormat.parse(requested_format),
+            code_encoding=CodeEncoding.parse(requested_encoding),
+        )
+
+    def response_headers(self) -> Dict[str, str]:
+        """Headers echoing the negotiated options back to the client."""
+        return {
+            STREAM_FORMAT_HEADER: self.format.value,
+            CODE_ENCODING_HEADER: self.code_encoding.value,
+        }
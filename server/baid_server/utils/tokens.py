@@ -0,0 +1,192 @@
+"""
+Token counting helpers.
+
+``count_tokens`` and ``count_tokens_batch`` go through the process-wide token
+counter, which uses the tokenizer selected by ``settings.TOKENIZER`` and
+memoizes counts by content hash. ``estimate_tokens`` is the dependency-free
+heuristic; the SQL function of the same name mirrors it and backfilled the
+counts of messages stored before counts were recorded.
+
+A model tokenizer is CPU-bound, so coroutines use the ``*_async`` variants and
+``offload_tokenizing``, which run it in a worker thread; the heuristic is cheap
+enough to stay on the event loop.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+from typing import Callable, List, Optional, Protocol, Sequence, TypeVar
+
+from baid_server.config import settings
+from baid_server.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r'[.,!?;:()\[\]{}\'\"-]')
+
+HEURISTIC = "heuristic"
+# "vertex:<model name>" loads the model's tokenizer locally (needs sentencepiece)
+VERTEX_PREFIX = "vertex:"
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text string.
+
+    This is a simple approximation based on common tokenization patterns.
+    For more accurate counts, configure a tokenizer and use ``count_tokens``.
+    """
+    # Split by whitespace for words
+    words = text.split()
+    # Count punctuation and special characters
+    punctuation = len(_PUNCTUATION.findall(text))
+    # Estimate: roughly 1.3 tokens per word for English text
+    return int(len(words) * 1.3) + punctuation
+
+
+class Tokenizer(Protocol):
+    """Counts the tokens of many texts in one call."""
+
+    name: str
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        ...
+
+
+class HeuristicTokenizer:
+    name = HEURISTIC
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        return [estimate_tokens(text) for text in texts]
+
+
+class VertexTokenizer:
+    """Local tokenizer of a Vertex AI model; the vocabulary is downloaded once and cached on disk."""
+
+    def __init__(self, model_name: str):
+        # Imported lazily: sentencepiece is only needed when this tokenizer is configured
+        from vertexai.preview.tokenization import get_tokenizer_for_model
+
+        self.name = VERTEX_PREFIX + model_name
+        self._tokenizer = get_tokenizer_for_model(model_name)
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        # One encoder call for the whole batch; empty strings are not accepted
+        non_empty = [text for text in texts if text]
+        counts = iter(
+            len(info.token_ids) for info in self._tokenizer.compute_tokens(non_empty).tokens_info
+        ) if non_empty else iter(())
+        return [next(counts) if text else 0 for text in texts]
+
+
+def create_tokenizer(spec: str) -> Tokenizer:
+    """Build the tokenizer named by ``spec``, falling back to the heuristic if it cannot load."""
+    if spec.startswith(VERTEX_PREFIX):
+        try:
+            return VertexTokenizer(spec[len(VERTEX_PREFIX):])
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {spec}, estimating tokens instead: {str(e)}")
+            return HeuristicTokenizer()
+    if spec != HEURISTIC:
+        raise ValueError(f"Unknown tokenizer: {spec}")
+    return HeuristicTokenizer()
+
+
+class TokenCounter:
+    """Counts tokens with a tokenizer, memoizing counts by content hash.
+
+    Safe to use from worker threads: the memo is guarded by a lock.
+    """
+
+    def __init__(self, tokenizer: Tokenizer, max_entries: int = 50000, min_memo_length: int = 256):
+        self.tokenizer = tokenizer
+        # Short texts are cheaper to count than to hash and store
+        self.min_memo_length = min_memo_length
+        self._memo: TTLCache[bytes, int] = TTLCache(maxsize=max_entries, ttl=float("inf"))
+        self._lock = threading.Lock()
+
+    @property
+    def blocks_event_loop(self) -> bool:
+        """Whether counting is expensive enough to move off the event loop."""
+        return not isinstance(self.tokenizer, HeuristicTokenizer)
+
+    @staticmethod
+    def _digest(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """Token counts of ``texts``; only texts not seen before reach the tokenizer."""
+        counts: List[Optional[int]] = [None] * len(texts)
+        pending_indices: List[int] = []
+        pending_digests: List[Optional[bytes]] = []
+        for index, text in enumerate(texts):
+            digest = self._digest(text) if len(text) >= self.min_memo_length else None
+            with self._lock:
+                cached = self._memo.get(digest) if digest is not None else None
+            if cached is not None:
+                counts[index] = cached
+            else:
+                pending_indices.append(index)
+                pending_digests.append(digest)
+
+        if pending_indices:
+            computed = self.tokenizer.count_batch([texts[index] for index in pending_indices])
+            for index, digest, count in zip(pending_indices, pending_digests, computed):
+                counts[index] = count
+                if digest is not None:
+                    with self._lock:
+                        self._memo.set(digest, count)
+        return counts
+
+
+_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    """The process-wide counter for the configured tokenizer."""
+    global _counter
+    if _counter is None:
+        _counter = TokenCounter(
+            create_tokenizer(settings.TOKENIZER),
+            max_entries=settings.TOKEN_COUNT_MEMO_SIZE,
+        )
+        logger.info(f"Counting tokens with {_counter.tokenizer.name}")
+    return _counter
+
+
+def set_token_counter(counter: Optional[TokenCounter]) -> None:
+    """Replace the process-wide counter; ``None`` rebuilds it from settings on next use."""
+    global _counter
+    _counter = counter
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in ``text`` according to the configured tokenizer."""
+    return get_token_counter().count(text)
+
+
+def count_tokens_batch(texts: Sequence[str]) -> List[int]:
+    """Token counts of many texts with a single tokenizer call."""
+    return get_token_counter().count_batch(texts)
+
+
+async def offload_tokenizing(func: Callable[..., T], *args) -> T:
+    """Run ``func``, which counts tokens, in a worker thread unless the tokenizer is the heuristic."""
+    if get_token_counter().blocks_event_loop:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def count_tokens_async(text: str) -> int:
+    """``count_tokens`` for coroutines."""
+    return await offload_tokenizing(count_tokens, text)
+
+
+async def count_tokens_batch_async(texts: Sequence[str]) -> List[int]:
+    """``count_tokens_batch`` for coroutines."""
+    return await offload_tokenizing(count_tokens_batch, texts)
@@ -0,0 +1,16 @@
+-- migrations/000005_create_response_cache.sql
+
+-- Create response_cache table for replaying completed agent responses
+CREATE TABLE IF NOT EXISTS response_cache (
+    namespace TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    events JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (namespace, cache_key)
+);
+
+-- Create indices for expiry and LRU eviction
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires_at ON response_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit_at ON response_cache(last_hit_at);
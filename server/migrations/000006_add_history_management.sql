@@ -0,0 +1,19 @@
+-- migrations/000006_add_history_management.sql
+
+-- The agent-side session currently backing each user session, and the tokens sent into it
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS agent_session_id TEXT;
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS agent_session_tokens INTEGER NOT NULL DEFAULT 0;
+
+-- Create session_summaries table for rolling summaries of older turns
+CREATE TABLE IF NOT EXISTS session_summaries (
+    id SERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    summarized_until_id INTEGER NOT NULL,
+    token_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create indices for faster queries
+CREATE INDEX IF NOT EXISTS idx_session_summaries_session ON session_summaries(user_id, session_id, id DESC);
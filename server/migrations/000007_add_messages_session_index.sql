@@ -0,0 +1,4 @@
+-- migrations/000007_add_messages_session_index.sql
+
+-- Composite index for keyset pagination of a session's history on (timestamp, id)
+CREATE INDEX IF NOT EXISTS idx_messages_user_session_timestamp ON messages(user_id, session_id, timestamp, id);
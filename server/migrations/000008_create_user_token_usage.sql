@@ -0,0 +1,32 @@
+-- migrations/000008_create_user_token_usage.sql
+
+-- SQL mirror of baid_server.utils.tokens.estimate_tokens: 1.3 tokens per word plus punctuation
+CREATE OR REPLACE FUNCTION estimate_tokens(content TEXT) RETURNS INTEGER AS $$
+    -- Words are counted as runs of non-whitespace, like str.split() with no separator
+    SELECT floor((SELECT count(*) FROM regexp_matches(content, '\S+', 'g')) * 1.3)::INTEGER
+           + (length(content) - length(regexp_replace(content, '[.,!?;:()\[\]{}''"-]', '', 'g')))
+$$ LANGUAGE SQL IMMUTABLE STRICT;
+
+-- Create user_token_usage table with a running token count per user
+CREATE TABLE IF NOT EXISTS user_token_usage (
+    user_id TEXT PRIMARY KEY,
+    token_count BIGINT NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    reconciled_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Backfill the counters from the existing messages
+INSERT INTO user_token_usage (user_id, token_count, message_count, last_message_at, reconciled_at)
+SELECT user_id, SUM(estimate_tokens(content)), COUNT(*), MAX(timestamp), CURRENT_TIMESTAMP
+FROM messages
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    token_count = EXCLUDED.token_count,
+    message_count = EXCLUDED.message_count,
+    last_message_at = EXCLUDED.last_message_at,
+    reconciled_at = EXCLUDED.reconciled_at;
+
+-- Create indices for the reconciliation job
+CREATE INDEX IF NOT EXISTS idx_user_token_usage_updated_at ON user_token_usage(updated_at);
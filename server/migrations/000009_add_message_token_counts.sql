@@ -0,0 +1,9 @@
+-- migrations/000009_add_message_token_counts.sql
+
+-- Token count of each message as measured by the server's tokenizer when it was stored;
+-- NULL for older messages, which fall back to the estimate_tokens() SQL function
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_count INTEGER;
+
+-- Token usage reported by the model, next to the counters of stored messages
+ALTER TABLE user_token_usage ADD COLUMN IF NOT EXISTS prompt_tokens BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE user_token_usage ADD COLUMN IF NOT EXISTS completion_tokens BIGINT NOT NULL DEFAULT 0;
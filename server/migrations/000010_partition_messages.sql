@@ -0,0 +1,86 @@
+-- migrations/000010_partition_messages.sql
+
+-- Range-partition messages by month of timestamp. Expired months are dropped as a whole
+-- (MessageRepository.drop_expired_partitions) instead of deleted row by row, and each
+-- partition's indexes stay small. The existing table is kept as the partition of
+-- everything up to the end of the current month instead of being copied into a new one;
+-- the monthly partitions after it are created ahead of time by
+-- MessageRepository.ensure_partitions.
+--
+-- This is not an online migration: widening id rewrites the existing table, the
+-- token_count backfill updates every row counted before 000009, and ATTACH scans the
+-- table to validate it, all under an ACCESS EXCLUSIVE lock on messages. On a large
+-- messages table run it in a maintenance window rather than at container start.
+DO $$
+DECLARE
+    legacy_end TIMESTAMPTZ;
+    month_start TIMESTAMPTZ;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass) THEN
+        RETURN;
+    END IF;
+
+    SELECT (date_trunc('month', GREATEST(MAX(timestamp), CURRENT_TIMESTAMP) AT TIME ZONE 'UTC')
+            + INTERVAL '1 month') AT TIME ZONE 'UTC'
+    INTO legacy_end
+    FROM messages;
+
+    ALTER TABLE messages RENAME TO messages_legacy;
+
+    -- The partitioned table brings its own primary key and indexes, built on this table on attach.
+    -- The single-column indexes are not recreated: every query filters on (user_id, session_id)
+    -- or user_id, and partition pruning replaces the timestamp index.
+    ALTER TABLE messages_legacy DROP CONSTRAINT messages_pkey;
+    DROP INDEX IF EXISTS idx_messages_user_id;
+    DROP INDEX IF EXISTS idx_messages_session_id;
+    DROP INDEX IF EXISTS idx_messages_timestamp;
+    DROP INDEX IF EXISTS idx_messages_user_session_timestamp;
+
+    -- Keep the id sequence when this partition is eventually dropped
+    ALTER TABLE messages_legacy ALTER COLUMN id DROP DEFAULT;
+    ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+    ALTER SEQUENCE messages_id_seq AS BIGINT;
+
+    -- Partitions must match the parent: BIGINT ids and no NULL partition keys or token counts.
+    -- Counting the messages stored before 000009 here lets usage queries skip the content.
+    UPDATE messages_legacy SET timestamp = 'epoch' WHERE timestamp IS NULL;
+    UPDATE messages_legacy SET token_count = estimate_tokens(content) WHERE token_count IS NULL;
+    ALTER TABLE messages_legacy
+        ALTER COLUMN id TYPE BIGINT,
+        ALTER COLUMN timestamp SET NOT NULL,
+        ALTER COLUMN token_count SET NOT NULL;
+
+    CREATE TABLE messages (
+        id BIGINT NOT NULL DEFAULT nextval('messages_id_seq'),
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        token_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+    -- History pages, session deletion and usage counting read only this index (token_count is
+    -- included for the index-only SUMs); it also serves per-user scans by its user_id prefix
+    CREATE INDEX idx_messages_user_session_timestamp
+        ON messages (user_id, session_id, timestamp, id) INCLUDE (token_count);
+
+    EXECUTE format('ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                   legacy_end);
+
+    -- Rows outside every monthly partition (e.g. a far-off client clock) land here instead of failing
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+    -- Summaries point at message ids, which are BIGINT from here on
+    ALTER TABLE session_summaries ALTER COLUMN summarized_until_id TYPE BIGINT;
+
+    FOR i IN 0..2 LOOP
+        month_start := (legacy_end AT TIME ZONE 'UTC' + make_interval(months => i)) AT TIME ZONE 'UTC';
+        EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                       'messages_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYYMM'),
+                       month_start,
+                       (month_start AT TIME ZONE 'UTC' + INTERVAL '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END $$;
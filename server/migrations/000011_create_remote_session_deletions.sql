@@ -0,0 +1,18 @@
+-- migrations/000011_create_remote_session_deletions.sql
+
+-- Agent engine sessions to delete, queued with the deletion of their user sessions
+-- and processed by the remote-session-deletions background task
+CREATE TABLE IF NOT EXISTS remote_session_deletions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    agent_session_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, agent_session_id)
+);
+
+-- Create indices for claiming due deletions and for bulk deletion by age
+CREATE INDEX IF NOT EXISTS idx_remote_session_deletions_next_attempt ON remote_session_deletions(next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_last_used_at ON user_sessions(last_used_at);
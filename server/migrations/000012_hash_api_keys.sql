@@ -0,0 +1,27 @@
+-- migrations/000012_hash_api_keys.sql
+
+-- Store API keys as salted SHA-256 hashes (see baid_server.utils.api_keys) with a short
+-- indexed lookup prefix ("baid_" and 8 characters) instead of in clear
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_prefix VARCHAR(16);
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_salt TEXT;
+ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_hash TEXT;
+
+-- Hash the existing keys; the salt only has to differ between keys
+UPDATE api_keys
+SET key_salt = md5(random()::text || clock_timestamp()::text || id::text)
+WHERE key_hash IS NULL;
+
+UPDATE api_keys
+SET key_prefix = left(api_key, 13),
+    key_hash = encode(sha256(convert_to(key_salt || api_key, 'UTF8')), 'hex')
+WHERE key_hash IS NULL;
+
+ALTER TABLE api_keys ALTER COLUMN key_prefix SET NOT NULL;
+ALTER TABLE api_keys ALTER COLUMN key_salt SET NOT NULL;
+ALTER TABLE api_keys ALTER COLUMN key_hash SET NOT NULL;
+
+-- Drop the plaintext keys along with their unique constraint and index
+ALTER TABLE api_keys DROP COLUMN IF EXISTS api_key;
+
+-- Create indices for validating keys
+CREATE INDEX IF NOT EXISTS idx_api_keys_key_prefix ON api_keys(key_prefix);
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Benchmark the request middleware stack.
+
+Compares the pure ASGI TokenLimitMiddleware and CORSMiddlewareLogging with the
+BaseHTTPMiddleware versions they replaced, on a plain JSON endpoint and on an
+SSE endpoint. The ASGI app is driven directly, so the numbers only contain
+middleware and framework overhead. User limits are stubbed out to keep the
+database out of the measurement.
+
+Usage: python scripts/benchmark_middleware.py [--requests 2000] [--streams 20] [--chunks 200]
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from baid_server.api.middleware.token_limit_middleware import TokenLimitMiddleware
+from baid_server.utils.logging import CORSMiddlewareLogging
+
+
+async def _limits(self, user_id):
+    return False, 1000, 100000
+
+
+class LegacyTokenLimitMiddleware(BaseHTTPMiddleware):
+    """The previous implementation, minus the database lookup."""
+
+    async def dispatch(self, request, call_next):
+        if request.url.path.endswith("/consult"):
+            user = request.state.user if hasattr(request.state, "user") else None
+            if user:
+                is_restricted, token_usage, token_limit = await _limits(self, user.get("sub"))
+                request.state.token_info = {"usage": token_usage, "limit": token_limit}
+        return await call_next(request)
+
+
+class LegacyCORSMiddlewareLogging(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        request.headers.get("origin")
+        return response
+
+
+class StubbedTokenLimitMiddleware(TokenLimitMiddleware):
+    _check_user_limits = _limits
+
+
+async def ping(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def consult(request):
+    chunks = request.app.state.chunks
+
+    async def events():
+        for index in range(chunks):
+            yield f"data: {{\"chunk\": {index}}}\n\n"
+            await asyncio.sleep(0)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def build_app(token_limit_middleware, cors_logging_middleware, chunks):
+    app = Starlette(routes=[Route("/api/ping", ping), Route("/api/consult", consult, methods=["POST"])])
+    app.state.chunks = chunks
+    app.add_middleware(token_limit_middleware)
+    app.add_middleware(cors_logging_middleware)
+    return app
+
+
+async def call(app, path, method="GET"):
+    """Run one request; returns (total seconds, gaps in seconds between body chunks)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"origin", b"http://localhost")], "client": ("127.0.0.1", 1),
+        "server": ("testserver", 80), "state": {"user": {"sub": "bench@example.com"}},
+    }
+    chunk_times = []
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a server, report the disconnect only once the response is complete
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            if message.get("body"):
+                chunk_times.append(time.perf_counter())
+            if not message.get("more_body", False):
+                response_done.set()
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    total = time.perf_counter() - started
+    return total, [later - earlier for earlier, later in zip(chunk_times, chunk_times[1:])]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def measure(name, app, requests, streams):
+    # Warm up routing and imports
+    for _ in range(50):
+        await call(app, "/api/ping")
+
+    totals = [(await call(app, "/api/ping"))[0] for _ in range(requests)]
+    gaps = []
+    for _ in range(streams):
+        gaps.extend((await call(app, "/api/consult", method="POST"))[1])
+
+    print(f"{name}")
+    print(f"  request overhead  p50 {statistics.median(totals) * 1e6:8.1f} us"
+          f"  p99 {percentile(totals, 0.99) * 1e6:8.1f} us")
+    print(f"  SSE chunk gap     p50 {statistics.median(gaps) * 1e6:8.1f} us"
+          f"  p99 {percentile(gaps, 0.99) * 1e6:8.1f} us")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000, help="JSON requests per stack")
+    parser.add_argument("--streams", type=int, default=20, help="SSE streams per stack")
+    parser.add_argument("--chunks", type=int, default=200, help="events per SSE stream")
+    args = parser.parse_args()
+
+    stacks = [
+        ("BaseHTTPMiddleware (before)", LegacyTokenLimitMiddleware, LegacyCORSMiddlewareLogging),
+        ("pure ASGI (after)", StubbedTokenLimitMiddleware, CORSMiddlewareLogging),
+    ]
+    for name, token_limit_middleware, cors_logging_middleware in stacks:
+        app = build_app(token_limit_middleware, cors_logging_middleware, args.chunks)
+        await measure(name, app, args.requests, args.streams)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Show the query plans of the hot queries on the messages table.
+
+Runs EXPLAIN for the history, resume, usage and deletion queries of one
+session and flags sequential scans of messages partitions, which mean a
+query is not using idx_messages_user_session_timestamp. With --analyze the
+queries are executed (the DELETE inside a rolled back transaction). Run it
+against a database with realistic volume: on small tables a sequential scan
+is the cheaper plan.
+
+Usage: python scripts/explain_message_queries.py --user alice@example.com --session <id> [--analyze]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from baid_server.db.database import close_db_pool, get_db_pool
+
+# Same statements as MessageRepository, TokenUsageRepository and SessionRepository
+QUERIES = {
+    "history page": ('''
+        SELECT id, role, content, timestamp
+        FROM messages
+        WHERE user_id = $1 AND session_id = $2
+          AND ($3::timestamptz IS NULL OR (timestamp, id) > ($3, $4))
+        ORDER BY timestamp ASC, id ASC
+        LIMIT $5
+    ''', lambda user, session: (user, session, None, None, 50)),
+    "stream resume": ('''
+        SELECT id, role, content
+        FROM messages
+        WHERE user_id = $1 AND session_id = $2 AND id > $3
+        ORDER BY id ASC
+    ''', lambda user, session: (user, session, 0)),
+    "session usage": ('''
+        SELECT COALESCE(SUM(token_count), 0) AS token_count, COUNT(*) AS message_count
+        FROM messages
+        WHERE user_id = $1 AND session_id = $2
+    ''', lambda user, session: (user, session)),
+    "user usage": ('''
+        SELECT COALESCE(SUM(token_count), 0) AS token_count, COUNT(id) AS message_count, MAX(timestamp)
+        FROM messages
+        WHERE user_id = $1
+    ''', lambda user, session: (user,)),
+    "session deletion": ('''
+        DELETE FROM messages WHERE user_id = $1 AND session_id = $2
+    ''', lambda user, session: (user, session)),
+}
+
+
+async def explain(conn, query: str, args, analyze: bool) -> str:
+    options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+    rows = await conn.fetch(f"EXPLAIN ({options}) {query}", *args)
+    return "\n".join(row[0] for row in rows)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user", required=True, help="user id (email) to query")
+    parser.add_argument("--session", required=True, help="session id to query")
+    parser.add_argument("--analyze", action="store_true", help="execute the queries (EXPLAIN ANALYZE)")
+    args = parser.parse_args()
+
+    pool = await get_db_pool()
+    sequential_scans = []
+    try:
+        async with pool.acquire() as conn:
+            for name, (query, parameters) in QUERIES.items():
+                transaction = conn.transaction()
+                await transaction.start()
+                try:
+                    plan = await explain(conn, query, parameters(args.user, args.session), args.analyze)
+                finally:
+                    await transaction.rollback()
+                print(f"== {name}\n{plan}\n")
+                if "Seq Scan on messages" in plan:
+                    sequential_scans.append(name)
+    finally:
+        await close_db_pool()
+
+    if sequential_scans:
+        print(f"Sequential scans of messages in: {', '.join(sequential_scans)}")
+        sys.exit(1)
+    print("All queries use index scans")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,15 +2,24 @@
 """
 Database migration script to run at container startup.
 This script applies SQL migration files from the migrations directory.
+
+Migrations are applied in version order, each in its own transaction, under
+an advisory lock. Applied files are recorded with a checksum; a start with
+nothing to apply costs a single query, and a modified applied migration
+fails the run.
 """
 
 import os
+import re
 import sys
+import hashlib
 import logging
 import time
 import asyncio
 import asyncpg
+from collections import Counter
 from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
 from baid_server.config import settings
 
 from baid_server.utils.logging import configure_logging, get_logger
@@ -37,6 +46,13 @@ MIGRATIONS_DIR = Path(os.path.join(os.path.dirname(os.path.dirname(os.path.abspa
 if os.getenv("ENVIRONMENT", "local") != "local":
     MIGRATIONS_DIR = Path("/app/migrations")
 
+MIGRATION_FILENAME = re.compile(r'^(\d+)_.+\.sql$')
+# 000004 was used by two migrations before versions were checked; both keep their (name) order
+GRANDFATHERED_DUPLICATE_VERSIONS = {4}
+
+# Held while migrating, so that instances starting together do not race
+MIGRATION_LOCK_ID = 0x6d696772  # "migr"
+
 async def get_connection_string():
     """Get database connection string from environment or Secret Manager."""
     if os.environ.get("ENVIRONMENT") == "development" and DB_PASSWORD:
@@ -66,6 +82,37 @@ async def get_connection_string():
         return connection_string
 
 
+class Migration(NamedTuple):
+    version: int
+    filename: str
+    checksum: str
+    sql: str
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Read the migration files in the order they are applied: by version, then by name."""
+    migrations = []
+    for path in directory.glob('*.sql'):
+        match = MIGRATION_FILENAME.match(path.name)
+        if match is None:
+            raise ValueError(f"Migration file name does not start with a version number: {path.name}")
+        content = path.read_bytes()
+        migrations.append(Migration(
+            version=int(match.group(1)),
+            filename=path.name,
+            checksum=hashlib.sha256(content).hexdigest(),
+            sql=content.decode('utf-8'),
+        ))
+    migrations.sort(key=lambda migration: (migration.version, migration.filename))
+
+    versions = Counter(migration.version for migration in migrations)
+    duplicates = sorted(version for version, count in versions.items()
+                        if count > 1 and version not in GRANDFATHERED_DUPLICATE_VERSIONS)
+    if duplicates:
+        raise ValueError(f"Duplicate migration versions: {', '.join(f'{version:06d}' for version in duplicates)}")
+    return migrations
+
+
 async def create_migration_table(conn):
     """Create migration tracking table if it doesn't exist."""
     await conn.execute('''
@@ -73,74 +120,125 @@ async def create_migration_table(conn):
         id SERIAL PRIMARY KEY,
         filename TEXT UNIQUE NOT NULL,
         applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    )
+    );
+    ALTER TABLE migration_history ADD COLUMN IF NOT EXISTS checksum TEXT;
+    ALTER TABLE migration_history ADD COLUMN IF NOT EXISTS execution_ms INTEGER;
     ''')
 
 
-async def get_applied_migrations(conn):
-    """Get list of already applied migrations."""
-    return set(row['filename'] for row in await conn.fetch('SELECT filename FROM migration_history'))
+async def is_up_to_date(conn, migrations: List[Migration]) -> bool:
+    """Whether every migration is recorded with its current checksum, in a single query."""
+    try:
+        applied = await conn.fetchval('''
+        SELECT COUNT(*)
+        FROM migration_history h
+        JOIN unnest($1::text[], $2::text[]) AS f(filename, checksum)
+          ON h.filename = f.filename AND h.checksum = f.checksum
+        ''', [m.filename for m in migrations], [m.checksum for m in migrations])
+    except (asyncpg.exceptions.UndefinedTableError, asyncpg.exceptions.UndefinedColumnError):
+        # First run, or a tracking table from before checksums were recorded
+        return False
+    return applied == len(migrations)
 
 
-async def apply_migrations():
-    """Apply all pending migration files."""
-    connection_string = await get_connection_string()
+async def get_applied_migrations(conn) -> Dict[str, Optional[str]]:
+    """Get the checksums of already applied migrations, by filename."""
+    return {row['filename']: row['checksum'] for row in await conn.fetch('SELECT filename, checksum FROM migration_history')}
+
+
+async def verify_checksums(conn, migrations: List[Migration], applied: Dict[str, Optional[str]]) -> bool:
+    """Check applied migrations against their files; record checksums of rows from before they were tracked."""
+    valid = True
+    for migration in migrations:
+        if migration.filename not in applied:
+            continue
+        recorded = applied[migration.filename]
+        if recorded is None:
+            await conn.execute(
+                'UPDATE migration_history SET checksum = $2 WHERE filename = $1',
+                migration.filename, migration.checksum
+            )
+        elif recorded != migration.checksum:
+            logger.error(f"Migration {migration.filename} was modified after it was applied "
+                         f"(recorded checksum {recorded}, file checksum {migration.checksum})")
+            valid = False
+    return valid
 
-    # Try to connect to database with retries
+
+async def connect(connection_string: str):
+    """Connect to the database, retrying while it starts up."""
     for attempt in range(MAX_RETRIES):
         try:
             conn = await asyncpg.connect(connection_string)
             logger.info("Successfully connected to the database")
-            break
+            return conn
         except Exception as e:
             if attempt < MAX_RETRIES - 1:
                 logger.warning(
                     f"Database connection attempt {attempt + 1} failed: {str(e)}. Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
             else:
                 logger.error(f"Failed to connect to database after {MAX_RETRIES} attempts: {str(e)}")
-                return False
+    return None
 
-    try:
-        # Create migration tracking table
-        await create_migration_table(conn)
 
-        # Get already applied migrations
-        applied_migrations = await get_applied_migrations(conn)
+async def apply_migrations():
+    """Apply all pending migration files."""
+    try:
+        migrations = load_migrations()
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    if not migrations:
+        logger.warning(f"No migration files found in {MIGRATIONS_DIR}")
+        return True
 
-        # Get all migration files
-        migration_files = sorted([f for f in MIGRATIONS_DIR.glob('*.sql')])
+    connection_string = await get_connection_string()
+    conn = await connect(connection_string)
+    if conn is None:
+        return False
 
-        if not migration_files:
-            logger.warning(f"No migration files found in {MIGRATIONS_DIR}")
+    try:
+        # Fast path for the usual container start: nothing to apply, no lock taken
+        if await is_up_to_date(conn, migrations):
+            logger.info(f"All {len(migrations)} migrations already applied")
             return True
 
-        # Apply pending migrations
-        for migration_file in migration_files:
-            filename = migration_file.name
-
-            if filename in applied_migrations:
-                logger.info(f"Migration {filename} already applied")
-                continue
-
-            logger.info(f"Applying migration: {filename}")
-            try:
-                # Read the migration content
-                with open(migration_file, 'r') as f:
-                    migration_sql = f.read()
-
-                # Execute the migration in a transaction
-                async with conn.transaction():
-                    await conn.execute(migration_sql)
-                    await conn.execute(
-                        'INSERT INTO migration_history (filename) VALUES ($1)',
-                        filename
-                    )
-                logger.info(f"Successfully applied migration: {filename}")
-            except Exception as e:
-                logger.error(f"Failed to apply migration {filename}: {str(e)}")
+        # Instances starting together apply the migrations one after the other;
+        # the ones that wait find them applied once they get the lock
+        logger.info("Waiting for the migration lock")
+        await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_ID)
+        try:
+            # Create migration tracking table
+            await create_migration_table(conn)
+
+            # Get already applied migrations
+            applied_migrations = await get_applied_migrations(conn)
+            if not await verify_checksums(conn, migrations, applied_migrations):
                 return False
 
+            # Apply pending migrations
+            for migration in migrations:
+                if migration.filename in applied_migrations:
+                    continue
+
+                logger.info(f"Applying migration: {migration.filename}")
+                started = time.perf_counter()
+                try:
+                    # Execute the migration in a transaction
+                    async with conn.transaction():
+                        await conn.execute(migration.sql)
+                        await conn.execute(
+                            'INSERT INTO migration_history (filename, checksum, execution_ms) VALUES ($1, $2, $3)',
+                            migration.filename, migration.checksum, int((time.perf_counter() - started) * 1000)
+                        )
+                    logger.info(f"Successfully applied migration: {migration.filename}")
+                except Exception as e:
+                    logger.error(f"Failed to apply migration {migration.filename}: {str(e)}")
+                    return False
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_ID)
+
         logger.info("All migrations applied successfully")
         return True
 
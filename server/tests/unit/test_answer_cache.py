@@ -0,0 +1,128 @@
+"""Unit tests for the /consult answer cache."""
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+from uuid import uuid4
+
+import pytest
+
+from baid_server.services.agent_service import AgentService, AgentConfig
+from baid_server.services.answer_cache import AnswerCache, normalize_prompt, wants_answer_cache
+from baid_server.services.response_cache import InMemoryResponseCache
+from baid_server.utils.stream_options import StreamFormat, StreamOptions
+
+AGENT_TEXT = json.dumps({
+    "schema": "jetbrains-llm-response",
+    "version": "1.0",
+    "response": {
+        "type": "answer",
+        "metadata": {"model": "test", "timestamp": "2025-01-01T00:00:00Z"},
+        "content": {"blocks": [{"type": "paragraph", "content": "It is a class"}]}
+    }
+})
+FILE_CONTEXT = {"is_open": True, "file_content": "class Foo: pass"}
+
+
+class TestAnswerCacheKey:
+    """Test cases for answer cache keys."""
+
+    def test_prompt_normalization(self):
+        assert normalize_prompt("  Explain   THIS class?\n") == "explain this class"
+
+    def test_key_ignores_prompt_formatting(self):
+        options = StreamOptions()
+        assert AnswerCache.key_for("Explain this class", FILE_CONTEXT, options) == \
+            AnswerCache.key_for("explain this  class?", FILE_CONTEXT, options)
+
+    def test_key_depends_on_file_and_stream_options(self):
+        key = AnswerCache.key_for("Explain this class", FILE_CONTEXT, StreamOptions())
+        other_file = {"is_open": True, "file_content": "class Bar: pass"}
+        assert key != AnswerCache.key_for("Explain this class", other_file, StreamOptions())
+        assert key != AnswerCache.key_for("Explain this class", FILE_CONTEXT, StreamOptions(format=StreamFormat.RAW))
+
+    def test_opt_in(self):
+        assert wants_answer_cache({"X-Answer-Cache": "on"}, {})
+        assert not wants_answer_cache({}, {})
+
+
+class TestProcessQueryAnswerCache:
+    """Test that process_query replays cached answers."""
+
+    @pytest.fixture
+    def agent_service(self):
+        with patch("baid_server.services.agent_service.ReasoningEngineExecutionServiceClient"):
+            service = AgentService(
+                message_repository=MagicMock(store_message=AsyncMock()),
+                session_repository=MagicMock(session_exists=AsyncMock(return_value=True)),
+                response_processor=MagicMock(),
+                config=AgentConfig(agent_engine_id="engine"),
+                session_service=MagicMock(),
+                answer_cache=AnswerCache(InMemoryResponseCache(), ttl=60),
+            )
+        agent = MagicMock()
+        agent.stream_query.side_effect = lambda **kwargs: iter([{"content": {"parts": [{"text": AGENT_TEXT}]}}])
+        service.get_agent = MagicMock(return_value=agent)
+        return service
+
+    async def _ask(self, service, tenant_id, use_answer_cache=True, user_id="user"):
+        return [event async for event in service.process_query(
+            user_id=user_id,
+            session_id="session",
+            user_input="Explain this class",
+            context=FILE_CONTEXT,
+            use_answer_cache=use_answer_cache,
+            tenant_id=tenant_id
+        )]
+
+    @pytest.mark.asyncio
+    async def test_repeat_question_is_served_from_cache(self, agent_service):
+        tenant_id = uuid4()
+        first = await self._ask(agent_service, tenant_id)
+        second = await self._ask(agent_service, tenant_id)
+
+        assert first == second
+        assert agent_service.get_agent().stream_query.call_count == 1
+        # The replayed answer is still recorded in the session history
+        roles = [call.args[2] for call in agent_service.message_repository.store_message.call_args_list]
+        assert roles == ["user", "assistant", "user", "assistant"]
+
+    @pytest.mark.asyncio
+    async def test_cache_hit_does_not_touch_the_agent_engine(self, agent_service):
+        history_manager = MagicMock(agent_session_for=AsyncMock(), record_turn=MagicMock())
+        agent_service.history_manager = history_manager
+        history_manager.agent_session_for.return_value = MagicMock(agent_session_id="session", carry_over=None)
+        tenant_id = uuid4()
+        await self._ask(agent_service, tenant_id)
+        agent_service.get_agent.reset_mock()
+        history_manager.reset_mock()
+
+        await self._ask(agent_service, tenant_id)
+
+        agent_service.get_agent.assert_not_called()
+        history_manager.agent_session_for.assert_not_called()
+        # The replayed turn still counts against the agent session's budget
+        history_manager.record_turn.assert_called_once()
+        assert history_manager.record_turn.call_args.args[:2] == ("user", "session")
+
+    @pytest.mark.asyncio
+    async def test_cache_is_per_tenant_and_invalidated(self, agent_service):
+        tenant_id = uuid4()
+        await self._ask(agent_service, tenant_id)
+        await self._ask(agent_service, uuid4())
+        assert agent_service.get_agent().stream_query.call_count == 2
+
+        assert await agent_service.answer_cache.invalidate(tenant_id) == 1
+        await self._ask(agent_service, tenant_id)
+        assert agent_service.get_agent().stream_query.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_users_without_tenant_do_not_share_answers(self, agent_service):
+        await self._ask(agent_service, None, user_id="alice")
+        await self._ask(agent_service, None, user_id="bob")
+        await self._ask(agent_service, None, user_id="alice")
+        assert agent_service.get_agent().stream_query.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_cache_requires_opt_in(self, agent_service):
+        await self._ask(agent_service, None, use_answer_cache=False)
+        await self._ask(agent_service, None, use_answer_cache=False)
+        assert agent_service.get_agent().stream_query.call_count == 2
@@ -0,0 +1,116 @@
+"""Unit tests for hashed API keys and their validation cache."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+import pytest
+
+from baid_server.db.repositories.user_repository import UserRepository
+from baid_server.utils.api_keys import generate_api_key, hash_api_key, lookup_prefix, verify_api_key
+
+API_KEY = generate_api_key()
+TENANT_ID = str(uuid4())
+
+
+def key_row(api_key=API_KEY, key_id=7, expires_at=None):
+    salt = "salt-" + str(key_id)
+    return {
+        "id": key_id, "key_salt": salt, "key_hash": hash_api_key(api_key, salt), "expires_at": expires_at,
+        "email": "ci@example.com", "name": "CI", "user_id": "ci@example.com", "tenant_id": TENANT_ID,
+        "tenant_name": "Default Tenant", "tenant_slug": "default",
+    }
+
+
+@pytest.fixture
+def conn():
+    connection = MagicMock()
+    connection.fetch = AsyncMock(return_value=[key_row()])
+    connection.fetchval = AsyncMock(return_value=7)
+    connection.execute = AsyncMock()
+    connection.executemany = AsyncMock()
+    return connection
+
+
+@pytest.fixture
+def repository(conn):
+    pool = MagicMock()
+    pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    UserRepository.clear_cache()
+    yield UserRepository(db_pool=pool)
+    UserRepository.clear_cache()
+
+
+class TestApiKeyHashing:
+    """Test cases for the API key helpers."""
+
+    def test_hash_verifies_only_the_same_key(self):
+        assert verify_api_key(API_KEY, "salt", hash_api_key(API_KEY, "salt"))
+        assert not verify_api_key(generate_api_key(), "salt", hash_api_key(API_KEY, "salt"))
+
+    def test_lookup_prefix_is_short(self):
+        assert lookup_prefix(API_KEY) == API_KEY[:13]
+
+
+class TestApiKeyValidation:
+    """Test cases for UserRepository.validate_api_key."""
+
+    @pytest.mark.asyncio
+    async def test_key_is_stored_hashed(self, repository, conn):
+        await repository.store_api_key("ci@example.com", API_KEY, "ci", tenant_id=uuid4())
+
+        args = conn.fetchval.call_args.args
+        assert API_KEY not in args
+        assert args[2] == lookup_prefix(API_KEY)
+        assert verify_api_key(API_KEY, args[3], args[4])
+
+    @pytest.mark.asyncio
+    async def test_validation_is_cached(self, repository, conn):
+        first = await repository.validate_api_key(API_KEY)
+        second = await repository.validate_api_key(API_KEY)
+
+        assert first == second
+        assert first["user_id"] == "ci@example.com"
+        assert "key_id" not in first
+        conn.fetch.assert_awaited_once_with(conn.fetch.call_args.args[0], lookup_prefix(API_KEY))
+
+    @pytest.mark.asyncio
+    async def test_other_key_with_same_prefix_is_rejected(self, repository):
+        assert await repository.validate_api_key(API_KEY[:13] + "0" * 40) is None
+
+    @pytest.mark.asyncio
+    async def test_delete_invalidates_cache(self, repository, conn):
+        await repository.validate_api_key(API_KEY)
+        await repository.delete_api_key("ci@example.com", "7")
+
+        conn.fetch.return_value = []
+        assert await repository.validate_api_key(API_KEY) is None
+
+    @pytest.mark.asyncio
+    async def test_cached_key_expires(self, repository, conn):
+        conn.fetch.return_value = [key_row(expires_at=datetime.now(timezone.utc) + timedelta(milliseconds=10))]
+        assert await repository.validate_api_key(API_KEY) is not None
+
+        await asyncio.sleep(0.02)
+        assert await repository.validate_api_key(API_KEY) is None
+
+    @pytest.mark.asyncio
+    async def test_uses_are_flushed_in_one_batch(self, repository, conn):
+        for _ in range(3):
+            await repository.validate_api_key(API_KEY)
+
+        assert await repository.flush_api_key_uses() == 1
+        assert await repository.flush_api_key_uses() == 0
+        assert conn.executemany.call_args.args[1][0][0] == 7
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_uses(self, repository, conn):
+        await repository.validate_api_key(API_KEY)
+        conn.executemany.side_effect = ConnectionError("database down")
+        repository._db_pool.acquire.return_value.__aexit__.return_value = False  # do not swallow the error
+
+        with pytest.raises(ConnectionError):
+            await repository.flush_api_key_uses()
+
+        conn.executemany.side_effect = None
+        assert await repository.flush_api_key_uses() == 1
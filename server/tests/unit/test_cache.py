@@ -0,0 +1,47 @@
+"""Unit tests for the in-process TTL cache."""
+from baid_server.utils.cache import TTLCache
+
+
+class FakeTimer:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    """Test cases for the TTLCache class."""
+
+    def test_entries_expire(self):
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+        cache.set("key", "value")
+
+        assert cache.get("key") == "value"
+        timer.now = 5
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_discard_where(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set(("tenant-1", "x"), 1)
+        cache.set(("tenant-1", "y"), 2)
+        cache.set(("tenant-2", "x"), 3)
+
+        assert cache.discard_where(lambda key: key[0] == "tenant-1") == 2
+        assert ("tenant-1", "x") not in cache
+        assert ("tenant-2", "x") in cache
@@ -0,0 +1,93 @@
+"""Unit tests for CI analysis coalescing and caching."""
+import asyncio
+
+import pytest
+
+from baid_server.models.ci_error import CIErrorRequest
+from baid_server.services.ci_analysis_cache import (
+    CACHE_COALESCED, CACHE_HIT, CACHE_MISS, CIAnalysisCoalescer, fingerprint_ci_request, normalize_ci_output
+)
+from baid_server.services.response_cache import InMemoryResponseCache
+
+EVENTS = ['data: {"type": "error_analysis", "content": "Missing module"}\n\n', "data: [DONE]\n\n"]
+
+
+def ci_request(stderr: str) -> CIErrorRequest:
+    return CIErrorRequest(command="pytest", stdout="", stderr=stderr)
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+class TestFingerprint:
+    """Test cases for CI request normalization."""
+
+    def test_masks_volatile_fragments(self):
+        text = "2025-03-01T10:22:33Z /home/runner/work/app/src/main.py failed in 12.5s (commit 3f9a2b7c1d)"
+        assert normalize_ci_output(text) == "<timestamp> <path>/main.py failed in <duration> (commit <hex>)"
+
+    def test_same_failure_on_different_runs_matches(self):
+        first = ci_request("12:00:01 ERROR /builds/1234abcd/app/setup.py: No module named foo")
+        second = ci_request("18:45:59 ERROR /builds/9876fedc/app/setup.py: No module named foo")
+        assert fingerprint_ci_request(first) == fingerprint_ci_request(second)
+
+    def test_different_failures_do_not_match(self):
+        assert fingerprint_ci_request(ci_request("No module named foo")) != \
+            fingerprint_ci_request(ci_request("No module named bar"))
+
+
+class TestCIAnalysisCoalescer:
+    """Test cases for the CIAnalysisCoalescer class."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_upstream_stream(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await release.wait()
+            for event in EVENTS:
+                yield event
+
+        coalescer = CIAnalysisCoalescer(InMemoryResponseCache(), ttl=60)
+        first_status, first = await coalescer.open("ci:tenant", "fp", upstream)
+        second_status, second = await coalescer.open("ci:tenant", "fp", upstream)
+        release.set()
+
+        assert (first_status, second_status) == (CACHE_MISS, CACHE_COALESCED)
+        assert await asyncio.gather(collect(first), collect(second)) == [EVENTS, EVENTS]
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_completed_analysis_is_served_from_cache(self):
+        async def upstream():
+            for event in EVENTS:
+                yield event
+
+        coalescer = CIAnalysisCoalescer(InMemoryResponseCache(), ttl=60)
+        _, stream = await coalescer.open("ci:tenant", "fp", upstream)
+        await collect(stream)
+        await asyncio.sleep(0)
+
+        status, cached = await coalescer.open("ci:tenant", "fp", upstream)
+        assert status == CACHE_HIT
+        assert await collect(cached) == EVENTS
+
+        status, _ = await coalescer.open("ci:other-tenant", "fp", upstream)
+        assert status == CACHE_MISS
+
+    @pytest.mark.asyncio
+    async def test_failed_analysis_is_not_cached(self):
+        async def upstream():
+            yield 'data: {"error": "Internal server error"}\n\n'
+            yield "data: [DONE]\n\n"
+
+        coalescer = CIAnalysisCoalescer(InMemoryResponseCache(), ttl=60)
+        _, stream = await coalescer.open("ci:tenant", "fp", upstream)
+        await collect(stream)
+        await asyncio.sleep(0)
+
+        status, _ = await coalescer.open("ci:tenant", "fp", upstream)
+        assert status == CACHE_MISS
@@ -0,0 +1,201 @@
+"""Unit tests for the database pools, read routing and connection class."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import asyncpg
+import pytest
+
+from baid_server.db import database
+from baid_server.db.database import (
+    POOL_ACQUIRE_TIMEOUTS,
+    POOL_ACQUIRE_WAIT,
+    POOL_CONNECTIONS,
+    QUERY_DURATION,
+    AppConnection,
+    MeteredPool,
+    get_read_pool,
+    pool_max_size,
+    reads,
+    writes,
+)
+from baid_server.utils.lazy import AsyncLazy
+
+
+@pytest.fixture
+def raw_pool():
+    pool = MagicMock()
+    pool.acquire = AsyncMock(return_value="connection")
+    pool.release = AsyncMock()
+    pool.get_size.return_value = 4
+    pool.get_idle_size.return_value = 1
+    return pool
+
+
+class UnconnectedAppConnection(AppConnection):
+    """AppConnection built without asyncpg's __init__; it has no socket to finalize."""
+
+    def __del__(self):
+        pass
+
+
+@pytest.fixture
+def connection():
+    conn = UnconnectedAppConnection.__new__(UnconnectedAppConnection)
+    conn._hot_statements = {}
+    return conn
+
+
+class TestPoolSizing:
+    """Test cases for pool_max_size."""
+
+    def test_budget_is_split_across_workers(self, monkeypatch):
+        monkeypatch.setattr(database.settings, "DB_POOL_MAX_SIZE", None)
+        monkeypatch.setattr(database.settings, "DB_MAX_CONNECTIONS", 20)
+        monkeypatch.setattr(database.settings, "WEB_CONCURRENCY", 4)
+        assert pool_max_size() == 5
+
+    def test_explicit_size_wins(self, monkeypatch):
+        monkeypatch.setattr(database.settings, "DB_POOL_MAX_SIZE", 7)
+        assert pool_max_size() == 7
+
+
+class TestMeteredPool:
+    """Test cases for the MeteredPool class."""
+
+    @pytest.mark.asyncio
+    async def test_acquire_records_wait_and_connections_in_use(self, raw_pool):
+        pool = MeteredPool(raw_pool)
+        waits = POOL_ACQUIRE_WAIT.count(pool="primary")
+
+        async with pool.acquire() as conn:
+            assert conn == "connection"
+            assert POOL_CONNECTIONS.value(pool="primary", state="in_use") == 3
+
+        raw_pool.release.assert_awaited_once_with("connection", timeout=None)
+        assert POOL_ACQUIRE_WAIT.count(pool="primary") == waits + 1
+
+    @pytest.mark.asyncio
+    async def test_acquire_timeout_is_counted(self, raw_pool):
+        raw_pool.acquire.side_effect = asyncio.TimeoutError
+        timeouts = POOL_ACQUIRE_TIMEOUTS.value(pool="replica")
+
+        with pytest.raises(asyncio.TimeoutError):
+            await MeteredPool(raw_pool, name="replica").acquire(timeout=0.1)
+        assert POOL_ACQUIRE_TIMEOUTS.value(pool="replica") == timeouts + 1
+
+    def test_other_attributes_pass_through(self, raw_pool):
+        assert MeteredPool(raw_pool).get_size() == 4
+
+
+class TestAppConnection:
+    """Test cases for the AppConnection class."""
+
+    @pytest.mark.asyncio
+    async def test_hot_query_uses_prepared_statement(self, connection, monkeypatch):
+        statement = MagicMock(fetchval=AsyncMock(return_value=42))
+        connection._hot_statements["SELECT 1 WHERE $1"] = statement
+        monkeypatch.setattr(asyncpg.Connection, "fetchval", AsyncMock())
+        selects = QUERY_DURATION.count(statement="select")
+
+        assert await connection.fetchval("SELECT 1 WHERE $1", "x") == 42
+        statement.fetchval.assert_awaited_once_with("x", column=0, timeout=None)
+        asyncpg.Connection.fetchval.assert_not_awaited()
+        assert QUERY_DURATION.count(statement="select") == selects + 1
+
+    @pytest.mark.asyncio
+    async def test_other_queries_use_statement_cache(self, connection, monkeypatch):
+        monkeypatch.setattr(asyncpg.Connection, "fetchval", AsyncMock(return_value=7))
+
+        assert await connection.fetchval("SELECT 2") == 7
+        asyncpg.Connection.fetchval.assert_awaited_once_with("SELECT 2", column=0, timeout=None)
+
+    @pytest.mark.asyncio
+    async def test_outdated_statement_falls_back(self, connection, monkeypatch):
+        statement = MagicMock(fetchrow=AsyncMock(side_effect=asyncpg.exceptions.InvalidCachedStatementError()))
+        connection._hot_statements["SELECT 3"] = statement
+        monkeypatch.setattr(asyncpg.Connection, "fetchrow", AsyncMock(return_value={"a": 1}))
+
+        assert await connection.fetchrow("SELECT 3") == {"a": 1}
+        assert "SELECT 3" not in connection._hot_statements
+
+
+class Repository:
+    """Minimal repository using the read routing decorators."""
+
+    @reads()
+    async def history(self, user_id):
+        return await get_read_pool()
+
+    @reads()
+    async def stream_history(self, user_id):
+        yield await get_read_pool()
+
+    @reads(scope="tenants")
+    async def tenants(self):
+        return await get_read_pool()
+
+    @writes()
+    async def store(self, user_id):
+        return await get_read_pool()
+
+
+class TestReadRouting:
+    """Test cases for routing reads to the replica."""
+
+    @pytest.fixture
+    def replica(self, monkeypatch):
+        replica = MagicMock()
+
+        async def create_replica():
+            return replica
+        monkeypatch.setattr(database, "replica_pool", AsyncLazy(create_replica, name="replica"))
+        database._recent_writes.clear()
+        yield replica
+        database._recent_writes.clear()
+
+    @pytest.mark.asyncio
+    async def test_reads_use_replica(self, replica):
+        repository = Repository()
+
+        assert await repository.history("alice") is replica
+        assert [pool async for pool in repository.stream_history("alice")] == [replica]
+        assert await repository.tenants() is replica
+
+    @pytest.mark.asyncio
+    async def test_read_generator_does_not_route_the_callers_queries(self, replica):
+        repository = Repository()
+        pools = repository.stream_history("alice")
+
+        assert await pools.__anext__() is replica
+        assert await get_read_pool() is None
+        # Finalizing from another task must not reset the caller's context
+        await asyncio.create_task(pools.aclose())
+
+    @pytest.mark.asyncio
+    async def test_unannotated_and_write_calls_use_primary(self, replica):
+        assert await get_read_pool() is None
+        assert await Repository().store("alice") is None
+
+    @pytest.mark.asyncio
+    async def test_reads_after_a_write_use_primary_for_that_key(self, replica):
+        repository = Repository()
+        await repository.store("alice")
+
+        assert await repository.history("alice") is None
+        assert await repository.history(user_id="bob") is replica
+
+    @pytest.mark.asyncio
+    async def test_unavailable_replica_falls_back_to_primary(self, monkeypatch):
+        async def fail():
+            raise ConnectionError("replica down")
+        monkeypatch.setattr(database, "replica_pool", AsyncLazy(fail, name="replica"))
+
+        assert await Repository().history("alice") is None
+
+    @pytest.mark.asyncio
+    async def test_no_replica_configured(self, monkeypatch):
+        monkeypatch.setattr(database.settings, "DB_REPLICA_URL", None)
+        monkeypatch.setattr(database.settings, "DB_REPLICA_CONNECTION_SECRET", None)
+        monkeypatch.setattr(database, "replica_pool", AsyncLazy(database._create_replica_pool, name="replica"))
+
+        assert await Repository().history("alice") is None
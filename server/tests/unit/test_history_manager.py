@@ -0,0 +1,115 @@
+"""Unit tests for conversation history management."""
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.services.history_manager import HistoryManager, plain_text, split_window, summarize, truncate_tokens
+from baid_server.utils.tokens import TokenCounter, count_tokens, set_token_counter
+
+
+def message(message_id, role, content):
+    return {"id": message_id, "role": role, "content": content}
+
+
+ANSWER = json.dumps({"response": {"content": {"blocks": [
+    {"type": "paragraph", "content": "Use a dict. It is faster."},
+    {"type": "code", "content": "d = {}"},
+]}}})
+
+
+class TestHistoryHelpers:
+    """Test cases for windowing and extractive summaries."""
+
+    def test_plain_text_of_block_response(self):
+        assert plain_text(ANSWER) == "Use a dict. It is faster. d = {}"
+        assert plain_text("  just text ") == "just text"
+
+    def test_window_keeps_newest_messages_within_budget(self):
+        messages = [message(i, "user", "word " * 10) for i in range(1, 6)]
+        older, recent = split_window(messages, window_tokens=30)
+        assert [m["id"] for m in older] == [1, 2, 3]
+        assert [m["id"] for m in recent] == [4, 5]
+
+        # The newest message is kept even when it alone exceeds the budget
+        older, recent = split_window(messages, window_tokens=1)
+        assert [m["id"] for m in recent] == [5]
+
+    def test_truncation_stays_within_the_configured_tokenizer_budget(self):
+        class CharacterTokenizer:
+            name = "characters"
+
+            def count_batch(self, texts):
+                return [len(text) for text in texts]
+
+        set_token_counter(TokenCounter(CharacterTokenizer()))
+        try:
+            text = "alpha beta gamma delta epsilon"
+            assert truncate_tokens(text, 20) == "alpha beta gamma ..."
+            assert count_tokens(truncate_tokens("x" * 100, 10)) <= 10
+            assert truncate_tokens(text, 100) == text
+        finally:
+            set_token_counter(None)
+
+    def test_summary_rolls_forward_and_stays_within_budget(self):
+        summary = summarize("", [message(1, "user", "How do I map keys? Thanks."), message(2, "assistant", ANSWER)], 100)
+        assert summary == "- user: How do I map keys?\n- assistant: Use a dict."
+
+        longer = summarize(summary, [message(3, "user", "And sets?")], max_tokens=10)
+        assert longer.splitlines()[-1] == "- user: And sets?"
+        assert "How do I map keys?" not in longer
+
+
+class TestHistoryManager:
+    """Test cases for agent session rotation."""
+
+    @pytest.fixture
+    def repositories(self):
+        messages = [message(i, "user" if i % 2 else "assistant", f"Turn {i} text here.") for i in range(1, 11)]
+        return {
+            "message_repository": MagicMock(get_messages_after=AsyncMock(return_value=messages)),
+            "session_repository": MagicMock(
+                get_agent_session=AsyncMock(return_value=("session", 50000)),
+                rotate_agent_session=AsyncMock(),
+            ),
+            "summary_repository": MagicMock(
+                get_latest_summary=AsyncMock(return_value=None),
+                store_summary=AsyncMock(),
+            ),
+        }
+
+    @pytest.mark.asyncio
+    async def test_within_budget_keeps_agent_session(self, repositories):
+        repositories["session_repository"].get_agent_session.return_value = ("agent-2", 100)
+        manager = HistoryManager(**repositories)
+        create = MagicMock()
+
+        agent_session = await manager.agent_session_for("user", "session", create)
+
+        assert (agent_session.agent_session_id, agent_session.carry_over) == ("agent-2", None)
+        create.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_over_budget_rotates_with_summary_and_window(self, repositories):
+        manager = HistoryManager(**repositories, agent_session_token_budget=32000, window_tokens=20)
+
+        agent_session = await manager.agent_session_for("user", "session", lambda: "agent-new")
+
+        assert agent_session.agent_session_id == "agent-new"
+        assert "- user: Turn 1 text here." in agent_session.carry_over
+        assert "assistant: Turn 10 text here." in agent_session.carry_over
+        stored = repositories["summary_repository"].store_summary.call_args.args
+        assert stored[3] == 7  # summarized up to the message before the window
+        repositories["session_repository"].rotate_agent_session.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_compaction_flushes_the_message_sink_first(self, repositories):
+        order = []
+        sink = MagicMock(flush=AsyncMock(side_effect=lambda: order.append("flush")))
+        repositories["message_repository"].get_messages_after.side_effect = \
+            lambda *args: order.append("read") or []
+        manager = HistoryManager(**repositories, message_sink=sink)
+
+        await manager.compact("user", "session")
+
+        assert order == ["flush", "read"]
@@ -0,0 +1,72 @@
+"""Unit tests for keyset pagination and streaming of session history."""
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.db.repositories.message_repository import MessageRepository
+from baid_server.utils.pagination import decode_cursor, encode_cursor
+
+TIMESTAMP = datetime(2025, 3, 1, 10, 22, 33, 123456, tzinfo=timezone.utc)
+
+
+def row(row_id):
+    return {"id": row_id, "role": "user", "content": f"message {row_id}", "timestamp": TIMESTAMP}
+
+
+class AsyncRows:
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestCursor:
+    """Test cases for pagination cursors."""
+
+    def test_round_trip(self):
+        assert decode_cursor(encode_cursor(TIMESTAMP, 42)) == (TIMESTAMP, 42)
+
+    def test_malformed_cursor(self):
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+
+class TestMessageRepositoryHistory:
+    """Test cases for history queries."""
+
+    @pytest.fixture
+    def conn(self):
+        connection = MagicMock()
+        connection.fetch = AsyncMock(return_value=[row(1), row(2)])
+        connection.cursor = MagicMock(return_value=AsyncRows([row(1), row(2), row(3)]))
+        connection.transaction = MagicMock(return_value=MagicMock(__aenter__=AsyncMock(), __aexit__=AsyncMock()))
+        return connection
+
+    @pytest.fixture
+    def repository(self, conn):
+        pool = MagicMock()
+        pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+        return MessageRepository(db_pool=pool)
+
+    @pytest.mark.asyncio
+    async def test_page_after_keyset_position(self, repository, conn):
+        history = await repository.get_session_history("user", "session", limit=2, after=(TIMESTAMP, 7))
+
+        assert [entry["id"] for entry in history] == [1, 2]
+        assert conn.fetch.call_args.args[1:] == ("user", "session", TIMESTAMP, 7, 2)
+
+    @pytest.mark.asyncio
+    async def test_stream_reads_through_cursor(self, repository, conn):
+        entries = [entry async for entry in repository.iter_session_history("user", "session", prefetch=50)]
+
+        assert [entry["message"] for entry in entries] == ["message 1", "message 2", "message 3"]
+        assert conn.cursor.call_args.kwargs == {"prefetch": 50}
+        conn.transaction.assert_called_once_with(readonly=True)
@@ -0,0 +1,107 @@
+"""Unit tests for the AsyncLazy class."""
+import asyncio
+
+import pytest
+
+from baid_server.utils.lazy import AsyncLazy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAsyncLazy:
+    """Test cases for the AsyncLazy class."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_creation(self):
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return object()
+
+        lazy = AsyncLazy(factory, name="resource")
+        values = await asyncio.gather(*(lazy.get() for _ in range(20)))
+
+        assert calls == 1
+        assert all(value is values[0] for value in values)
+        assert lazy.is_initialized
+
+    @pytest.mark.asyncio
+    async def test_failure_is_cached_until_backoff_passes(self):
+        clock = FakeClock()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise ConnectionError("database unavailable")
+            return "pool"
+
+        lazy = AsyncLazy(factory, name="pool", backoff=2.0, timer=clock)
+        with pytest.raises(ConnectionError):
+            await lazy.get()
+        clock.now = 1.0
+        with pytest.raises(ConnectionError):
+            await lazy.get()
+        assert calls == 1
+
+        clock.now = 2.5
+        assert await lazy.get() == "pool"
+        assert calls == 2
+
+    @pytest.mark.asyncio
+    async def test_backoff_doubles_up_to_limit(self):
+        clock = FakeClock()
+
+        async def factory():
+            raise ConnectionError("database unavailable")
+
+        lazy = AsyncLazy(factory, name="pool", backoff=1.0, max_backoff=3.0, timer=clock)
+        for expected in (1.0, 2.0, 3.0, 3.0):
+            with pytest.raises(ConnectionError):
+                await lazy.get()
+            assert lazy._retry_at == clock.now + expected
+            clock.now = lazy._retry_at
+
+    @pytest.mark.asyncio
+    async def test_reset_forces_new_creation(self):
+        values = iter(["first", "second"])
+
+        async def factory():
+            return next(values)
+
+        lazy = AsyncLazy(factory, name="service")
+        assert await lazy.get() == "first"
+        assert lazy.reset() == "first"
+        assert not lazy.is_initialized
+        assert await lazy.get() == "second"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_creation(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def factory():
+            started.set()
+            await release.wait()
+            return "service"
+
+        lazy = AsyncLazy(factory, name="service")
+        first = asyncio.ensure_future(lazy.get())
+        await started.wait()
+        second = asyncio.ensure_future(lazy.get())
+        first.cancel()
+        release.set()
+
+        assert await second == "service"
+        with pytest.raises(asyncio.CancelledError):
+            await first
@@ -0,0 +1,86 @@
+"""Unit tests for the maintenance of the messages partitions."""
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.db.repositories.message_repository import MessageRepository, _parse_partition_bound
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+def partition(name, bound):
+    return {"name": name, "bound": bound}
+
+
+@pytest.fixture
+def conn():
+    connection = MagicMock()
+    connection.fetch = AsyncMock(return_value=[
+        partition("messages_legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')"),
+        partition("messages_default", "DEFAULT"),
+        partition("messages_p202611", "FOR VALUES FROM ('2026-11-01 00:00:00+00') TO ('2026-12-01 00:00:00+00')"),
+    ])
+    connection.fetchval = AsyncMock(return_value=True)
+    connection.execute = AsyncMock()
+    connection.transaction = MagicMock(return_value=MagicMock(__aenter__=AsyncMock(), __aexit__=AsyncMock()))
+    return connection
+
+
+@pytest.fixture
+def pool(conn):
+    db_pool = MagicMock()
+    db_pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    return db_pool
+
+
+def executed(conn):
+    return [call.args[0] for call in conn.execute.call_args_list]
+
+
+class TestMessagePartitions:
+    """Test cases for the partition maintenance of MessageRepository."""
+
+    def test_partition_bounds_are_parsed(self):
+        assert _parse_partition_bound("FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00')") == (
+            None, datetime(2026, 11, 1, tzinfo=timezone.utc))
+        assert _parse_partition_bound("DEFAULT") is None
+
+    @pytest.mark.asyncio
+    async def test_only_missing_months_are_created(self, pool, conn):
+        created = await MessageRepository(db_pool=pool).ensure_partitions(conn, months_ahead=3, now=NOW)
+
+        assert created == 2
+        statements = executed(conn)
+        assert len(statements) == 6
+        assert statements[0] == 'CREATE TABLE "messages_p202612" (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        # Rows of the month that landed in the default partition move with it
+        assert "DELETE FROM messages_default" in statements[1]
+        assert "timestamp >= '2026-12-01T00:00:00+00:00' AND timestamp < '2027-01-01T00:00:00+00:00'" in statements[1]
+        assert 'INSERT INTO "messages_p202612" SELECT * FROM moved' in statements[1]
+        assert statements[2] == ('ALTER TABLE messages ATTACH PARTITION "messages_p202612" '
+                                 "FOR VALUES FROM ('2026-12-01T00:00:00+00:00') TO ('2027-01-01T00:00:00+00:00')")
+        assert statements[5] == ('ALTER TABLE messages ATTACH PARTITION "messages_p202701" '
+                                 "FOR VALUES FROM ('2027-01-01T00:00:00+00:00') TO ('2027-02-01T00:00:00+00:00')")
+        assert conn.transaction.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_expired_partitions_are_dropped_with_their_usage(self, pool, conn):
+        later = datetime(2026, 12, 15, tzinfo=timezone.utc)
+
+        dropped = await MessageRepository(db_pool=pool).drop_expired_partitions(conn, retention_days=30, now=later)
+
+        assert dropped == 1
+        statements = executed(conn)
+        assert 'FROM "messages_legacy"' in statements[0]
+        assert statements[1] == 'DROP TABLE "messages_legacy"'
+        conn.transaction.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_maintenance_is_skipped_while_another_instance_runs_it(self, pool, conn):
+        conn.fetchval.return_value = False
+
+        await MessageRepository(db_pool=pool).maintain_partitions(retention_days=30)
+
+        conn.fetch.assert_not_awaited()
+        conn.execute.assert_not_awaited()
@@ -0,0 +1,101 @@
+"""Unit tests for the write-behind message sink."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.services.message_sink import MessageSink
+
+
+@pytest.fixture
+def repository():
+    """Create a mock message repository recording flushed batches."""
+    return MagicMock(store_messages=AsyncMock())
+
+
+def flushed_contents(repository):
+    return [[row[3] for row in call.args[0]] for call in repository.store_messages.call_args_list]
+
+
+class TestMessageSink:
+    """Test cases for the MessageSink class."""
+
+    @pytest.mark.asyncio
+    async def test_flushes_when_batch_is_full(self, repository):
+        sink = MessageSink(repository, batch_size=2, flush_interval=10)
+        await sink.start()
+
+        await sink.enqueue("user", "session", "user", "first")
+        await sink.enqueue("user", "session", "assistant", "second")
+        await asyncio.sleep(0.01)
+
+        assert flushed_contents(repository) == [["first", "second"]]
+        await sink.stop()
+
+    @pytest.mark.asyncio
+    async def test_flushes_after_interval(self, repository):
+        sink = MessageSink(repository, batch_size=100, flush_interval=0.05)
+        await sink.start()
+
+        await sink.enqueue("user", "session", "user", "only")
+        await asyncio.sleep(0.01)
+        repository.store_messages.assert_not_called()
+
+        await asyncio.sleep(0.1)
+        assert flushed_contents(repository) == [["only"]]
+        await sink.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_drains_queue(self, repository):
+        sink = MessageSink(repository, batch_size=100, flush_interval=10)
+        await sink.start()
+
+        for i in range(3):
+            await sink.enqueue("user", "session", "user", f"message {i}")
+        await sink.stop()
+
+        assert flushed_contents(repository) == [["message 0", "message 1", "message 2"]]
+        assert not sink.is_running
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_queued_messages_now(self, repository):
+        sink = MessageSink(repository, batch_size=100, flush_interval=10)
+        await sink.start()
+
+        await sink.enqueue("user", "session", "user", "first")
+        await sink.enqueue("user", "session", "assistant", "second")
+        await asyncio.wait_for(sink.flush(), timeout=1)
+
+        assert flushed_contents(repository) == [["first", "second"]]
+        await asyncio.wait_for(sink.flush(), timeout=1)
+        assert repository.store_messages.await_count == 1
+        await sink.stop()
+
+    @pytest.mark.asyncio
+    async def test_writes_directly_when_not_running(self, repository):
+        sink = MessageSink(repository)
+
+        await sink.enqueue("user", "session", "user", "direct")
+
+        assert flushed_contents(repository) == [["direct"]]
+
+    @pytest.mark.asyncio
+    async def test_writes_directly_when_queue_is_full(self, repository):
+        sink = MessageSink(repository, max_queue_size=1, batch_size=100, flush_interval=10)
+        await sink.start()
+        # Keep the drain task from picking up the queued message
+        sink._queue.put_nowait(("user", "session", "user", "queued", None))
+
+        await sink.enqueue("user", "session", "user", "overflow")
+
+        assert flushed_contents(repository) == [["overflow"]]
+        await sink.stop()
+
+    @pytest.mark.asyncio
+    async def test_flush_errors_are_swallowed(self, repository):
+        repository.store_messages.side_effect = Exception("database down")
+        sink = MessageSink(repository)
+
+        await sink.enqueue("user", "session", "user", "lost")
+
+        repository.store_messages.assert_awaited_once()
@@ -0,0 +1,51 @@
+"""Unit tests for the metrics registry and the /metrics token check."""
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import SecretStr
+
+from baid_server.api.dependencies import verify_metrics_token
+from baid_server.utils.metrics import Counter, _Metric
+
+
+def bearer(token):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+class TestMetrics:
+    """Test cases for metric rendering."""
+
+    def test_counter_renders_labelled_samples(self):
+        counter = Counter("requests_total", "Requests.", ["tenant"])
+        counter.inc(tenant="a")
+        counter.inc(2, tenant="a")
+
+        assert counter.render().splitlines() == [
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{tenant="a"} 3.0',
+        ]
+
+    def test_metric_base_is_abstract(self):
+        with pytest.raises(TypeError):
+            _Metric("plain", "No samples.")
+
+
+class TestMetricsToken:
+    """Test cases for verify_metrics_token."""
+
+    @pytest.mark.asyncio
+    async def test_matching_token_is_accepted(self):
+        with patch("baid_server.api.dependencies.settings.METRICS_TOKEN", SecretStr("scrape")):
+            await verify_metrics_token(bearer("scrape"))
+            with pytest.raises(HTTPException) as error:
+                await verify_metrics_token(bearer("guess"))
+        assert error.value.status_code == 403
+
+    @pytest.mark.asyncio
+    async def test_no_configured_token_rejects_everyone(self):
+        with patch("baid_server.api.dependencies.settings.METRICS_TOKEN", None):
+            with pytest.raises(HTTPException):
+                await verify_metrics_token(bearer(""))
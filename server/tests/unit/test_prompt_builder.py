@@ -0,0 +1,68 @@
+"""Unit tests for prompt assembly."""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from baid_server.prompts.builder import (
+    CI_ANALYSIS, CI_ANALYSIS_INSTRUCTIONS, CONSULT_INSTRUCTIONS, INSTRUCTIONS_DEPLOYED, INSTRUCTIONS_EVERY_TURN,
+    PromptBuilder
+)
+from baid_server.services.ci_error_service import CIErrorService, CIErrorServiceConfig
+
+FILE_CONTEXT = {"is_open": True, "file_content": "class Foo: pass"}
+
+
+class TestPromptBuilder:
+    """Test cases for the PromptBuilder class."""
+
+    def test_instructions_are_a_stable_prefix_sent_once_per_session(self):
+        builder = PromptBuilder()
+        first = builder.consult_message("session", "Explain this", FILE_CONTEXT)
+        assert first.startswith(CONSULT_INSTRUCTIONS)
+        assert first.endswith("File content: class Foo: pass\nExplain this")
+
+        builder.mark_primed("session")
+        assert builder.consult_message("session", "And now?", {}) == "And now?"
+        assert builder.consult_message("other-session", "And now?", {}).startswith(CONSULT_INSTRUCTIONS)
+
+    def test_instruction_sets_are_primed_separately(self):
+        builder = PromptBuilder()
+        builder.mark_primed("session")
+        assert builder.needs_instructions("session", CI_ANALYSIS)
+        message = builder.ci_analysis_message("session", "pytest", "", "ImportError")
+        assert message.startswith(CI_ANALYSIS_INSTRUCTIONS) and "ImportError" in message
+
+    def test_modes(self):
+        deployed = PromptBuilder(mode=INSTRUCTIONS_DEPLOYED)
+        assert deployed.consult_message(None, "Hi", {}) == "Hi"
+
+        every_turn = PromptBuilder(mode=INSTRUCTIONS_EVERY_TURN)
+        every_turn.mark_primed("session")
+        assert every_turn.needs_instructions("session")
+
+        with pytest.raises(ValueError):
+            PromptBuilder(mode="sometimes")
+
+
+class TestCIAnalysisPriming:
+    """Test that a CI analysis primes its session for follow-ups."""
+
+    @pytest.mark.asyncio
+    async def test_successful_analysis_marks_session_primed(self):
+        builder = PromptBuilder()
+        with patch("baid_server.services.ci_error_service.ReasoningEngineExecutionServiceClient"):
+            service = CIErrorService(config=CIErrorServiceConfig(agent_engine_id="engine"), prompt_builder=builder)
+        service.get_agent = MagicMock()
+
+        async def blocks(event):
+            yield "data: {}\n\n"
+
+        with patch("baid_server.services.ci_error_service.parse_ci_response", return_value=[{}]), \
+                patch("baid_server.services.ci_error_service.CiResponseParser.process_incoming_chunk", blocks), \
+                patch("baid_server.services.ci_error_service.asyncio.sleep"):
+            prompt = builder.ci_analysis_message("session", "pytest", "", "ImportError")
+            events = [event async for event in service.analyze_error(prompt, "user", "session", "request")]
+
+        assert events[-1] == "data: [DONE]\n\n"
+        assert not builder.needs_instructions("session", CI_ANALYSIS)
+        assert builder.ci_analysis_message("session", "pytest", "", "ImportError").startswith("I'm facing an error")
@@ -0,0 +1,71 @@
+"""Unit tests for the RemoteSessionDeleter class."""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+from baid_server.services.agent_service import AgentService
+from baid_server.services.remote_session_deleter import RemoteSessionDeleter
+
+
+def deletion(deletion_id, agent_session_id, attempts=1):
+    return {"id": deletion_id, "user_id": "user", "agent_session_id": agent_session_id, "attempts": attempts}
+
+
+@pytest.fixture
+def repository():
+    repo = MagicMock()
+    repo.claim = AsyncMock(return_value=[deletion(1, "a"), deletion(2, "b", attempts=3)])
+    repo.complete = AsyncMock()
+    repo.retry_later = AsyncMock()
+    return repo
+
+
+class TestRemoteSessionDeleter:
+    """Test cases for the RemoteSessionDeleter class."""
+
+    @pytest.mark.asyncio
+    async def test_deleted_sessions_leave_the_queue(self, repository):
+        delete_session = AsyncMock()
+
+        assert await RemoteSessionDeleter(repository, delete_session).run_once() == 2
+
+        delete_session.assert_any_await("user", "a")
+        delete_session.assert_any_await("user", "b")
+        repository.complete.assert_awaited_once_with([1, 2])
+
+    @pytest.mark.asyncio
+    async def test_failures_are_retried_with_backoff(self, repository):
+        async def delete_session(user_id, agent_session_id):
+            if agent_session_id == "b":
+                raise RuntimeError("engine unavailable")
+
+        deleter = RemoteSessionDeleter(repository, delete_session, retry_delay=10.0)
+        assert await deleter.run_once() == 1
+
+        repository.complete.assert_awaited_once_with([1])
+        repository.retry_later.assert_awaited_once_with(2, "engine unavailable", 40.0)
+
+    @pytest.mark.asyncio
+    async def test_empty_queue(self, repository):
+        repository.claim.return_value = []
+
+        assert await RemoteSessionDeleter(repository, AsyncMock()).run_once() == 0
+        repository.complete.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_agent_service_deletion_is_awaited(self, repository):
+        session_service = MagicMock()
+        session_service.delete_session = AsyncMock(side_effect=[None, NotFound("gone")])
+        agent_service = SimpleNamespace(session_service=session_service,
+                                        config=SimpleNamespace(reasoning_engine_app_name="engine"))
+
+        async def delete_session(user_id, agent_session_id):
+            await AgentService.delete_session(agent_service, user_id, agent_session_id)
+
+        assert await RemoteSessionDeleter(repository, delete_session).run_once() == 2
+
+        session_service.delete_session.assert_any_await(app_name="engine", user_id="user", session_id="a")
+        assert session_service.delete_session.await_count == 2
+        repository.complete.assert_awaited_once_with([1, 2])
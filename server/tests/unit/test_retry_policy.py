@@ -0,0 +1,121 @@
+"""Unit tests for the shared agent engine retry policy."""
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.services.agent_service import AgentService, AgentConfig
+from baid_server.services.retry_policy import (
+    CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy, SentEventTracker
+)
+from baid_server.utils.stream_options import StreamFormat, StreamOptions
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def text_event(text):
+    return {"content": {"parts": [{"text": text}]}}
+
+
+class TestRetryPolicy:
+    """Test cases for backoff, retry budget and circuit breaker."""
+
+    def test_backoff_is_full_jitter_and_capped(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0, rng=lambda: 1.0)
+        assert [policy.backoff(attempt) for attempt in (1, 2, 3, 4)] == [2.0, 4.0, 5.0, 5.0]
+        assert RetryPolicy(rng=lambda: 0.0).backoff(3) == 0.0
+
+    def test_gives_up_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=2, rng=lambda: 0.5)
+        policy.begin()
+        assert policy.next_delay(1) == 1.0
+        assert policy.next_delay(2) is None
+
+    def test_budget_limits_retries_during_brownout(self):
+        policy = RetryPolicy(budget=RetryBudget(ratio=0.5, max_tokens=2), breaker=CircuitBreaker(failure_threshold=100))
+        retries = 0
+        for _ in range(10):
+            policy.begin()
+            if policy.next_delay(1) is not None:
+                retries += 1
+        # Two banked tokens, then one retry for every two requests
+        assert retries == 2 + 4
+
+    def test_circuit_opens_and_probes_after_timeout(self):
+        clock = FakeClock()
+        policy = RetryPolicy(breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30, timer=clock))
+        policy.begin()
+        assert policy.next_delay(1) is not None
+        assert policy.next_delay(2) is None
+        with pytest.raises(CircuitOpenError):
+            policy.begin()
+
+        clock.now = 30
+        policy.begin()  # half-open probe
+        with pytest.raises(CircuitOpenError):
+            policy.begin()
+        policy.record_success()
+        assert policy.breaker.state == CircuitBreaker.CLOSED
+
+    def test_abandoned_probe_does_not_block_the_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, probe_timeout=10, timer=clock)
+        breaker.record_failure()
+
+        clock.now = 30
+        assert breaker.allow_request()  # probe whose stream is then abandoned
+        assert not breaker.allow_request()
+
+        clock.now = 40
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+class TestSentEventTracker:
+    """Test cases for dedup of events regenerated by a retry."""
+
+    def test_suppresses_events_sent_by_earlier_attempts(self):
+        tracker = SentEventTracker()
+        assert [tracker.should_send(e) for e in ["a", "a", "b"]] == [True, True, True]
+        tracker.new_attempt()
+        assert [tracker.should_send(e) for e in ["a", "a", "a", "b", "c"]] == [False, False, True, False, True]
+
+
+class TestProcessQueryRetry:
+    """Test that process_query does not repeat content after a retry."""
+
+    @pytest.mark.asyncio
+    async def test_retry_does_not_duplicate_sent_chunks(self):
+        with patch("baid_server.services.agent_service.ReasoningEngineExecutionServiceClient"):
+            service = AgentService(
+                message_repository=MagicMock(store_message=AsyncMock()),
+                session_repository=MagicMock(session_exists=AsyncMock(return_value=True)),
+                response_processor=MagicMock(),
+                config=AgentConfig(agent_engine_id="engine"),
+                session_service=MagicMock(),
+                retry_policy=RetryPolicy(rng=lambda: 0.0),
+            )
+
+        def flaky_stream():
+            yield text_event("first")
+            raise ConnectionError("stream reset")
+
+        agent = MagicMock()
+        agent.stream_query.side_effect = [flaky_stream(), iter([text_event("first"), text_event("second")])]
+        service.get_agent = MagicMock(return_value=agent)
+
+        events = [event async for event in service.process_query(
+            user_id="user",
+            session_id="session",
+            user_input="question",
+            stream_options=StreamOptions(format=StreamFormat.RAW),
+        )]
+
+        assert events == ["data: first\n\n", "data: second\n\n", "data: [DONE]\n\n"]
+        assert agent.stream_query.call_count == 2
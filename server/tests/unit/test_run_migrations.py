@@ -0,0 +1,69 @@
+"""Unit tests for the migration runner script."""
+from unittest.mock import AsyncMock, MagicMock
+
+import asyncpg
+import pytest
+
+from scripts.run_migrations import is_up_to_date, load_migrations, verify_checksums
+
+
+def write(directory, name, sql="SELECT 1;"):
+    (directory / name).write_text(sql)
+
+
+class TestLoadMigrations:
+    """Test cases for reading the migration files."""
+
+    def test_repository_migrations_are_ordered_by_version(self):
+        filenames = [migration.filename for migration in load_migrations()]
+
+        assert filenames == sorted(filenames)
+        assert filenames.index("000004_add_tenants.sql") < filenames.index("000004_add_user_limits.sql")
+
+    def test_versions_sort_numerically(self, tmp_path):
+        write(tmp_path, "10_later.sql")
+        write(tmp_path, "9_earlier.sql")
+
+        assert [m.filename for m in load_migrations(tmp_path)] == ["9_earlier.sql", "10_later.sql"]
+
+    def test_new_duplicate_versions_are_rejected(self, tmp_path):
+        write(tmp_path, "000012_a.sql")
+        write(tmp_path, "000012_b.sql")
+
+        with pytest.raises(ValueError, match="000012"):
+            load_migrations(tmp_path)
+
+
+class TestMigrationState:
+    """Test cases for comparing the files with migration_history."""
+
+    @pytest.fixture
+    def migrations(self, tmp_path):
+        write(tmp_path, "000001_init.sql", "CREATE TABLE a (id INT);")
+        write(tmp_path, "000002_more.sql", "CREATE TABLE b (id INT);")
+        return load_migrations(tmp_path)
+
+    @pytest.mark.asyncio
+    async def test_up_to_date_is_one_query(self, migrations):
+        conn = MagicMock(fetchval=AsyncMock(return_value=2))
+
+        assert await is_up_to_date(conn, migrations)
+        conn.fetchval.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_missing_tracking_table_is_not_up_to_date(self, migrations):
+        conn = MagicMock(fetchval=AsyncMock(side_effect=asyncpg.exceptions.UndefinedTableError()))
+
+        assert not await is_up_to_date(conn, migrations)
+
+    @pytest.mark.asyncio
+    async def test_modified_migration_fails_verification(self, migrations):
+        conn = MagicMock(execute=AsyncMock())
+        applied = {"000001_init.sql": "0" * 64, "000002_more.sql": None}
+
+        assert not await verify_checksums(conn, migrations, applied)
+        # The checksum of a row recorded before checksums existed is filled in
+        conn.execute.assert_awaited_once_with(
+            'UPDATE migration_history SET checksum = $2 WHERE filename = $1',
+            "000002_more.sql", migrations[1].checksum
+        )
@@ -0,0 +1,186 @@
+"""Unit tests for session mapping caching and bulk deletion in SessionRepository."""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.db.repositories.session_repository import SessionRepository
+
+
+@pytest.fixture
+def conn():
+    """Create a mock database connection."""
+    connection = MagicMock()
+    connection.fetchval = AsyncMock(return_value=1)
+    connection.execute = AsyncMock()
+    connection.executemany = AsyncMock()
+    connection.transaction = MagicMock(return_value=MagicMock(__aenter__=AsyncMock(), __aexit__=AsyncMock()))
+    return connection
+
+
+@pytest.fixture
+def repository(conn):
+    """Create a SessionRepository backed by a mock pool with an empty cache."""
+    pool = MagicMock()
+    pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    SessionRepository.clear_cache()
+    yield SessionRepository(db_pool=pool)
+    SessionRepository.clear_cache()
+
+
+class TestSessionRepositoryCache:
+    """Test cases for the known-session cache."""
+
+    @pytest.mark.asyncio
+    async def test_session_exists_queries_once(self, repository, conn):
+        assert await repository.session_exists("user", "session")
+        assert await repository.session_exists("user", "session")
+
+        conn.fetchval.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_missing_session_is_not_cached(self, repository, conn):
+        conn.fetchval.return_value = None
+
+        assert not await repository.session_exists("user", "session")
+        assert not await repository.session_exists("user", "session")
+        assert conn.fetchval.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_known_mapping_is_touched_instead_of_upserted(self, repository, conn):
+        await repository.store_session_mapping("user", "session")
+        await repository.store_session_mapping("user", "session")
+
+        conn.execute.assert_awaited_once()
+        assert await repository.flush_session_touches() == 1
+        conn.executemany.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_touches_are_coalesced(self, repository, conn):
+        for _ in range(5):
+            repository.touch_session("user", "session")
+        repository.touch_session("user", "other")
+
+        assert await repository.flush_session_touches() == 2
+        assert await repository.flush_session_touches() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_touches(self, repository, conn):
+        repository.touch_session("user", "session")
+        conn.executemany.side_effect = ConnectionError("database down")
+        repository._db_pool.acquire.return_value.__aexit__.return_value = False  # do not swallow the error
+
+        with pytest.raises(ConnectionError):
+            await repository.flush_session_touches()
+
+        conn.executemany.side_effect = None
+        assert await repository.flush_session_touches() == 1
+
+    @pytest.mark.asyncio
+    async def test_delete_session_invalidates_cache(self, repository, conn):
+        assert await repository.session_exists("user", "session")
+        await repository.delete_session("user", "session")
+
+        conn.fetchval.return_value = None
+        assert not await repository.session_exists("user", "session")
+
+
+class TestAgentSessionCache:
+    """Test cases for the cached agent session and its batched token count."""
+
+    @pytest.mark.asyncio
+    async def test_steady_state_turns_need_no_query(self, repository, conn):
+        conn.fetchrow = AsyncMock(return_value={"agent_session_id": "agent", "agent_session_tokens": 100})
+
+        assert await repository.get_agent_session("user", "session") == ("agent", 100)
+        repository.add_agent_session_tokens("user", "session", 20)
+        repository.add_agent_session_tokens("user", "session", 30)
+        assert await repository.get_agent_session("user", "session") == ("agent", 150)
+
+        conn.fetchrow.assert_awaited_once()
+        conn.execute.assert_not_awaited()
+        assert await repository.flush_agent_session_tokens() == 1
+        assert conn.executemany.call_args.args[1] == [("user", "session", 50)]
+        assert await repository.flush_agent_session_tokens() == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_token_flush_keeps_increments(self, repository, conn):
+        repository.add_agent_session_tokens("user", "session", 20)
+        conn.executemany.side_effect = ConnectionError("database down")
+        repository._db_pool.acquire.return_value.__aexit__.return_value = False  # do not swallow the error
+
+        with pytest.raises(ConnectionError):
+            await repository.flush_agent_session_tokens()
+
+        repository.add_agent_session_tokens("user", "session", 5)
+        conn.executemany.side_effect = None
+        assert await repository.flush_agent_session_tokens() == 1
+        assert conn.executemany.call_args.args[1] == [("user", "session", 25)]
+
+    @pytest.mark.asyncio
+    async def test_rotation_replaces_cached_session_and_drops_old_tokens(self, repository, conn):
+        conn.fetchrow = AsyncMock(return_value={"agent_session_id": None, "agent_session_tokens": 40000})
+        await repository.get_agent_session("user", "session")
+        repository.add_agent_session_tokens("user", "session", 500)
+
+        conn.fetchval.return_value = "session"
+        await repository.rotate_agent_session("user", "session", "agent-2", 300)
+
+        assert await repository.get_agent_session("user", "session") == ("agent-2", 300)
+        assert await repository.flush_agent_session_tokens() == 0
+
+
+class TestBulkSessionDeletion:
+    """Test cases for SessionRepository.delete_sessions."""
+
+    @staticmethod
+    def session_row(user_id, session_id, agent_session_id=None):
+        return {"user_id": user_id, "session_id": session_id, "agent_session_id": agent_session_id or session_id}
+
+    @pytest.mark.asyncio
+    async def test_sessions_are_deleted_in_batches(self, repository, conn):
+        conn.fetch = AsyncMock(side_effect=[
+            [self.session_row("user", "a"), self.session_row("user", "b", "b-rotated")],
+            [self.session_row("user", "c")],
+        ])
+        conn.fetchval.return_value = 0
+
+        assert await repository.delete_sessions(user_id="user", batch_size=2, pause=0) == 3
+
+        assert conn.fetch.await_count == 2
+        assert conn.transaction.call_count == 2
+        enqueued = [call.args for call in conn.execute.call_args_list if "remote_session_deletions" in call.args[0]]
+        assert enqueued[0][1:] == (["user", "user", "user"], ["a", "b", "b-rotated"])
+        assert enqueued[1][1:] == (["user"], ["c"])
+
+    @pytest.mark.asyncio
+    async def test_deleted_sessions_leave_the_cache(self, repository, conn):
+        assert await repository.session_exists("user", "a")
+        conn.fetch = AsyncMock(return_value=[self.session_row("user", "a")])
+        conn.fetchval.return_value = 0
+
+        await repository.delete_sessions(user_id="user", batch_size=10)
+
+        conn.fetchval.return_value = None
+        assert not await repository.session_exists("user", "a")
+
+    @pytest.mark.asyncio
+    async def test_locked_sessions_are_retried_in_later_passes(self, repository, conn):
+        # The first pass skips a locked session, the second one deletes it
+        conn.fetch = AsyncMock(side_effect=[[self.session_row("user", "a")], [self.session_row("user", "b")]])
+        conn.fetchval.side_effect = [1, 0]
+
+        assert await repository.delete_sessions(user_id="user", batch_size=10, retry_delay=0) == 2
+        assert conn.fetch.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_passes_are_bounded(self, repository, conn):
+        conn.fetch = AsyncMock(return_value=[])
+        conn.fetchval.return_value = 1
+
+        assert await repository.delete_sessions(user_id="user", max_passes=3, retry_delay=0) == 0
+        assert conn.fetch.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_a_filter_is_required(self, repository):
+        with pytest.raises(ValueError):
+            await repository.delete_sessions()
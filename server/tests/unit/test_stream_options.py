@@ -0,0 +1,138 @@
+"""Unit tests for SSE stream format negotiation."""
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.services.agent_service import AgentService, AgentConfig
+from baid_server.utils.response_parser import ResponseParser
+from baid_server.utils.stream_options import CodeEncoding, StreamFormat, StreamOptions
+
+AGENT_TEXT = json.dumps({
+    "schema": "jetbrains-llm-response",
+    "version": "1.0",
+    "response": {
+        "type": "answer",
+        "metadata": {"model": "test", "timestamp": "2025-01-01T00:00:00Z"},
+        "content": {"blocks": [{"type": "paragraph", "content": "Hello"}]}
+    }
+})
+
+
+class TestStreamOptions:
+    """Test cases for StreamOptions negotiation."""
+
+    def test_defaults_to_blocks(self):
+        options = StreamOptions.negotiate({}, {})
+        assert options.format == StreamFormat.BLOCKS
+        assert options.includes_blocks and not options.includes_raw
+
+    def test_header_selects_format(self):
+        options = StreamOptions.negotiate({"X-Stream-Format": "raw"}, {})
+        assert options.format == StreamFormat.RAW
+
+    def test_query_param_takes_precedence(self):
+        options = StreamOptions.negotiate({"X-Stream-Format": "raw"}, {"stream_format": "Both"})
+        assert options.format == StreamFormat.BOTH
+        assert options.includes_blocks and options.includes_raw
+
+    def test_unknown_format_is_rejected(self):
+        with pytest.raises(ValueError):
+            StreamOptions.negotiate({}, {"stream_format": "xml"})
+
+    def test_code_encoding_defaults_to_base64(self):
+        assert StreamOptions.negotiate({}, {}).code_encoding == CodeEncoding.BASE64
+
+    def test_code_encoding_negotiated_by_header(self):
+        options = StreamOptions.negotiate({"X-Code-Encoding": "json"}, {})
+        assert options.code_encoding == CodeEncoding.JSON
+        assert options.response_headers()["X-Code-Encoding"] == "json"
+
+
+class TestCodeBlockEncoding:
+    """Test cases for code block content encoding."""
+
+    CODE_RESPONSE = {
+        "schema": "jetbrains-llm-response",
+        "version": "1.0",
+        "response": {
+            "type": "answer",
+            "metadata": {"model": "test", "timestamp": "2025-01-01T00:00:00Z"},
+            "content": {"blocks": [{"type": "code", "language": "python", "content": "print('hi')\n"}]}
+        }
+    }
+
+    async def _first_block(self, code_encoding):
+        async for sse_data in ResponseParser.process_incoming_chunk(self.CODE_RESPONSE, code_encoding):
+            return json.loads(sse_data[len("data: "):])
+
+    @pytest.mark.asyncio
+    async def test_base64_for_legacy_clients(self):
+        block = await self._first_block(CodeEncoding.BASE64)
+        assert block["content"] == "cHJpbnQoJ2hpJykK"
+        assert "encoding" not in block
+
+    @pytest.mark.asyncio
+    async def test_json_encoding_keeps_plain_content(self):
+        block = await self._first_block(CodeEncoding.JSON)
+        assert block["content"] == "print('hi')\n"
+        assert block["encoding"] == "json"
+
+
+class TestProcessQueryStreamFormat:
+    """Test that process_query only emits the negotiated payloads."""
+
+    @pytest.fixture
+    def agent_service(self):
+        with patch("baid_server.services.agent_service.ReasoningEngineExecutionServiceClient"):
+            service = AgentService(
+                message_repository=MagicMock(store_message=AsyncMock()),
+                session_repository=MagicMock(session_exists=AsyncMock(return_value=True)),
+                response_processor=MagicMock(),
+                config=AgentConfig(agent_engine_id="engine"),
+                session_service=MagicMock(),
+            )
+        agent = MagicMock()
+        agent.stream_query.return_value = iter([{"content": {"parts": [{"text": AGENT_TEXT}]}}])
+        service.get_agent = MagicMock(return_value=agent)
+        return service
+
+    async def _collect(self, service, stream_format):
+        events = []
+        async for event in service.process_query(
+                user_id="user",
+                session_id="session",
+                user_input="hi",
+                stream_options=StreamOptions(format=stream_format)
+        ):
+            events.append(event)
+        return events
+
+    @pytest.mark.asyncio
+    async def test_blocks_only_has_no_raw_text(self, agent_service):
+        events = await self._collect(agent_service, StreamFormat.BLOCKS)
+        assert events == [
+            'data: {"type": "paragraph", "content": "Hello"}\n\n',
+            "data: [DONE]\n\n",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_raw_only_has_no_blocks(self, agent_service):
+        events = await self._collect(agent_service, StreamFormat.RAW)
+        assert events == [f"data: {AGENT_TEXT}\n\n", "data: [DONE]\n\n"]
+
+    @pytest.mark.asyncio
+    async def test_multi_line_raw_text_stays_in_one_event(self, agent_service):
+        agent_service.get_agent().stream_query.return_value = iter([
+            {"content": {"parts": [{"text": "def f():\n\n    return 1"}]}}
+        ])
+        events = await self._collect(agent_service, StreamFormat.RAW)
+        assert events[0] == "data: def f():\ndata: \ndata:     return 1\n\n"
+        # Only the event terminator is a blank line
+        assert events[0].count("\n\n") == 1
+
+    @pytest.mark.asyncio
+    async def test_both_emits_blocks_then_raw(self, agent_service):
+        events = await self._collect(agent_service, StreamFormat.BOTH)
+        assert len(events) == 3
+        assert events[1] == f"data: {AGENT_TEXT}\n\n"
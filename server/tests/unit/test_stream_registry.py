@@ -0,0 +1,109 @@
+"""Unit tests for resumable SSE streams."""
+import asyncio
+
+import pytest
+
+from baid_server.services.stream_registry import StreamRegistry
+
+EVENTS = ['data: {"type": "text", "content": "a"}\n\n', 'data: {"type": "text", "content": "b"}\n\n',
+          "data: [DONE]\n\n"]
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+class TestStreamRegistry:
+    """Test cases for the StreamRegistry class."""
+
+    @pytest.mark.asyncio
+    async def test_events_are_numbered(self):
+        async def upstream():
+            for event in EVENTS:
+                yield event
+
+        registry = StreamRegistry()
+        stream = registry.start("user-1", upstream())
+
+        assert await collect(StreamRegistry.events(stream)) == [
+            f"id: {index}\n{event}" for index, event in enumerate(EVENTS)
+        ]
+
+    @pytest.mark.asyncio
+    async def test_resume_replays_after_last_event_and_follows_upstream(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            yield EVENTS[0]
+            yield EVENTS[1]
+            await release.wait()
+            yield EVENTS[2]
+
+        registry = StreamRegistry()
+        stream = registry.start("user-1", upstream())
+        first = StreamRegistry.events(stream)
+        assert await first.__anext__() == f"id: 0\n{EVENTS[0]}"
+        await first.aclose()  # client drops the connection
+
+        resumed = registry.get(stream.stream_id, "user-1")
+        release.set()
+
+        assert await collect(StreamRegistry.events(resumed, last_event_id=0)) == [
+            f"id: 1\n{EVENTS[1]}", f"id: 2\n{EVENTS[2]}"
+        ]
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_streams_are_private_and_expire(self):
+        async def upstream():
+            yield EVENTS[-1]
+
+        registry = StreamRegistry(replay_ttl=0)
+        stream = registry.start("user-1", upstream())
+
+        assert registry.get(stream.stream_id, "user-2") is None
+        assert registry.get(stream.stream_id, "user-1") is stream
+
+        await stream.broadcast.wait()
+        await asyncio.sleep(0)
+        assert registry.get(stream.stream_id, "user-1") is None
+
+    @pytest.mark.asyncio
+    async def test_evicted_stream_releases_its_source(self):
+        closed = []
+
+        async def upstream():
+            try:
+                yield EVENTS[0]
+                await asyncio.Event().wait()
+            finally:
+                closed.append(1)
+
+        registry = StreamRegistry(max_streams=1)
+        first = registry.start("user-1", upstream())
+        await asyncio.sleep(0)
+        registry.start("user-1", upstream())
+
+        await first.broadcast.wait()
+        assert closed == [1]
+        assert first.broadcast.events == [EVENTS[0]]
+
+    @pytest.mark.asyncio
+    async def test_stream_stops_after_max_duration(self):
+        closed = []
+
+        async def upstream():
+            try:
+                yield EVENTS[0]
+                await asyncio.Event().wait()
+            finally:
+                closed.append(1)
+
+        registry = StreamRegistry(max_duration=0.01)
+        stream = registry.start("user-1", upstream())
+
+        await asyncio.wait_for(stream.broadcast.wait(), timeout=1)
+        assert closed == [1]
+        assert isinstance(stream.broadcast.error, TimeoutError)
@@ -1,100 +1,119 @@
 """Unit tests for the token limit middleware."""
+import json
+
 import pytest
-import pytest_asyncio
-from unittest.mock import patch, AsyncMock, MagicMock
-from fastapi import HTTPException, Request
-from fastapi.responses import JSONResponse
+from unittest.mock import AsyncMock
 
 from baid_server.api.middleware.token_limit_middleware import TokenLimitMiddleware
 
 
+def make_scope(path="/api/consult", user={"sub": "test_user_id"}):
+    scope = {"type": "http", "method": "POST", "path": path, "headers": [], "state": {}}
+    if user is not None:
+        scope["state"]["user"] = user
+    return scope
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+class StreamingApp:
+    """ASGI app streaming a few SSE chunks, recording the scope it was called with."""
+
+    def __init__(self):
+        self.scope = None
+
+    async def __call__(self, scope, receive, send):
+        self.scope = scope
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        for index in range(3):
+            await send({"type": "http.response.body", "body": f"data: {index}\n\n".encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
 class TestTokenLimitMiddleware:
     """Test cases for the TokenLimitMiddleware class."""
 
     @pytest.fixture
-    def middleware(self):
+    def app(self):
+        return StreamingApp()
+
+    @pytest.fixture
+    def middleware(self, app):
         """Create a TokenLimitMiddleware instance for testing."""
-        mock_app = MagicMock()
-        middleware = TokenLimitMiddleware(app=mock_app)
+        middleware = TokenLimitMiddleware(app=app)
         # Mock the _check_user_limits method to avoid database calls
         middleware._check_user_limits = AsyncMock()
         return middleware
 
     @pytest.fixture
-    def mock_request(self):
-        """Create a mock request for testing."""
-        request = MagicMock(spec=Request)
-        request.url.path = "/api/consult"
-        request.state = MagicMock()
-        request.state.user = {"sub": "test_user_id"}
-        return request
+    def sent(self):
+        return []
 
     @pytest.fixture
-    def mock_call_next(self):
-        """Create a mock call_next function for testing."""
-        async def call_next_mock(request):
-            return JSONResponse(content={"status": "success"})
-        return call_next_mock
+    def send(self, sent):
+        async def send_mock(message):
+            sent.append(message)
+        return send_mock
 
     @pytest.mark.asyncio
-    async def test_allowed_request(self, middleware, mock_request, mock_call_next):
+    async def test_allowed_request(self, middleware, app, send, sent):
         """Test that a request is allowed when user is not restricted and under token limit."""
-        # Configure the mock to return values indicating user is not restricted and under limit
         middleware._check_user_limits.return_value = (False, 5000, 10000)  # (is_restricted, token_usage, token_limit)
-        
-        # Execute middleware
-        response = await middleware.dispatch(mock_request, mock_call_next)
-        
-        # Verify response
-        assert response.status_code == 200
+
+        await middleware(make_scope(), receive, send)
+
         middleware._check_user_limits.assert_called_once_with("test_user_id")
-        assert "token_info" in mock_request.state.__dict__
-        assert mock_request.state.token_info["usage"] == 5000
-        assert mock_request.state.token_info["limit"] == 10000
+        assert sent[0]["status"] == 200
+        assert app.scope["state"]["token_info"] == {"usage": 5000, "limit": 10000}
 
     @pytest.mark.asyncio
-    async def test_restricted_user(self, middleware, mock_request, mock_call_next):
+    async def test_stream_is_passed_through_untouched(self, middleware, send, sent):
+        """Test that every SSE chunk reaches the server as the app sent it."""
+        middleware._check_user_limits.return_value = (False, 5000, 10000)
+
+        await middleware(make_scope(), receive, send)
+
+        assert [message.get("body") for message in sent[1:]] == [b"data: 0\n\n", b"data: 1\n\n", b"data: 2\n\n", b""]
+
+    @pytest.mark.asyncio
+    async def test_restricted_user(self, middleware, app, send, sent):
         """Test that a request is rejected when user is restricted."""
-        # Configure the mock to return values indicating user is restricted
         middleware._check_user_limits.return_value = (True, 5000, 10000)  # (is_restricted, token_usage, token_limit)
-        
-        # Execute middleware and expect exception
-        with pytest.raises(HTTPException) as excinfo:
-            await middleware.dispatch(mock_request, mock_call_next)
-        
-        # Verify exception
+
+        await middleware(make_scope(), receive, send)
+
         middleware._check_user_limits.assert_called_once_with("test_user_id")
-        assert excinfo.value.status_code == 403
-        assert "restricted" in excinfo.value.detail
+        assert sent[0]["status"] == 403
+        assert "restricted" in json.loads(sent[1]["body"])["detail"]
+        assert app.scope is None
 
     @pytest.mark.asyncio
-    async def test_token_limit_exceeded(self, middleware, mock_request, mock_call_next):
+    async def test_token_limit_exceeded(self, middleware, app, send, sent):
         """Test that a request is rejected when user exceeds token limit."""
-        # Configure the mock to return values indicating user is over their token limit
         middleware._check_user_limits.return_value = (False, 12000, 10000)  # (is_restricted, token_usage, token_limit)
-        
-        # Execute middleware and expect exception
-        with pytest.raises(HTTPException) as excinfo:
-            await middleware.dispatch(mock_request, mock_call_next)
-        
-        # Verify exception
+
+        await middleware(make_scope(), receive, send)
+
         middleware._check_user_limits.assert_called_once_with("test_user_id")
-        assert excinfo.value.status_code == 429
-        assert "token limit" in excinfo.value.detail
+        assert sent[0]["status"] == 429
+        assert "token limit" in json.loads(sent[1]["body"])["detail"]
+        assert app.scope is None
 
     @pytest.mark.asyncio
-    async def test_non_consult_endpoint(self, middleware, mock_call_next):
+    async def test_non_consult_endpoint(self, middleware, send, sent):
         """Test that middleware doesn't check token limits for non-consult endpoints."""
-        # Create request for a different endpoint
-        request = MagicMock(spec=Request)
-        request.url.path = "/api/some-other-endpoint"
-        request.state = MagicMock()
-        request.state.user = {"sub": "test_user_id"}
-        
-        # Execute middleware
-        response = await middleware.dispatch(request, mock_call_next)
-        
-        # Verify response and that token check was not called
-        assert response.status_code == 200
+        await middleware(make_scope(path="/api/some-other-endpoint"), receive, send)
+
+        assert sent[0]["status"] == 200
         middleware._check_user_limits.assert_not_called()
 
+    @pytest.mark.asyncio
+    async def test_anonymous_request(self, middleware, send, sent):
+        """Test that requests without a user in state are not checked."""
+        await middleware(make_scope(user=None), receive, send)
+
+        assert sent[0]["status"] == 200
+        middleware._check_user_limits.assert_not_called()
@@ -0,0 +1,63 @@
+"""Unit tests for the per-user token usage counters."""
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.db.repositories.message_repository import MessageRepository
+from baid_server.db.repositories.token_usage_repository import TokenUsageRepository
+from baid_server.utils.tokens import estimate_tokens
+
+
+@pytest.fixture
+def conn():
+    connection = MagicMock()
+    connection.fetchval = AsyncMock(return_value=1234)
+    connection.execute = AsyncMock()
+    connection.executemany = AsyncMock()
+    connection.transaction = MagicMock(return_value=MagicMock(__aenter__=AsyncMock(), __aexit__=AsyncMock()))
+    return connection
+
+
+@pytest.fixture
+def pool(conn):
+    db_pool = MagicMock()
+    db_pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    TokenUsageRepository.clear_cache()
+    yield db_pool
+    TokenUsageRepository.clear_cache()
+
+
+class TestTokenUsageRepository:
+    """Test cases for the TokenUsageRepository class."""
+
+    @pytest.mark.asyncio
+    async def test_batch_is_aggregated_per_user(self, pool, conn):
+        first = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        second = datetime(2025, 1, 2, tzinfo=timezone.utc)
+        await MessageRepository(db_pool=pool).store_messages([
+            ("bob", "s1", "user", "Hello there.", first),
+            ("alice", "s2", "user", "Hi!", first),
+            ("bob", "s1", "assistant", "General Kenobi.", second),
+        ])
+
+        counters = conn.executemany.call_args_list[-1].args[1]
+        assert counters == [
+            ("alice", estimate_tokens("Hi!"), 1, first),
+            ("bob", estimate_tokens("Hello there.") + estimate_tokens("General Kenobi."), 2, second),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_single_message_updates_counter_in_same_transaction(self, pool, conn):
+        await MessageRepository(db_pool=pool).store_message("bob", "s1", "user", "Hello there.")
+
+        conn.transaction.assert_called_once()
+        assert conn.executemany.call_args.args[1] == [("bob", estimate_tokens("Hello there."), 1, None)]
+
+    @pytest.mark.asyncio
+    async def test_usage_lookup_is_cached(self, pool, conn):
+        repository = TokenUsageRepository(db_pool=pool)
+        assert await repository.get_token_usage("bob") == 1234
+        assert await repository.get_token_usage("bob") == 1234
+
+        conn.fetchval.assert_awaited_once()
@@ -0,0 +1,100 @@
+"""Unit tests for token counting."""
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from baid_server.utils.tokens import (
+    HeuristicTokenizer,
+    TokenCounter,
+    VertexTokenizer,
+    count_tokens_batch_async,
+    create_tokenizer,
+    estimate_tokens,
+    set_token_counter,
+)
+
+
+class RecordingTokenizer:
+    """Counts characters and records every batch it is asked to count."""
+    name = "recording"
+
+    def __init__(self):
+        self.batches = []
+
+    def count_batch(self, texts):
+        self.batches.append(list(texts))
+        return [len(text) for text in texts]
+
+
+class TestTokenCounter:
+    """Test cases for the TokenCounter class."""
+
+    def test_batch_reaches_tokenizer_in_one_call(self):
+        tokenizer = RecordingTokenizer()
+        counter = TokenCounter(tokenizer, min_memo_length=0)
+
+        assert counter.count_batch(["a", "bb", "ccc"]) == [1, 2, 3]
+        assert tokenizer.batches == [["a", "bb", "ccc"]]
+
+    def test_repeated_content_is_memoized(self):
+        tokenizer = RecordingTokenizer()
+        counter = TokenCounter(tokenizer, min_memo_length=0)
+        counter.count_batch(["a", "bb"])
+
+        assert counter.count_batch(["bb", "dddd", "a"]) == [2, 4, 1]
+        assert tokenizer.batches[-1] == ["dddd"]
+
+    def test_short_texts_are_not_memoized(self):
+        tokenizer = RecordingTokenizer()
+        counter = TokenCounter(tokenizer, min_memo_length=10)
+        counter.count("short")
+        counter.count("short")
+
+        assert tokenizer.batches == [["short"], ["short"]]
+
+    @pytest.mark.asyncio
+    async def test_model_tokenizer_runs_off_the_event_loop(self):
+        threads = []
+
+        class ThreadRecordingTokenizer(RecordingTokenizer):
+            def count_batch(self, texts):
+                threads.append(threading.current_thread())
+                return super().count_batch(texts)
+
+        set_token_counter(TokenCounter(ThreadRecordingTokenizer()))
+        try:
+            assert await count_tokens_batch_async(["a", "bb"]) == [1, 2]
+        finally:
+            set_token_counter(None)
+        assert threads and threads[0] is not threading.current_thread()
+
+    def test_heuristic_matches_estimate(self):
+        text = "def add(a, b):\n    return a + b"
+        assert TokenCounter(HeuristicTokenizer()).count(text) == estimate_tokens(text)
+
+
+class TestTokenizers:
+    """Test cases for tokenizer selection."""
+
+    def test_unknown_tokenizer_is_rejected(self):
+        with pytest.raises(ValueError):
+            create_tokenizer("bpe")
+
+    def test_unavailable_model_tokenizer_falls_back(self, monkeypatch):
+        def fail(self, model_name):
+            raise ImportError("No module named 'sentencepiece'")
+        monkeypatch.setattr(VertexTokenizer, "__init__", fail)
+
+        assert isinstance(create_tokenizer("vertex:gemini-1.5-flash-002"), HeuristicTokenizer)
+
+    def test_vertex_tokenizer_skips_empty_texts(self):
+        tokenizer = VertexTokenizer.__new__(VertexTokenizer)
+        tokenizer._tokenizer = MagicMock()
+        tokenizer._tokenizer.compute_tokens.return_value = SimpleNamespace(tokens_info=[
+            SimpleNamespace(token_ids=[1, 2]), SimpleNamespace(token_ids=[3]),
+        ])
+
+        assert tokenizer.count_batch(["hello world", "", "!"]) == [2, 0, 1]
+        tokenizer._tokenizer.compute_tokens.assert_called_once_with(["hello world", "!"])
@@ -0,0 +1,97 @@
+"""Unit tests for the upstream scheduler and metrics."""
+import asyncio
+
+import pytest
+
+from baid_server.services.upstream_scheduler import SchedulerRejected, UpstreamScheduler, parse_tenant_weights
+from baid_server.utils.metrics import MetricsRegistry
+
+
+def scheduler(**kwargs) -> UpstreamScheduler:
+    kwargs.setdefault("registry", MetricsRegistry())
+    return UpstreamScheduler(**kwargs)
+
+
+class TestUpstreamScheduler:
+    """Test cases for the UpstreamScheduler class."""
+
+    @pytest.mark.asyncio
+    async def test_per_user_and_per_tenant_caps(self):
+        upstream = scheduler(max_concurrency=10, per_tenant_limit=2, per_user_limit=1)
+        first = upstream.submit("tenant", "alice")
+        second_alice = upstream.submit("tenant", "alice")
+        bob = upstream.submit("tenant", "bob")
+        carol = upstream.submit("tenant", "carol")
+
+        # Alice's second call does not block Bob; the tenant cap holds Carol back
+        assert (first.granted, second_alice.granted, bob.granted, carol.granted) == (True, False, True, False)
+
+        upstream.release(first)
+        assert second_alice.granted and not carol.granted
+
+    @pytest.mark.asyncio
+    async def test_weighted_fair_queuing_across_tenants(self):
+        upstream = scheduler(max_concurrency=1, per_tenant_limit=10, per_user_limit=10,
+                             tenant_weights={"big": 2.0})
+        holder = upstream.submit("other", "u0")
+        tickets = [upstream.submit("big", f"b{i}") for i in range(4)] + \
+                  [upstream.submit("small", f"s{i}") for i in range(2)]
+
+        order = []
+        current = holder
+        for _ in tickets:
+            upstream.release(current)
+            current = next(t for t in tickets if t.granted and not t.released)
+            order.append(current.tenant_key)
+
+        assert order == ["big", "small", "big", "big", "small", "big"]
+
+    @pytest.mark.asyncio
+    async def test_rejects_with_retry_after_when_queue_is_full(self):
+        upstream = scheduler(max_concurrency=1, max_queue_depth=2, service_time_estimate=4.0)
+        upstream.submit("a", "u1")
+        upstream.submit("b", "u2")
+        upstream.submit("c", "u3")
+
+        with pytest.raises(SchedulerRejected) as exc_info:
+            upstream.submit("d", "u4")
+        assert exc_info.value.retry_after == 12
+
+    @pytest.mark.asyncio
+    async def test_stream_holds_slot_until_done_and_times_out_waiters(self):
+        upstream = scheduler(max_concurrency=1, queue_timeout=0.01)
+        release = asyncio.Event()
+
+        async def source():
+            await release.wait()
+            yield "data: [DONE]\n\n"
+
+        first = upstream.stream(upstream.submit("a", "u1"), source())
+        waiting = upstream.stream(upstream.submit("b", "u2"), source())
+        assert upstream.in_flight == 1 and upstream.queued == 1
+
+        # The second caller gives up in the queue while the first holds the only slot
+        assert (await waiting.__anext__()).startswith('data: {"error"')
+        await waiting.aclose()
+        assert upstream.queued == 0
+
+        release.set()
+        assert [event async for event in first] == ["data: [DONE]\n\n"]
+        assert upstream.in_flight == 0
+
+    def test_parse_tenant_weights(self):
+        assert parse_tenant_weights("a=2, b=0.5,") == {"a": 2.0, "b": 0.5}
+
+
+class TestMetricsRegistry:
+    """Test cases for the Prometheus text rendering."""
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests", ["outcome"]).inc(outcome="ok")
+        registry.histogram("wait_seconds", "Wait", buckets=(1,)).observe(0.5)
+
+        text = registry.render()
+        assert 'requests_total{outcome="ok"} 1.0' in text
+        assert 'wait_seconds_bucket{le="+Inf"} 1' in text
+        assert registry.counter("requests_total", "Requests", ["outcome"]).value(outcome="ok") == 1.0
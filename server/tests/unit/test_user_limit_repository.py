@@ -0,0 +1,93 @@
+"""Unit tests for the cached user limit lookups."""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.db.repositories.user_limit_repository import (
+    ALL_USERS,
+    DEFAULT_TOKEN_LIMIT,
+    LIMITS_CHANNEL,
+    UserLimitRepository,
+)
+
+
+@pytest.fixture
+def conn():
+    connection = MagicMock()
+    connection.fetchrow = AsyncMock(return_value={"status": "active", "user_limit": None, "default_limit": "50000"})
+    connection.execute = AsyncMock()
+    connection.add_listener = AsyncMock()
+    connection.remove_listener = AsyncMock()
+    connection.is_closed.return_value = False
+    return connection
+
+
+@pytest.fixture
+def pool(conn):
+    db_pool = MagicMock()
+    db_pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    UserLimitRepository.clear_cache()
+    yield db_pool
+    UserLimitRepository.clear_cache()
+
+
+class TestUserLimitRepository:
+    """Test cases for the UserLimitRepository class."""
+
+    @pytest.mark.asyncio
+    async def test_limits_come_from_one_query(self, pool, conn):
+        repository = UserLimitRepository(db_pool=pool)
+        assert await repository.get_limits("bob") == (False, 50000)
+        conn.fetchrow.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_user_limit_overrides_default(self, pool, conn):
+        conn.fetchrow.return_value = {"status": "Restricted", "user_limit": "2000", "default_limit": "50000"}
+        assert await UserLimitRepository(db_pool=pool).get_limits("bob") == (True, 2000)
+
+    @pytest.mark.asyncio
+    async def test_missing_settings_use_builtin_default(self, pool, conn):
+        conn.fetchrow.return_value = {"status": None, "user_limit": None, "default_limit": None}
+        assert await UserLimitRepository(db_pool=pool).get_limits("bob") == (False, DEFAULT_TOKEN_LIMIT)
+
+    @pytest.mark.asyncio
+    async def test_limits_are_cached_until_notified(self, pool, conn):
+        repository = UserLimitRepository(db_pool=pool)
+        await repository.get_limits("bob")
+        await repository.get_limits("bob")
+        assert conn.fetchrow.await_count == 1
+
+        repository._on_notification(conn, 1, LIMITS_CHANNEL, "bob")
+        await repository.get_limits("bob")
+        assert conn.fetchrow.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_default_limit_change_clears_every_user(self, pool, conn):
+        repository = UserLimitRepository(db_pool=pool)
+        await repository.get_limits("alice")
+        await repository.get_limits("bob")
+
+        await UserLimitRepository.notify_changed(conn, ALL_USERS)
+
+        conn.execute.assert_awaited_once_with("SELECT pg_notify($1, $2)", LIMITS_CHANNEL, ALL_USERS)
+        await repository.get_limits("alice")
+        await repository.get_limits("bob")
+        assert conn.fetchrow.await_count == 4
+
+    @pytest.mark.asyncio
+    async def test_listen_holds_one_connection(self, conn):
+        db_pool = MagicMock()
+        db_pool.acquire = AsyncMock(return_value=conn)
+        db_pool.release = AsyncMock()
+        repository = UserLimitRepository(db_pool=db_pool)
+
+        await repository.listen()
+        await repository.listen()
+
+        db_pool.acquire.assert_awaited_once()
+        conn.add_listener.assert_awaited_once_with(LIMITS_CHANNEL, repository._on_notification)
+        assert repository.is_listening
+
+        await repository.unlisten()
+        db_pool.release.assert_awaited_once_with(conn)
+        assert not repository.is_listening
@@ -0,0 +1,83 @@
+"""Unit tests for the users dashboard."""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from baid_server.api.routes.users import stream_users_html, templates
+from baid_server.db.repositories.user_repository import UserRepository
+
+
+def dashboard_row(**values):
+    row = {"default_token_limit": 50000, "default_token_limit_updated": None, "total": 2, "id": None}
+    row.update(values)
+    return row
+
+
+@pytest.fixture
+def conn():
+    connection = MagicMock()
+    connection.fetch = AsyncMock(return_value=[
+        dashboard_row(id=2, email="bob@example.com", token_count=900, token_limit=1000),
+        dashboard_row(id=1, email="alice@example.com", token_count=10, token_limit=50000),
+    ])
+    return connection
+
+
+@pytest.fixture
+def pool(conn):
+    db_pool = MagicMock()
+    db_pool.acquire.return_value = MagicMock(__aenter__=AsyncMock(return_value=conn), __aexit__=AsyncMock())
+    return db_pool
+
+
+class TestUsersDashboard:
+    """Test cases for UserRepository.get_dashboard_page."""
+
+    @pytest.mark.asyncio
+    async def test_page_comes_from_one_query(self, pool, conn):
+        dashboard = await UserRepository(db_pool=pool).get_dashboard_page(limit=2, offset=4, sort="usage")
+
+        conn.fetch.assert_awaited_once()
+        query, limit, offset = conn.fetch.call_args.args
+        assert (limit, offset) == (2, 4)
+        assert "ORDER BY token_ratio DESC" in query
+        assert dashboard["total"] == 2
+        assert dashboard["default_token_limit"] == 50000
+        assert [user["email"] for user in dashboard["users"]] == ["bob@example.com", "alice@example.com"]
+
+    @pytest.mark.asyncio
+    async def test_page_past_the_end_keeps_defaults(self, pool, conn):
+        conn.fetch.return_value = [dashboard_row()]
+
+        dashboard = await UserRepository(db_pool=pool).get_dashboard_page(offset=100, sort="email", descending=False)
+
+        assert "ORDER BY email ASC" in conn.fetch.call_args.args[0]
+        assert dashboard["users"] == []
+        assert dashboard["default_token_limit"] == 50000
+
+    @pytest.mark.asyncio
+    async def test_unknown_sort_is_rejected(self, pool):
+        with pytest.raises(KeyError):
+            await UserRepository(db_pool=pool).get_dashboard_page(sort="content; DROP TABLE users")
+
+
+class TestUsersDashboardTemplate:
+    """Test cases for rendering the users dashboard."""
+
+    users = [{
+        "id": index, "email": f"user{index}@example.com", "name": None, "picture": None,
+        "last_active_relative": "Never", "status": "active", "message_count": index,
+        "token_count": index * 10, "token_limit": 1000, "token_percentage": index,
+    } for index in range(200)]
+    pagination = {"page": 1, "page_size": 200, "total": 200, "pages": 1, "sort": "created_at", "order": "desc"}
+
+    def test_template_is_compiled_once(self):
+        assert templates.get_template("users/dashboard.html") is templates.get_template("users/dashboard.html")
+
+    def test_streamed_html_matches_rendered_html(self):
+        chunks = list(stream_users_html(self.users, 1000, self.pagination))
+
+        assert len(chunks) > 1
+        assert "".join(chunks) == templates.get_template("users/dashboard.html").render(
+            users=self.users, default_token_limit=1000, pagination=self.pagination
+        )